@@ -0,0 +1,11 @@
+// Timestamp service used for Payment and PaymentRequest timestamps.
+// Regenerate the Python package with: thrift --gen py -out . TimestampService.thrift
+
+service TimestampService {
+    // Current server time as "YYYY-MM-DD HH:MM:SS".
+    string getTimestamp(),
+
+    // A block of count strictly increasing "YYYY-MM-DD HH:MM:SS.ffffff"
+    // timestamps, never repeating any timestamp handed out before.
+    list<string> getTimestamps(1: i32 count)
+}
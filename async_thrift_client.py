@@ -0,0 +1,274 @@
+import asyncio
+import itertools
+import struct
+import weakref
+from collections import deque
+
+from thrift.Thrift import TMessageType, TApplicationException
+from thrift.transport import TTransport
+from TimestampService import TimestampService
+
+import thrift_client
+from thrift_client import PROTOCOLS
+
+RESULT_TYPES = {
+    'getTimestamp': TimestampService.getTimestamp_result,
+    'getTimestamps': TimestampService.getTimestamps_result,
+}
+
+
+class AsyncThriftConnection:
+    """
+    One asyncio connection to the timestamp server.
+
+    Calls are pipelined: each request is written with its own sequence id and
+    a reader task matches the replies back to the waiting futures, so many
+    coroutines can share the connection without waiting for each other.
+    """
+
+    def __init__(self, host, port, transport='buffered', protocol='binary'):
+        self.host = host
+        self.port = port
+        self.framed = transport == 'framed'
+        self.protocol_class = PROTOCOLS[protocol]
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._seqids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _ensure_connected(self, timeout):
+        """
+        Opens the connection if it is not open. Waiting for the connect lock
+        and connecting share one timeout, so callers queued behind a connect
+        to an unreachable server give up with it rather than one after another.
+        """
+        if not self.connected:
+            await asyncio.wait_for(self._connect(), timeout)
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if not self.connected:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                self._reader, self._writer = reader, writer
+                self._reader_task = asyncio.get_running_loop().create_task(self._read_replies(reader, writer))
+
+    def _encode(self, method, seqid, args):
+        buffer = TTransport.TMemoryBuffer()
+        protocol = self.protocol_class(buffer)
+        protocol.writeMessageBegin(method, TMessageType.CALL, seqid)
+        args.write(protocol)
+        protocol.writeMessageEnd()
+        payload = buffer.getvalue()
+        if self.framed:
+            return struct.pack('!i', len(payload)) + payload
+        return payload
+
+    def _decode(self, data):
+        """
+        Decodes one reply from the start of data.
+        Returns (seqid, result or exception, bytes consumed), or None if data
+        does not hold a complete reply yet.
+        """
+        offset = 0
+        if self.framed:
+            if len(data) < 4:
+                return None
+            (length,) = struct.unpack('!i', data[:4])
+            if len(data) < 4 + length:
+                return None
+            offset = 4
+            data = data[4:4 + length]
+
+        buffer = TTransport.TMemoryBuffer(bytes(data))
+        protocol = self.protocol_class(buffer)
+        try:
+            (method, message_type, seqid) = protocol.readMessageBegin()
+            if message_type == TMessageType.EXCEPTION:
+                result = TApplicationException()
+                result.read(protocol)
+            else:
+                result = RESULT_TYPES[method]()
+                result.read(protocol)
+            protocol.readMessageEnd()
+        except EOFError:
+            if self.framed:
+                raise
+            return None
+        return seqid, result, offset + buffer.cstringio_buf.tell()
+
+    async def _read_replies(self, reader, writer):
+        data = bytearray()
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    raise ConnectionError("Timestamp server closed the connection")
+                data.extend(chunk)
+                while data:
+                    decoded = self._decode(data)
+                    if decoded is None:
+                        break
+                    seqid, result, consumed = decoded
+                    del data[:consumed]
+                    future = self._pending.pop(seqid, None)
+                    if future is not None and not future.done():
+                        future.set_result(result)
+        except Exception as e:
+            self._fail_pending(e)
+        finally:
+            writer.close()
+            # A newer connection may have replaced this one already.
+            if self._writer is writer:
+                self._writer = None
+
+    def _disconnect(self, error):
+        """
+        Drops the connection and fails every call waiting on it.
+        """
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = self._reader_task = None
+        self._fail_pending(error)
+
+    def _fail_pending(self, error):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def call(self, method, args, timeout):
+        """
+        Sends one call and waits for its reply. Connecting, writing the
+        request and waiting for the reply are each bounded by timeout.
+        """
+        await self._ensure_connected(timeout)
+        writer = self._writer
+        if writer is None:
+            raise ConnectionError("Timestamp server closed the connection")
+        seqid = next(self._seqids) & 0x7FFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self._pending[seqid] = future
+        try:
+            writer.write(self._encode(method, seqid, args))
+            try:
+                await asyncio.wait_for(writer.drain(), timeout)
+            except asyncio.TimeoutError as e:
+                # The request may be half written, which leaves the stream unusable.
+                self._pending.pop(seqid, None)
+                if self._writer is writer:
+                    self._disconnect(e)
+                raise
+            result = await asyncio.wait_for(future, timeout)
+        except BaseException:
+            self._pending.pop(seqid, None)
+            raise
+        if isinstance(result, TApplicationException):
+            raise result
+        if result.success is None:
+            raise TApplicationException(TApplicationException.MISSING_RESULT, f"{method} failed: unknown result")
+        return result.success
+
+    async def close(self):
+        self._disconnect(ConnectionError("Connection closed"))
+
+
+class AsyncTimestampClient:
+    """
+    Asyncio-native TimestampService client using the same wire format as
+    thrift_client. Calls are spread round-robin over a few pipelined
+    connections, which are opened lazily and reopened after a failure.
+    """
+
+    def __init__(self, host, port, connections=2, timeout_ms=1000, transport='buffered', protocol='binary'):
+        self.timeout = timeout_ms / 1000.0
+        self._connections = [
+            AsyncThriftConnection(host, port, transport=transport, protocol=protocol) for _ in range(connections)
+        ]
+        self._next = itertools.cycle(self._connections)
+
+    async def _call(self, method, args):
+        return await next(self._next).call(method, args, self.timeout)
+
+    async def getTimestamp(self):
+        return await self._call('getTimestamp', TimestampService.getTimestamp_args())
+
+    async def getTimestamps(self, count):
+        return await self._call('getTimestamps', TimestampService.getTimestamps_args(count=count))
+
+    async def close(self):
+        for connection in self._connections:
+            await connection.close()
+
+
+class AsyncTimestampLease:
+    """
+    Async counterpart of thrift_client.TimestampLease: hands out timestamps
+    from a leased block and fetches a new one when it runs out or expires.
+    """
+
+    def __init__(self, client, size=100, ttl_ms=1000):
+        self.client = client
+        self.size = size
+        self.ttl_ms = ttl_ms
+        self._lock = asyncio.Lock()
+        self._block = deque()
+        self._expires_at = 0
+
+    async def next(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            if not self._block or loop.time() > self._expires_at:
+                try:
+                    block = await self.client.getTimestamps(self.size)
+                except TApplicationException:
+                    return await self.client.getTimestamp()
+                self._block = deque(block)
+                self._expires_at = loop.time() + self.ttl_ms / 1000.0
+            return self._block.popleft()
+
+
+# asyncio streams belong to one event loop, so each loop gets its own lease.
+_leases = weakref.WeakKeyDictionary()
+
+
+def _get_lease():
+    loop = asyncio.get_running_loop()
+    lease = _leases.get(loop)
+    if lease is None:
+        client = AsyncTimestampClient(
+            thrift_client.THRIFT_HOST,
+            thrift_client.THRIFT_PORT,
+            timeout_ms=thrift_client.THRIFT_TIMEOUT_MS,
+            transport=thrift_client.THRIFT_TRANSPORT,
+            protocol=thrift_client.THRIFT_PROTOCOL,
+        )
+        lease = _leases[loop] = AsyncTimestampLease(
+            client, size=thrift_client.THRIFT_LEASE_SIZE, ttl_ms=thrift_client.THRIFT_LEASE_TTL_MS
+        )
+    return lease
+
+
+async def aget_timestamp():
+    """
+    Awaitable get_timestamp() for async views, e.g.
+        await Payment.objects.acreate(..., timestamp=await aget_timestamp())
+    Shares the circuit breaker and local fallback clock with the blocking
+    client, and sets the source read by the timestamp_source field default.
+    """
+    clock = thrift_client._clock
+    if clock.server_available:
+        try:
+            timestamp = await _get_lease().next()
+        except Exception as e:
+            clock.record_failure(e)
+        else:
+            return clock.record_server(timestamp)
+    return clock.local_now()
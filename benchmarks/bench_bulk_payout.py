@@ -0,0 +1,47 @@
+"""
+Benchmark: bulk payouts/sec through payapp.transfers.bulk_transfer, compared
+with one transfer() call per recipient.
+
+Usage: python benchmarks/bench_bulk_payout.py [recipients]
+"""
+import sys
+import time
+import warnings
+from decimal import Decimal
+
+from common import setup_django, create_users
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    setup_django()
+    warnings.filterwarnings('ignore', message='DateTimeField')
+
+    from register.models import OnlineAccount
+    from payapp.transfers import bulk_transfer, transfer
+
+    users = create_users(count + 1)
+    sender, recipients = users[0], users[1:]
+    OnlineAccount.objects.filter(user=sender).update(balance=Decimal('99999999'))
+    currencies = ['GBP', 'USD', 'EUR']
+    payouts = [
+        {'recipient_email': user.email, 'amount': '1.25', 'currency': currencies[i % 3]}
+        for i, user in enumerate(recipients)
+    ]
+
+    started = time.perf_counter()
+    results = bulk_transfer(sender, payouts)
+    elapsed = time.perf_counter() - started
+    ok = sum(1 for result in results if result['status'] == 'ok')
+    print(f"bulk_transfer: {ok} payouts in {elapsed:.3f}s -> {ok / elapsed:,.0f} payouts/sec")
+
+    single = min(count, 1000)
+    started = time.perf_counter()
+    for user in recipients[:single]:
+        transfer(sender, user, Decimal('1.25'), 'GBP')
+    elapsed = time.perf_counter() - started
+    print(f"transfer():    {single} payouts in {elapsed:.3f}s -> {single / elapsed:,.0f} payouts/sec")
+
+
+if __name__ == '__main__':
+    main()
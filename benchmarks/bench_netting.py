@@ -0,0 +1,49 @@
+"""
+Benchmark: settling a group's pending payment requests with
+payapp.netting.net_payment_requests, reporting how long netting and
+settlement take and how many transfers replace the requests.
+
+Usage: python benchmarks/bench_netting.py [requests] [users]
+"""
+import random
+import sys
+import time
+from decimal import Decimal
+
+from common import setup_django, create_users
+
+CURRENCIES = ['GBP', 'USD', 'EUR']
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    user_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    setup_django()
+
+    from payapp.models import PaymentRequest
+    from payapp.netting import net_payment_requests
+
+    random.seed(2025)
+    users = create_users(user_count, balance=Decimal('1000000'))
+    requests = []
+    for _ in range(count):
+        requester, requestee = random.sample(users, 2)
+        requests.append(PaymentRequest(
+            requester=requester,
+            requestee=requestee,
+            amount=Decimal(random.randint(100, 10000)).scaleb(-2),
+            currency=random.choice(CURRENCIES),
+        ))
+    PaymentRequest.objects.bulk_create(requests, batch_size=1000)
+
+    started = time.perf_counter()
+    result = net_payment_requests(users)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{result.settled_requests} requests between {user_count} users settled with "
+        f"{len(result.transfers)} transfers in {elapsed:.2f}s"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark: the dashboard, mark_all_as_read and admin per-user queries on a
+large payments table, without and then with the composite indexes on
+Payment and PaymentRequest. Prints SQLite's EXPLAIN QUERY PLAN
+for every statement and the median latency of each operation.
+
+Usage: python benchmarks/bench_query_plans.py [payments] [users] [runs]
+"""
+import random
+import statistics
+import sys
+import time
+import warnings
+from datetime import timedelta
+
+from common import setup_django, create_users
+
+INDEXED = {
+    'payment': ['payment_sender_origin_idx', 'payment_recipient_origin_idx'],
+    'paymentrequest': ['payment_request_requester_idx', 'payment_request_requestee_idx'],
+}
+
+
+def seed(users, payments, requests):
+    """
+    Inserts the rows with executemany; bulk_create is too slow for a million.
+    Every user has read the oldest 90% of payments and requests.
+    """
+    from django.db import connection
+    from django.utils import timezone
+    from payapp.models import NotificationCounter
+
+    now = timezone.now()
+    adapt = connection.ops.adapt_datetimefield_value
+    ids = [user.pk for user in users]
+    random.seed(2025)
+
+    def when():
+        return adapt(now - timedelta(seconds=random.randrange(365 * 24 * 60 * 60)))
+
+    with connection.cursor() as cursor:
+        for start in range(0, payments, 50000):
+            cursor.executemany(
+                "INSERT INTO payapp_payment (sender_id, recipient_id, amount, currency, original_amount, "
+                "original_currency, timestamp, timestamp_source, origin, rate_version) "
+                "VALUES (%s, %s, '1.00', 'GBP', '1.00', 'GBP', %s, 'local', %s, '')",
+                [
+                    (*random.sample(ids, 2), when(), random.choice(('direct', 'request')))
+                    for _ in range(start, min(start + 50000, payments))
+                ],
+            )
+        expires_at = adapt(now + timedelta(days=30))
+        for start in range(0, requests, 50000):
+            cursor.executemany(
+                "INSERT INTO payapp_paymentrequest (requester_id, requestee_id, amount, currency, timestamp, "
+                "timestamp_source, expires_at, status) "
+                "VALUES (%s, %s, '1.00', 'GBP', %s, 'local', %s, %s)",
+                [
+                    (
+                        *random.sample(ids, 2), when(), expires_at,
+                        random.choices(('pending', 'accepted', 'rejected'), (1, 6, 3))[0],
+                    )
+                    for _ in range(start, min(start + 50000, requests))
+                ],
+            )
+    NotificationCounter.objects.bulk_create(
+        NotificationCounter(
+            user_id=user_id, last_seen_payment_id=payments * 9 // 10, last_seen_request_id=requests * 9 // 10
+        )
+        for user_id in ids
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def operations(user):
+    from django.db import transaction
+    from payapp.dashboard import dashboard_lists, dashboard_summary, page
+    from payapp.models import Payment
+    from payapp.notifications import mark_all_read
+
+    def mark_all_as_read():
+        with transaction.atomic():
+            mark_all_read(user)
+            transaction.set_rollback(True)
+
+    ops = {'dashboard_summary': lambda: dashboard_summary(user)}
+    for name, queryset in dashboard_lists(user).items():
+        ops[name] = lambda queryset=queryset: page(queryset)
+    ops['mark_all_as_read'] = mark_all_as_read
+    ops['admin_user_payments'] = lambda: (
+        list(Payment.objects.filter(sender=user)), list(Payment.objects.filter(recipient=user))
+    )
+    return ops
+
+
+def measure(label, ops, runs):
+    from django.db import connection
+
+    print(f"\n=== {label} ===")
+    for name, operation in ops.items():
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            operation()
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - started)
+
+        print(f"\n{name}: median {statistics.median(timings) * 1000:.2f} ms over {runs} runs")
+        with connection.cursor() as cursor:
+            for sql, params in statements:
+                if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE')):
+                    continue
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                for row in cursor.fetchall():
+                    print(f"    {row[-1]}")
+
+
+def main():
+    payments = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    user_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    setup_django()
+    warnings.filterwarnings('ignore', message='DateTimeField')
+
+    from django.db import connection
+    from payapp.models import Payment, PaymentRequest
+
+    models = {'payment': Payment, 'paymentrequest': PaymentRequest}
+    indexes = {
+        model_name: [index for index in models[model_name]._meta.indexes if index.name in names]
+        for model_name, names in INDEXED.items()
+    }
+    with connection.schema_editor() as editor:
+        for model_name, model_indexes in indexes.items():
+            for index in model_indexes:
+                editor.remove_index(models[model_name], index)
+
+    users = create_users(user_count)
+    started = time.perf_counter()
+    seed(users, payments, payments // 10)
+    print(f"Seeded {payments} payments and {payments // 10} requests in {time.perf_counter() - started:.1f}s")
+
+    ops = operations(users[0])
+    measure("foreign key indexes only", ops, runs)
+
+    started = time.perf_counter()
+    with connection.schema_editor() as editor:
+        for model_name, model_indexes in indexes.items():
+            for index in model_indexes:
+                editor.add_index(models[model_name], index)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    print(f"\nBuilt the composite indexes in {time.perf_counter() - started:.1f}s")
+    measure("with composite indexes", ops, runs)
+
+
+if __name__ == '__main__':
+    main()
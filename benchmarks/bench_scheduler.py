@@ -0,0 +1,62 @@
+"""
+Benchmark: draining a backlog of due scheduled payments with
+payapp.scheduler.run_due_payments, reporting throughput and how much peak
+memory grew while draining, which should stay flat as the backlog grows.
+
+Usage: python benchmarks/bench_scheduler.py [schedules] [batch_size]
+"""
+import sys
+import time
+import resource
+import warnings
+from datetime import timedelta
+from decimal import Decimal
+
+from common import setup_django, create_users
+
+PAYERS = 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    setup_django()
+    warnings.filterwarnings('ignore', message='DateTimeField')
+
+    from django.utils import timezone
+    from payapp.models import ScheduledPayment
+    from payapp.scheduler import run_due_payments
+
+    users = create_users(PAYERS, balance=Decimal('1000000'))
+    now = timezone.now()
+    for start in range(0, count, 10000):
+        ScheduledPayment.objects.bulk_create(
+            (
+                ScheduledPayment(
+                    sender=users[i % PAYERS],
+                    recipient=users[(i + 1) % PAYERS],
+                    amount=Decimal('1.00'),
+                    recurrence=ScheduledPayment.MONTHLY,
+                    start_at=now - timedelta(minutes=i % 1440),
+                    next_run_at=now - timedelta(minutes=i % 1440),
+                )
+                for i in range(start, min(start + 10000, count))
+            ),
+            batch_size=1000,
+        )
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    processed = 0
+    for succeeded, failed in run_due_payments(batch_size=batch_size, now=now):
+        processed += succeeded + failed
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"{processed} schedules in {elapsed:.2f}s -> {processed / elapsed:,.0f}/sec, "
+        f"peak RSS grew {(rss_after - rss_before) / 1024:.1f} MiB while draining (batch size {batch_size})"
+    )
+
+
+if __name__ == '__main__':
+    main()
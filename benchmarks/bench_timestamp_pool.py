@@ -0,0 +1,75 @@
+"""
+Micro-benchmark: Payment.objects.create rows/sec with a new Thrift connection
+per timestamp (the previous get_timestamp) versus the pooled client.
+
+Usage: python benchmarks/bench_timestamp_pool.py [rows]
+"""
+import os
+import sys
+import time
+
+from common import free_port, setup_django, start_timestamp_server, create_users
+
+PORT = free_port()
+os.environ['TIMESTAMP_SERVICE_PORT'] = str(PORT)
+
+
+def unpooled_get_timestamp():
+    """
+    The previous get_timestamp: a new socket, transport and client per call.
+    """
+    from thrift.transport import TSocket, TTransport
+    from thrift.protocol import TBinaryProtocol
+    from TimestampService import TimestampService
+
+    transport = TTransport.TBufferedTransport(TSocket.TSocket('localhost', PORT))
+    client = TimestampService.Client(TBinaryProtocol.TBinaryProtocol(transport))
+    transport.open()
+    timestamp = client.getTimestamp()
+    transport.close()
+    return timestamp
+
+
+def use_default(field, default):
+    """
+    Swaps a model field's default, dropping Django's cached default getter.
+    """
+    field.default = default
+    field.__dict__.pop('_get_default', None)
+
+
+def run(label, rows, sender, recipient):
+    from payapp.models import Payment
+
+    started = time.perf_counter()
+    for _ in range(rows):
+        Payment.objects.create(sender=sender, recipient=recipient, amount=1)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {rows} rows in {elapsed:.3f}s -> {rows / elapsed:,.0f} rows/sec")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    setup_django()
+    start_timestamp_server(PORT)
+    time.sleep(0.2)
+
+    import warnings
+    import thrift_client
+    from payapp.models import Payment
+
+    # Thrift timestamps are naive; silence Django's per-row timezone warning.
+    warnings.filterwarnings('ignore', message='DateTimeField')
+
+    sender, recipient = create_users(2)
+    field = Payment._meta.get_field('timestamp')
+
+    use_default(field, unpooled_get_timestamp)
+    run('unpooled', rows, sender, recipient)
+
+    use_default(field, thrift_client.get_timestamp)
+    run('pooled', rows, sender, recipient)
+
+
+if __name__ == '__main__':
+    main()
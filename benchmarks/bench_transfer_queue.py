@@ -0,0 +1,112 @@
+"""
+Benchmark: direct payments to a few hot merchant accounts from many threads,
+applied synchronously with transfer() versus queued with enqueue_transfer()
+and applied by a TransferWorkerPool running alongside.
+
+Reports request latency (what the HTTP view would wait for), end-to-end
+throughput, and how many requests failed with a database error.
+
+Usage: python benchmarks/bench_transfer_queue.py [threads] [payments_per_thread]
+"""
+import random
+import statistics
+import sys
+import threading
+import time
+import warnings
+from decimal import Decimal
+
+from common import setup_django, create_users
+
+MERCHANTS = 3
+PAYERS = 200
+
+
+def run_clients(threads, per_thread, payers, merchants, pay):
+    """
+    Runs pay(sender, recipient) from several threads.
+    Returns (latencies in seconds, errors).
+    """
+    from django.db import connection
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = random.Random(seed)
+        local = []
+        try:
+            for _ in range(per_thread):
+                started = time.perf_counter()
+                try:
+                    pay(rng.choice(payers), rng.choice(merchants))
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                local.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+            with lock:
+                latencies.extend(local)
+
+    workers = [threading.Thread(target=client, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, errors
+
+
+def report(label, count, elapsed, latencies, errors):
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{label:7} {count} payments in {elapsed:.2f}s -> {count / elapsed:,.0f}/sec, "
+        f"request p50 {statistics.median(latencies) * 1000:.1f}ms p99 {p99 * 1000:.1f}ms, "
+        f"{len(errors)} database errors"
+    )
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    setup_django(file_backed=True)
+    warnings.filterwarnings('ignore', message='DateTimeField')
+
+    from payapp.models import PendingTransfer
+    from payapp.transfer_queue import TransferWorkerPool, enqueue_transfer
+    from payapp.transfers import InsufficientFunds, transfer
+
+    users = create_users(PAYERS + MERCHANTS, balance=Decimal('100000'))
+    merchants, payers = users[:MERCHANTS], users[MERCHANTS:]
+    amount = Decimal('1.25')
+
+    def pay_sync(sender, recipient):
+        try:
+            transfer(sender, recipient, amount, 'GBP')
+        except InsufficientFunds:
+            pass
+
+    started = time.perf_counter()
+    latencies, errors = run_clients(threads, per_thread, payers, merchants, pay_sync)
+    report('sync', len(latencies) - len(errors), time.perf_counter() - started, latencies, errors)
+
+    pool = TransferWorkerPool(workers=4, batch_size=200, poll_interval=0.01)
+    pool_thread = threading.Thread(target=pool.run)
+    started = time.perf_counter()
+    pool_thread.start()
+    latencies, errors = run_clients(
+        threads, per_thread, payers, merchants, lambda sender, recipient: enqueue_transfer(sender, recipient, amount, 'GBP')
+    )
+    while PendingTransfer.objects.filter(status=PendingTransfer.QUEUED).exists():
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    pool.stop()
+    pool_thread.join()
+    completed = PendingTransfer.objects.filter(status=PendingTransfer.COMPLETED).count()
+    report('queued', completed, elapsed, latencies, errors)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Shared setup for the benchmark scripts in this directory.
+
+Each script is run from the project root, e.g. ``python benchmarks/bench_timestamp_pool.py``.
+Benchmarks run against a throwaway test database, never webapps2025.db.
+"""
+import atexit
+import os
+import socket
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def free_port():
+    """
+    Returns a TCP port that is free on localhost.
+    """
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def setup_django(file_backed=False):
+    """
+    Configures Django and creates a fresh benchmark database, separate from
+    both webapps2025.db and the test suite's database. It is in memory unless
+    file_backed is set, which multi-threaded benchmarks need so that SQLite
+    connections wait for each other's locks. A file database is removed on exit.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapps2025.settings")
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.db import connection
+    settings.DATABASES['default']['TEST']['NAME'] = os.path.join(ROOT, 'bench_webapps2025.db') if file_backed else None
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    if file_backed:
+        atexit.register(connection.creation.destroy_test_db, old_name, verbosity=0)
+
+
+def start_timestamp_server(port, **options):
+    """
+    Runs the Thrift timestamp server on a daemon thread and returns the server.
+    Options are passed to thrift_server.build_server (mode, workers, transport, protocol).
+    """
+    from thrift_server import TimestampHandler, build_server
+
+    server = build_server(TimestampHandler(), host='localhost', port=port, **options)
+    threading.Thread(target=server.serve, daemon=True).start()
+    return server
+
+
+def create_users(count, balance=1000, currency='GBP'):
+    """
+    Creates count users with online accounts and returns the users.
+    """
+    from django.contrib.auth.models import User
+    from register.models import OnlineAccount
+
+    users = User.objects.bulk_create(
+        User(username=f"bench{i}", email=f"bench{i}@example.com") for i in range(count)
+    )
+    users = list(User.objects.filter(username__startswith='bench').order_by('id'))
+    OnlineAccount.objects.bulk_create(
+        OnlineAccount(user=user, currency=currency, balance=balance) for user in users
+    )
+    return users
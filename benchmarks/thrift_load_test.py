@@ -0,0 +1,111 @@
+"""
+Load test for the Thrift timestamp server: RPC/s and latency percentiles
+with 1, 8 and 64 concurrent clients, each running in its own process with
+its own persistent connection.
+
+Usage:
+    python benchmarks/thrift_load_test.py --server threadpool --workers 64
+    python benchmarks/thrift_load_test.py --server nonblocking --transport framed --protocol compact
+    python benchmarks/thrift_load_test.py --port 10000   # test an already running server
+
+Without --port, a server is started in a subprocess with the given options.
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from common import ROOT, free_port
+
+from thrift_server import SERVER_MODES, TRANSPORT_FACTORIES, PROTOCOL_FACTORIES
+
+
+def client_worker(host, port, transport, protocol, start_at, duration, method, results):
+    from thrift_client import open_client
+
+    client_transport, client = open_client(host, port, timeout_ms=10000, transport=transport, protocol=protocol)
+    call = client.getTimestamp if method == 'getTimestamp' else lambda: client.getTimestamps(1)
+    latencies = []
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = start_at + duration
+    while time.time() < deadline:
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+    client_transport.close()
+    results.put(latencies)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(clients, args, port):
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    processes = [
+        multiprocessing.Process(
+            target=client_worker,
+            args=('localhost' if args.port is None else args.host, port, args.transport, args.protocol,
+                  start_at, args.duration, args.method, results),
+        )
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    latencies = []
+    for _ in processes:
+        latencies.extend(results.get())
+    for process in processes:
+        process.join()
+
+    latencies.sort()
+    print(
+        f"{clients:>3} clients: {len(latencies) / args.duration:>10,.0f} RPC/s   "
+        f"p50 {percentile(latencies, 0.50) * 1000:7.3f} ms   "
+        f"p99 {percentile(latencies, 0.99) * 1000:7.3f} ms   "
+        f"max {latencies[-1] * 1000 if latencies else 0:7.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=None, help="existing server to test")
+    parser.add_argument('--server', choices=SERVER_MODES, default='threaded')
+    parser.add_argument('--workers', type=int, default=64)
+    parser.add_argument('--transport', choices=sorted(TRANSPORT_FACTORIES), default='buffered')
+    parser.add_argument('--protocol', choices=sorted(PROTOCOL_FACTORIES), default='binary')
+    parser.add_argument('--clients', default='1,8,64', help="comma-separated client counts")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per run")
+    parser.add_argument('--method', choices=('getTimestamp', 'getTimestamps'), default='getTimestamp')
+    args = parser.parse_args()
+
+    server = None
+    port = args.port
+    if port is None:
+        port = free_port()
+        server = subprocess.Popen([
+            sys.executable, os.path.join(ROOT, 'thrift_server.py'),
+            '--host', 'localhost', '--port', str(port), '--server', args.server,
+            '--workers', str(args.workers), '--transport', args.transport, '--protocol', args.protocol,
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(1.0)
+
+    print(f"server={args.server} workers={args.workers} transport={args.transport} protocol={args.protocol}")
+    try:
+        for clients in (int(count) for count in args.clients.split(',')):
+            run(clients, args, port)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import bisect
+import random
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, Sum
+
+from register.models import AccountShard, OnlineAccount
+
+
+def shard_account(account, shard_count):
+    """
+    Splits an account's incoming credits over shard_count sub-balance rows,
+    or stops sharding it with shard_count=1. Balances already held in shards
+    are folded back into the account first, so the total never changes.
+    """
+    if shard_count < 1:
+        raise ValueError("An account needs at least one shard.")
+    with transaction.atomic():
+        # The row before the shards, the lock order move_funds uses.
+        OnlineAccount.objects.select_for_update().get(pk=account.pk)
+        consolidate_shards(account.pk)
+        AccountShard.objects.filter(account=account).delete()
+        if shard_count > 1:
+            AccountShard.objects.bulk_create(
+                AccountShard(account=account, index=index) for index in range(shard_count)
+            )
+        OnlineAccount.objects.filter(pk=account.pk).update(shard_count=shard_count)
+        account.shard_count = shard_count
+
+
+def consolidate_shards(account_id):
+    """
+    Moves everything held in an account's shards into its OnlineAccount row,
+    so it can be debited with the usual conditional update. Every shard row
+    is locked, empty ones included, until the caller's transaction ends, so
+    no credit can land on a shard the caller goes on to delete. Callers hold
+    the account's row lock first.
+    """
+    shards = list(
+        AccountShard.objects.select_for_update()
+        .filter(account_id=account_id)
+        .order_by('pk')
+        .values_list('pk', 'balance')
+    )
+    held = sum(balance for _, balance in shards)
+    if not held:
+        return
+    AccountShard.objects.filter(pk__in=[pk for pk, balance in shards if balance]).update(balance=0)
+    OnlineAccount.objects.filter(pk=account_id).update(balance=F('balance') + held)
+
+
+def held_in_shards(account_id):
+    """
+    Returns the total held in an account's shards, without locking them.
+    While the caller holds the account's row lock nothing else can fold the
+    shards in, so the total can only grow until the caller consolidates.
+    """
+    held = AccountShard.objects.filter(account_id=account_id).aggregate(held=Sum('balance'))['held']
+    return held or Decimal('0')
+
+
+def settle_shards(consolidate, credits):
+    """
+    Folds the shards of the accounts in consolidate into their rows (see
+    consolidate_shards) and adds [(account_id, shard_count, amount)] credits
+    to random shards, visiting accounts in id order so shard locks are always
+    taken in the same order. Callers lock the account rows they write first.
+    """
+    credits = sorted(credits)
+    start = 0
+    for account_id in sorted(consolidate):
+        end = bisect.bisect_left(credits, (account_id,))
+        if end > start:
+            credit_shards(credits[start:end])
+        consolidate_shards(account_id)
+        start = end
+    if start < len(credits):
+        credit_shards(credits[start:])
+
+
+def credit_shards(credits):
+    """
+    Adds [(account_id, shard_count, amount)] to a random shard of each account,
+    with one executemany of
+        UPDATE ... SET balance = balance + x WHERE account_id = ... AND index = ...
+    Raises AccountShard.DoesNotExist, so the caller's transaction rolls back,
+    if a shard_count is stale and some credit found no shard to land on.
+    """
+    table = connection.ops.quote_name(AccountShard._meta.db_table)
+    balance = connection.ops.quote_name(AccountShard._meta.get_field('balance').column)
+    account = connection.ops.quote_name(AccountShard._meta.get_field('account').column)
+    index = connection.ops.quote_name(AccountShard._meta.get_field('index').column)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {table} SET {balance} = {balance} + %s WHERE {account} = %s AND {index} = %s",
+            [(amount, account_id, random.randrange(shard_count)) for account_id, shard_count, amount in credits],
+        )
+        # (account, index) is unique, so each statement updates at most one row.
+        if cursor.rowcount != len(credits):
+            raise AccountShard.DoesNotExist(
+                f"{len(credits) - cursor.rowcount} of {len(credits)} shard credits found no shard"
+            )
@@ -1,6 +1,15 @@
 from django.contrib import admin
-from .models import Payment, PaymentRequest
+from .models import (
+    Payment, PaymentRequest, IdempotencyKey, LedgerEntry, BalanceSnapshot, PendingTransfer, ScheduledPayment,
+    NotificationCounter,
+)
 
 admin.site.register(Payment)
 admin.site.register(PaymentRequest)
 
+admin.site.register(IdempotencyKey)
+admin.site.register(LedgerEntry)
+admin.site.register(BalanceSnapshot)
+admin.site.register(PendingTransfer)
+admin.site.register(ScheduledPayment)
+admin.site.register(NotificationCounter)
@@ -0,0 +1,139 @@
+import base64
+import binascii
+from decimal import Decimal
+
+from django.db.models import F, Func, OuterRef, Q, Subquery
+from django.utils.dateparse import parse_datetime
+from django.db.models.functions import Coalesce
+
+from payapp.models import Payment, PaymentRequest
+from payapp.notifications import COUNTERS, unread_payments, unread_requests
+from payapp.rates import CENTS
+from register.models import AccountShard, OnlineAccount
+
+PAYMENT_FIELDS = ('id', 'amount', 'currency', 'original_amount', 'original_currency', 'timestamp')
+REQUEST_FIELDS = ('id', 'amount', 'currency', 'timestamp', 'status')
+# Rows per dashboard list page.
+PAGE_SIZE = 20
+# Newest first. The unread lists are bounded below by the user's watermark
+# id, so they are ordered by id alone: the watermark and the page keyset are
+# then one range on the (recipient, origin, id) and (requestee, status, id)
+# indexes. Ids are assigned in arrival order, like the leased timestamps.
+NEWEST_FIRST = ('-timestamp', '-id')
+NEWEST_ID_FIRST = ('-id',)
+COUNTS = (
+    'received_direct_payments_unread_count',
+    'received_request_payments_unread_count',
+    'pending_requests_unread_count',
+)
+
+
+def dashboard_lists(user):
+    """
+    Returns the querysets behind each dashboard tab, newest first (see
+    NEWEST_FIRST). Rows are plain dicts with the other party's address under
+    'email', read through a join rather than one query per row.
+    """
+    payments = Payment.objects.order_by(*NEWEST_FIRST)
+    requests = PaymentRequest.objects.order_by(*NEWEST_FIRST)
+    return {
+        'sent_direct_payments': payments.filter(sender=user, origin=Payment.DIRECT_PAYMENT)
+        .values(*PAYMENT_FIELDS, email=F('recipient__email')),
+        'received_direct_payments': unread_payments(user).filter(origin=Payment.DIRECT_PAYMENT)
+        .order_by(*NEWEST_ID_FIRST).values(*PAYMENT_FIELDS, email=F('sender__email')),
+        'sent_request_payments': payments.filter(sender=user, origin=Payment.PAYMENT_REQUEST)
+        .values(*PAYMENT_FIELDS, email=F('recipient__email')),
+        'received_request_payments': unread_payments(user).filter(origin=Payment.PAYMENT_REQUEST)
+        .order_by(*NEWEST_ID_FIRST).values(*PAYMENT_FIELDS, email=F('sender__email')),
+        'pending_requests': unread_requests(user).live()
+        .order_by(*NEWEST_ID_FIRST).values(*REQUEST_FIELDS, email=F('requester__email')),
+        'requested_payments': requests.filter(requester=user)
+        .values(*REQUEST_FIELDS, email=F('requestee__email')),
+    }
+
+
+def encode_cursor(row):
+    """
+    Returns an opaque cursor pointing just past row, from its (timestamp, id).
+    """
+    position = f"{row['timestamp'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (timestamp, id) in a cursor, raising ValueError if it is malformed.
+    """
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp = parse_datetime(timestamp)
+        pk = int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if timestamp is None:
+        raise ValueError("Invalid cursor")
+    return timestamp, pk
+
+
+def page(queryset, cursor=None, size=PAGE_SIZE):
+    """
+    Returns (rows, next_cursor) for one page of a dashboard list, next_cursor
+    being None on the last page.
+
+    Pages are found by keyset rather than OFFSET, so a page deep in a long
+    history costs the same as the first. Lists ordered by id continue below
+    the cursor's id. Otherwise the keyset is (timestamp, id): the
+    timestamp <= bound seeks into the index and the tie on timestamp is
+    broken by id.
+    """
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        if tuple(queryset.query.order_by) == NEWEST_ID_FIRST:
+            queryset = queryset.filter(id__lt=pk)
+        else:
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(id__lt=pk), timestamp__lte=timestamp)
+    rows = list(queryset[:size + 1])
+    next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+    return rows[:size], next_cursor
+
+
+def dashboard_summary(user):
+    """
+    Returns the user's account with its shard holdings and the unread badge
+    counts, read with one query: the counts come from the user's
+    NotificationCounter row, joined by primary key, and the shard total is a
+    scalar subquery on the account row.
+    """
+    counter = 'user__notification_counter__'
+    account = (
+        OnlineAccount.objects.filter(user=user)
+        .annotate(
+            held=Subquery(
+                AccountShard.objects.filter(account=OuterRef('pk'))
+                .order_by()
+                .values(total=Func('balance', function='SUM'))
+            ),
+            **{
+                badge: Coalesce(F(counter + name), 0)
+                for badge, name in zip(COUNTS, COUNTERS)
+            },
+        )
+        .values('currency', 'balance', 'held', *COUNTS)
+        .get()
+    )
+    held = account.pop('held')
+    # SQLite sums decimal columns as floats.
+    account['balance'] += Decimal(held or 0).quantize(CENTS)
+    return account
+
+
+def dashboard_data(user):
+    """
+    Everything the user dashboard renders, as plain dicts and lists, in a
+    fixed number of queries however many payments the user has. Each list
+    holds its first page, with the cursor of the next under '<list>_cursor'.
+    """
+    data = dashboard_summary(user)
+    for name, queryset in dashboard_lists(user).items():
+        data[name], data[f'{name}_cursor'] = page(queryset)
+    return data
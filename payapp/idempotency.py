@@ -0,0 +1,154 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseRedirect
+from django.shortcuts import redirect
+from django.utils import timezone
+
+from payapp.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+# Form fields that differ between otherwise identical submissions.
+IGNORED_FIELDS = {'csrfmiddlewaretoken', IDEMPOTENCY_FIELD}
+
+
+def get_idempotency_key(request):
+    """
+    Returns the key sent in the Idempotency-Key header or the idempotency_key
+    form field, or None if the request has neither.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER) or request.POST.get(IDEMPOTENCY_FIELD)
+    key = (key or '').strip()
+    return key or None
+
+
+def request_fingerprint(request):
+    """
+    Hashes the path and form fields, so a key reused for a different payment
+    can be told apart from a retry of the same one.
+    """
+    fields = sorted((name, request.POST.getlist(name)) for name in request.POST if name not in IGNORED_FIELDS)
+    return hashlib.sha256(json.dumps([request.path, fields]).encode()).hexdigest()
+
+
+def claim_key(user, key, fingerprint):
+    """
+    Records that a request with this key has started.
+    Returns (record, claimed); claimed is False if a live record already exists.
+    An expired record that has not been swept yet is taken over, and a record
+    deleted between the failed insert and the read (its request failed) is
+    claimed again.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    while True:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint, expires_at=expires_at), True
+        except IntegrityError:
+            pass
+        try:
+            record = IdempotencyKey.objects.get(user=user, key=key)
+            break
+        except IdempotencyKey.DoesNotExist:
+            continue
+
+    taken_over = IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).update(
+        fingerprint=fingerprint,
+        completed=False,
+        response_status=None,
+        response_location='',
+        response_messages=[],
+        response_body='',
+        response_content_type='',
+        expires_at=expires_at,
+    )
+    if taken_over:
+        record.refresh_from_db()
+    return record, bool(taken_over)
+
+
+def _queued_messages(request):
+    # Messages added during this request that have not been rendered yet.
+    return getattr(getattr(request, '_messages', None), '_queued_messages', [])
+
+
+def replay(request, record, fingerprint):
+    """
+    Answers a repeated request from its stored outcome without running the view.
+    """
+    if record.fingerprint != fingerprint:
+        messages.error(request, "This idempotency key was already used for a different request.")
+        return redirect('dashboard')
+    if not record.completed:
+        messages.warning(request, "This payment is already being processed.")
+        return redirect('dashboard')
+
+    for level, message, extra_tags in record.response_messages:
+        messages.add_message(request, level, message, extra_tags=extra_tags)
+    if record.response_location:
+        response = HttpResponseRedirect(record.response_location)
+    else:
+        response = HttpResponse(
+            record.response_body, status=record.response_status, content_type=record.response_content_type or None
+        )
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Makes a POST view safe to retry. The first request with a given key runs
+    the view and stores its redirect and flash messages, or its body for
+    responses that are not redirects; later requests with the same key get
+    that outcome back while the key is live. Requests without a key run as
+    before.
+
+    Put it outside @transaction.atomic, so the key is claimed, and visible to
+    concurrent retries, before the view's transaction starts.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = get_idempotency_key(request)
+        if request.method != 'POST' or key is None or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            messages.error(request, "Idempotency key is too long.")
+            return redirect('dashboard')
+
+        fingerprint = request_fingerprint(request)
+        record, claimed = claim_key(request.user, key, fingerprint)
+        if not claimed:
+            return replay(request, record, fingerprint)
+
+        already_queued = len(_queued_messages(request))
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            # Nothing was recorded, so let the client retry.
+            record.delete()
+            raise
+
+        record.completed = True
+        record.response_status = response.status_code
+        record.response_location = response.get('Location', '')
+        if not record.response_location and not getattr(response, 'streaming', False):
+            record.response_body = response.content.decode(response.charset)
+            record.response_content_type = response.get('Content-Type', '')
+        record.response_messages = [
+            [message.level, str(message.message), message.extra_tags or '']
+            for message in _queued_messages(request)[already_queued:]
+        ]
+        record.save(update_fields=[
+            'completed', 'response_status', 'response_location', 'response_messages',
+            'response_body', 'response_content_type',
+        ])
+        return response
+
+    return wrapper
@@ -0,0 +1,162 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Func, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from payapp.models import BalanceSnapshot, LedgerEntry
+from payapp.rates import CENTS
+from register.models import AccountShard, OnlineAccount
+
+ZERO = Decimal('0.00')
+
+
+def transfer_entries(payment, sender_account, recipient_account, debit_amount, credit_amount, created_at=None):
+    """
+    Returns the unsaved debit and credit LedgerEntry rows for one payment,
+    for the caller to write with bulk_create.
+    """
+    created_at = created_at or timezone.now()
+    return [
+        LedgerEntry(
+            account=sender_account,
+            payment=payment,
+            kind=LedgerEntry.DEBIT,
+            amount=-debit_amount,
+            currency=sender_account.currency,
+            created_at=created_at,
+        ),
+        LedgerEntry(
+            account=recipient_account,
+            payment=payment,
+            kind=LedgerEntry.CREDIT,
+            amount=credit_amount,
+            currency=recipient_account.currency,
+            created_at=created_at,
+        ),
+    ]
+
+
+def open_account(user, currency, balance):
+    """
+    Creates an OnlineAccount and the OPENING ledger entry for its starting balance.
+    """
+    with transaction.atomic():
+        account = OnlineAccount.objects.create(user=user, currency=currency, balance=balance)
+        LedgerEntry.objects.create(account=account, kind=LedgerEntry.OPENING, amount=balance, currency=currency)
+    return account
+
+
+def _cents(total):
+    # SQLite sums decimal columns as floats, so round the result back to cents.
+    return Decimal(total).quantize(CENTS)
+
+
+def _sum(entries):
+    return _cents(entries.aggregate(total=Coalesce(Sum('amount'), Value(ZERO)))['total'])
+
+
+def balance_as_of(account, when=None):
+    """
+    Returns the ledger balance of account at time when (default: now).
+    Reads the latest snapshot taken by then and adds the entries written
+    after it, so the cost depends on the snapshot interval, not on the
+    account's history.
+    """
+    when = when or timezone.now()
+    snapshot = (
+        BalanceSnapshot.objects.filter(account=account, taken_at__lte=when)
+        .order_by('-last_entry_id')
+        .first()
+    )
+    entries = LedgerEntry.objects.filter(account=account, created_at__lte=when)
+    if snapshot is None:
+        return _sum(entries)
+    return snapshot.balance + _sum(entries.filter(pk__gt=snapshot.last_entry_id))
+
+
+def _latest_snapshot(account_ref):
+    return BalanceSnapshot.objects.filter(account=account_ref).order_by('-last_entry_id')
+
+
+def _since_snapshots(up_to_entry_id):
+    """
+    Returns (account_id, snapshot balance, delta) for every account: the
+    balance of its latest snapshot and the sum of its entries after that
+    snapshot up to up_to_entry_id, each None if there is nothing to read.
+
+    The query starts from the accounts, so each delta is a range scan of the
+    (account, id) index from the snapshot's last_entry_id on, and entries
+    already covered by a snapshot are never read.
+    """
+    latest = _latest_snapshot(OuterRef('pk'))
+    entries = (
+        LedgerEntry.objects.filter(account=OuterRef('pk'), pk__gt=OuterRef('since'), pk__lte=up_to_entry_id)
+        .order_by()
+        .values(total=Func('amount', function='SUM'))
+    )
+    return (
+        OnlineAccount.objects.annotate(
+            snapshot_balance=Subquery(latest.values('balance')[:1]),
+            since=Coalesce(Subquery(latest.values('last_entry_id')[:1]), Value(0)),
+            delta=Subquery(entries),
+        )
+        .values_list('pk', 'snapshot_balance', 'delta')
+    )
+
+
+def ledger_balances(up_to_entry_id):
+    """
+    Returns {account_id: ledger balance} covering every entry up to
+    up_to_entry_id, each computed as the account's latest snapshot plus the
+    entries written after it. One query in total, whatever the account count.
+    """
+    return {
+        account_id: (snapshot_balance or ZERO) + (ZERO if delta is None else _cents(delta))
+        for account_id, snapshot_balance, delta in _since_snapshots(up_to_entry_id)
+    }
+
+
+def take_snapshots(batch_size=500):
+    """
+    Writes a BalanceSnapshot for every account with entries since its last
+    snapshot. Returns the number of snapshots written. Run one at a time.
+    """
+    high = LedgerEntry.objects.aggregate(high=Max('pk'))['high']
+    if high is None:
+        return 0
+    taken_at = timezone.now()
+    snapshots = [
+        BalanceSnapshot(
+            account_id=account_id,
+            balance=(snapshot_balance or ZERO) + _cents(delta),
+            last_entry_id=high,
+            taken_at=taken_at,
+        )
+        for account_id, snapshot_balance, delta in _since_snapshots(high)
+        if delta is not None
+    ]
+    BalanceSnapshot.objects.bulk_create(snapshots, batch_size=batch_size)
+    return len(snapshots)
+
+
+def reconcile():
+    """
+    Compares each account's ledger balance with its stored balance, including
+    anything held in its shards.
+    Returns [(account_id, ledger_balance, stored_balance)] for accounts that
+    disagree. Balances are read in one transaction so they are consistent.
+    """
+    with transaction.atomic():
+        high = LedgerEntry.objects.aggregate(high=Max('pk'))['high'] or 0
+        ledger = ledger_balances(high)
+        stored = dict(OnlineAccount.objects.values_list('pk', 'balance'))
+        held = AccountShard.objects.values('account').annotate(total=Sum('balance')).values_list('account', 'total')
+        for account_id, total in held:
+            stored[account_id] += _cents(total)
+    return [
+        (account_id, ledger.get(account_id, ZERO), balance)
+        for account_id, balance in sorted(stored.items())
+        if ledger.get(account_id, ZERO) != balance
+    ]
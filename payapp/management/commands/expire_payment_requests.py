@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from payapp.models import PaymentRequest
+from payapp.notifications import requests_closed
+
+
+class Command(BaseCommand):
+    help = "Marks pending payment requests past their expiry as expired, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Requests expired per statement.")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        expired = 0
+        # Each batch is read from the (status, expires_at) index and updated in
+        # its own short transaction, so the write lock is never held for long.
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    PaymentRequest.objects.select_for_update()
+                    .filter(status='pending', expires_at__lte=now)
+                    .order_by('expires_at')
+                    .values_list('pk', 'requestee_id')[:batch_size]
+                )
+                if not rows:
+                    break
+                request_ids = [request_id for request_id, _ in rows]
+                updated = PaymentRequest.objects.filter(
+                    pk__in=request_ids, status='pending', expires_at__lte=now
+                ).update(status='expired')
+                if updated < len(rows):
+                    # Some were answered after the read; only the rows expired here leave the counters.
+                    flipped = set(
+                        PaymentRequest.objects.filter(pk__in=request_ids, status='expired').values_list('pk', flat=True)
+                    )
+                    rows = [row for row in rows if row[0] in flipped]
+                expired += updated
+                requests_closed((requestee_id, request_id) for request_id, requestee_id in rows)
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} payment requests."))
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp.netting import net_payment_requests
+from payapp.transfers import InsufficientFunds
+from register.models import OnlineAccount
+
+
+class Command(BaseCommand):
+    help = "Settles the pending payment requests within a group of users with the fewest net transfers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('emails', nargs='+', help="Emails of the users in the group.")
+        parser.add_argument('--currency', default='GBP', help="Currency the requests are netted in.")
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(email__in=options['emails']))
+        missing = set(options['emails']) - {user.email for user in users}
+        if missing:
+            raise CommandError(f"No user for {', '.join(sorted(missing))}.")
+        try:
+            result = net_payment_requests(users, currency=options['currency'])
+        except InsufficientFunds:
+            raise CommandError("A member of the group cannot cover their net debt; nothing was settled.")
+        except (OnlineAccount.DoesNotExist, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Settled {result.settled_requests} payment requests with {len(result.transfers)} transfers."
+        ))
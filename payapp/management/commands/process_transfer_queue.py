@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from payapp.transfer_queue import TransferWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Applies queued direct payments with a pool of shard-owning worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Worker threads.")
+        parser.add_argument('--batch-size', type=int, default=100, help="Transfers applied per transaction.")
+        parser.add_argument('--poll-interval', type=float, default=0.5, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        pool = TransferWorkerPool(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        )
+        self.stdout.write(f"Processing the transfer queue with {pool.workers} workers.")
+        pool.run(once=options['once'])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from payapp.notifications import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes every user's unread notification counters from payments and payment requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Users recounted per transaction.")
+
+    def handle(self, *args, **options):
+        rebuilt = 0
+        for count in rebuild_counters(batch_size=options['batch_size']):
+            rebuilt += count
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{rebuilt} users recounted")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt notification counters for {rebuilt} users."))
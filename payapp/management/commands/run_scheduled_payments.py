@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from payapp.scheduler import run_due_payments
+
+
+class Command(BaseCommand):
+    help = "Makes every scheduled payment that is due and advances its next run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Schedules claimed per transaction.")
+
+    def handle(self, *args, **options):
+        succeeded = failed = 0
+        for batch_succeeded, batch_failed in run_due_payments(batch_size=options['batch_size']):
+            succeeded += batch_succeeded
+            failed += batch_failed
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{succeeded + failed} scheduled payments processed")
+        self.stdout.write(self.style.SUCCESS(f"Made {succeeded} scheduled payments; {failed} failed."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp.account_shards import shard_account
+from register.models import OnlineAccount
+
+
+class Command(BaseCommand):
+    help = "Spreads a busy account's incoming credits over several sub-balance rows (1 turns sharding off)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="Email of the account holder.")
+        parser.add_argument('shards', type=int, help="Number of shards.")
+
+    def handle(self, *args, **options):
+        try:
+            account = OnlineAccount.objects.get(user__email=options['email'])
+        except OnlineAccount.DoesNotExist:
+            raise CommandError(f"No online account for {options['email']}.")
+        try:
+            shard_account(account, options['shards'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['email']} now has {account.shard_count} shard(s); balance {account.total_balance}."
+        ))
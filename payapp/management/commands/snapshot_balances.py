@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from payapp.ledger import reconcile, take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshots ledger balances of accounts with new entries, optionally reconciling them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Snapshots written per insert.")
+        parser.add_argument(
+            '--reconcile', action='store_true', help="Report accounts whose ledger and stored balances differ."
+        )
+
+    def handle(self, *args, **options):
+        written = take_snapshots(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} balance snapshots."))
+
+        if options['reconcile']:
+            mismatches = reconcile()
+            for account_id, ledger_balance, stored_balance in mismatches:
+                self.stdout.write(self.style.ERROR(
+                    f"Account {account_id}: ledger {ledger_balance}, stored {stored_balance}"
+                ))
+            if not mismatches:
+                self.stdout.write(self.style.SUCCESS("Ledger and stored balances agree."))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0008_alter_payment_timestamp_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="rate_version",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:03
+
+import thrift_client
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0009_payment_rate_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="timestamp_source",
+            field=models.CharField(
+                choices=[("server", "Thrift Server"), ("local", "Local Clock")],
+                default=thrift_client.get_timestamp_source,
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="paymentrequest",
+            name="timestamp_source",
+            field=models.CharField(
+                choices=[("server", "Thrift Server"), ("local", "Local Clock")],
+                default=thrift_client.get_timestamp_source,
+                max_length=10,
+            ),
+        ),
+    ]
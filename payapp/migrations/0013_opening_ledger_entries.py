@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_opening_entries(apps, schema_editor):
+    """
+    Starts the ledger of every existing account with its current balance.
+    """
+    OnlineAccount = apps.get_model("register", "OnlineAccount")
+    LedgerEntry = apps.get_model("payapp", "LedgerEntry")
+    LedgerEntry.objects.bulk_create(
+        (
+            LedgerEntry(account_id=account_id, kind="opening", amount=balance, currency=currency)
+            for account_id, balance, currency in OnlineAccount.objects.values_list("pk", "balance", "currency").iterator()
+        ),
+        batch_size=500,
+    )
+
+
+def delete_opening_entries(apps, schema_editor):
+    LedgerEntry = apps.get_model("payapp", "LedgerEntry")
+    LedgerEntry.objects.filter(kind="opening").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0012_ledger"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_opening_entries, delete_opening_entries),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:46
+
+from datetime import timedelta
+
+import payapp.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def expire_from_timestamp(apps, schema_editor):
+    """
+    Dates the expiry of existing requests from when they were made.
+    """
+    PaymentRequest = apps.get_model("payapp", "PaymentRequest")
+    PaymentRequest.objects.update(
+        expires_at=F("timestamp") + timedelta(seconds=settings.PAYMENT_REQUEST_TTL)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0015_scheduledpayment"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paymentrequest",
+            name="expires_at",
+            field=models.DateTimeField(default=payapp.models.payment_request_expiry),
+        ),
+        migrations.RunPython(expire_from_timestamp, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="paymentrequest",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("accepted", "Accepted"),
+                    ("rejected", "Rejected"),
+                    ("expired", "Expired"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paymentrequest",
+            index=models.Index(
+                fields=["status", "expires_at"], name="payment_request_expiry_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0016_paymentrequest_expiry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["sender", "origin", "timestamp", "id"],
+                name="payment_sender_origin_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("read_status", False)),
+                fields=["recipient", "origin", "timestamp", "id"],
+                name="payment_unread_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paymentrequest",
+            index=models.Index(
+                fields=["requester", "timestamp", "id"],
+                name="payment_request_requester_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paymentrequest",
+            index=models.Index(
+                condition=models.Q(("read_status", False)),
+                fields=["requestee", "status", "timestamp", "id"],
+                name="payment_request_unread_idx",
+            ),
+        ),
+    ]
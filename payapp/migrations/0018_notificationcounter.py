@@ -0,0 +1,79 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_unread(apps, schema_editor):
+    """
+    Starts every user's counters from the unread rows they already have.
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Payment = apps.get_model("payapp", "Payment")
+    PaymentRequest = apps.get_model("payapp", "PaymentRequest")
+    NotificationCounter = apps.get_model("payapp", "NotificationCounter")
+
+    counts = {
+        user_id: [0, 0, 0]
+        for user_id in User.objects.values_list("pk", flat=True).iterator()
+    }
+    unread_payments = (
+        Payment.objects.filter(read_status=False)
+        .values_list("recipient_id", "origin")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    for recipient_id, origin, count in unread_payments:
+        counts[recipient_id][0 if origin == "direct" else 1] = count
+    unread_requests = (
+        PaymentRequest.objects.filter(status="pending", read_status=False)
+        .values_list("requestee_id")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    for requestee_id, count in unread_requests:
+        counts[requestee_id][2] = count
+    NotificationCounter.objects.bulk_create(
+        (
+            NotificationCounter(
+                user_id=user_id,
+                unread_direct_payments=direct,
+                unread_request_payments=request_payments,
+                unread_requests=requests,
+            )
+            for user_id, (direct, request_payments, requests) in counts.items()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0017_dashboard_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationCounter",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="notification_counter",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("unread_direct_payments", models.IntegerField(default=0)),
+                ("unread_request_payments", models.IntegerField(default=0)),
+                ("unread_requests", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,151 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def read_status_to_watermarks(apps, schema_editor):
+    """
+    Sets each user's watermarks just below their oldest unread payment and
+    request, or to the newest ids if they have read everything. A read row
+    newer than an unread one cannot be skipped by a watermark, so it becomes
+    unread again; the counts are recomputed to match.
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Payment = apps.get_model("payapp", "Payment")
+    PaymentRequest = apps.get_model("payapp", "PaymentRequest")
+    NotificationCounter = apps.get_model("payapp", "NotificationCounter")
+
+    newest_payment = Payment.objects.aggregate(newest=Max("id"))["newest"] or 0
+    newest_request = PaymentRequest.objects.aggregate(newest=Max("id"))["newest"] or 0
+    oldest_unread_payment = dict(
+        Payment.objects.filter(read_status=False)
+        .values_list("recipient_id")
+        .annotate(oldest=Min("id"))
+        .order_by()
+    )
+    oldest_unread_request = dict(
+        PaymentRequest.objects.filter(read_status=False)
+        .values_list("requestee_id")
+        .annotate(oldest=Min("id"))
+        .order_by()
+    )
+    NotificationCounter.objects.all().delete()
+    NotificationCounter.objects.bulk_create(
+        (
+            NotificationCounter(
+                user_id=user_id,
+                last_seen_payment_id=oldest_unread_payment.get(
+                    user_id, newest_payment + 1
+                )
+                - 1,
+                last_seen_request_id=oldest_unread_request.get(
+                    user_id, newest_request + 1
+                )
+                - 1,
+            )
+            for user_id in User.objects.values_list("pk", flat=True).iterator()
+        ),
+        batch_size=500,
+    )
+
+    counters = {counter.pk: counter for counter in NotificationCounter.objects.all()}
+    payment_counts = (
+        Payment.objects.filter(
+            id__gt=F("recipient__notification_counter__last_seen_payment_id")
+        )
+        .values_list("recipient_id", "origin")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    for recipient_id, origin, count in payment_counts:
+        if origin == "direct":
+            counters[recipient_id].unread_direct_payments = count
+        else:
+            counters[recipient_id].unread_request_payments = count
+    request_counts = (
+        PaymentRequest.objects.filter(
+            status="pending",
+            id__gt=F("requestee__notification_counter__last_seen_request_id"),
+        )
+        .values_list("requestee_id")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    for requestee_id, count in request_counts:
+        counters[requestee_id].unread_requests = count
+    NotificationCounter.objects.bulk_update(
+        counters.values(),
+        ["unread_direct_payments", "unread_request_payments", "unread_requests"],
+        batch_size=500,
+    )
+
+
+def watermarks_to_read_status(apps, schema_editor):
+    Payment = apps.get_model("payapp", "Payment")
+    PaymentRequest = apps.get_model("payapp", "PaymentRequest")
+    NotificationCounter = apps.get_model("payapp", "NotificationCounter")
+
+    seen_payment = NotificationCounter.objects.filter(
+        user=OuterRef("recipient")
+    ).values("last_seen_payment_id")
+    Payment.objects.filter(id__lte=Coalesce(Subquery(seen_payment), 0)).update(
+        read_status=True
+    )
+    seen_request = NotificationCounter.objects.filter(
+        user=OuterRef("requestee")
+    ).values("last_seen_request_id")
+    PaymentRequest.objects.filter(id__lte=Coalesce(Subquery(seen_request), 0)).update(
+        read_status=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0018_notificationcounter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationcounter",
+            name="last_seen_payment_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="notificationcounter",
+            name="last_seen_request_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(read_status_to_watermarks, watermarks_to_read_status),
+        migrations.RemoveIndex(
+            model_name="payment",
+            name="payment_unread_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="paymentrequest",
+            name="payment_request_unread_idx",
+        ),
+        migrations.RemoveField(
+            model_name="payment",
+            name="read_status",
+        ),
+        migrations.RemoveField(
+            model_name="paymentrequest",
+            name="read_status",
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["recipient", "origin", "id"],
+                name="payment_recipient_origin_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="paymentrequest",
+            index=models.Index(
+                fields=["requestee", "status", "id"],
+                name="payment_request_requestee_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payapp", "0019_read_watermarks"),
+        ("register", "0002_account_shards"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ledgerentry",
+            index=models.Index(
+                fields=["account", "id"], name="ledger_account_entry_idx"
+            ),
+        ),
+    ]
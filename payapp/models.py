@@ -1,6 +1,15 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
-from thrift_client import get_timestamp
+from django.utils import timezone
+from thrift_client import get_timestamp, get_timestamp_source
+
+TIMESTAMP_SOURCE_CHOICES = [
+    ('server', 'Thrift Server'),
+    ('local', 'Local Clock'),
+]
 
 class Payment(models.Model):
     DIRECT_PAYMENT = 'direct'
@@ -17,24 +26,254 @@ class Payment(models.Model):
     original_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     original_currency = models.CharField(max_length=3, default='GBP')
     timestamp = models.DateTimeField(default=get_timestamp)
+    timestamp_source = models.CharField(max_length=10, choices=TIMESTAMP_SOURCE_CHOICES, default=get_timestamp_source)
     origin = models.CharField(max_length=10, choices=ORIGIN_CHOICES, default=DIRECT_PAYMENT)
-    read_status = models.BooleanField(default=False)
+    rate_version = models.CharField(max_length=16, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Sent lists on the dashboard, newest first.
+            models.Index(fields=['sender', 'origin', 'timestamp', 'id'], name='payment_sender_origin_idx'),
+            # Received lists, unread being the ids above the recipient's watermark.
+            models.Index(fields=['recipient', 'origin', 'id'], name='payment_recipient_origin_idx'),
+        ]
+
     def __str__(self):
         return f"Payment from {self.sender} to {self.recipient} of {self.amount} {self.currency}"
 
 
+def payment_request_expiry():
+    """
+    Default expiry of a new payment request, PAYMENT_REQUEST_TTL seconds from now.
+    """
+    return timezone.now() + timedelta(seconds=settings.PAYMENT_REQUEST_TTL)
+
+
+class PaymentRequestQuerySet(models.QuerySet):
+    def live(self):
+        """
+        Pending requests that have not expired, whether or not the sweeper has
+        marked them yet.
+        """
+        return self.filter(status='pending', expires_at__gt=timezone.now())
+
+
 class PaymentRequest(models.Model):
     requester = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payment_requests')
     requestee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_requests')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='GBP')
     timestamp = models.DateTimeField(default=get_timestamp)
+    timestamp_source = models.CharField(max_length=10, choices=TIMESTAMP_SOURCE_CHOICES, default=get_timestamp_source)
+    expires_at = models.DateTimeField(default=payment_request_expiry)
     STATUS_CHOICES = [
          ('pending', 'Pending'),
          ('accepted', 'Accepted'),
          ('rejected', 'Rejected'),
+         ('expired', 'Expired'),
     ]
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
-    read_status = models.BooleanField(default=False)
+
+    objects = PaymentRequestQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Pending requests in expiry order, for "manage.py expire_payment_requests".
+            models.Index(fields=['status', 'expires_at'], name='payment_request_expiry_idx'),
+            # Requests the user has made, newest first.
+            models.Index(fields=['requester', 'timestamp', 'id'], name='payment_request_requester_idx'),
+            # Pending requests received, unread being the ids above the requestee's watermark.
+            models.Index(fields=['requestee', 'status', 'id'], name='payment_request_requestee_idx'),
+        ]
+
     def __str__(self):
         return f"Request from {self.requester.username} to {self.requestee.username}: {self.amount} {self.currency} ({self.status})"
+
+
+class NotificationCounter(models.Model):
+    """
+    A user's read state and unread badge counts.
+
+    Payments and requests the user has received are read up to the
+    last_seen ids; anything with a higher id is unread, so marking everything
+    read moves the watermarks and writes only this row. The counts are kept
+    up to date by payapp.notifications in the same transaction as the
+    payments and requests they count, so the dashboard reads one row by
+    primary key instead of counting. Rows are created on first use;
+    "manage.py rebuild_notification_counters" recomputes the counts.
+    """
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE, related_name='notification_counter')
+    last_seen_payment_id = models.BigIntegerField(default=0)
+    last_seen_request_id = models.BigIntegerField(default=0)
+    unread_direct_payments = models.IntegerField(default=0)
+    unread_request_payments = models.IntegerField(default=0)
+    unread_requests = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Notification counter for {self.user}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a POST sent with an idempotency key, so a retried request is
+    answered from here instead of running the payment again. Rows are claimed
+    before the view runs and filled in once it has finished.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    completed = models.BooleanField(default=False)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_location = models.CharField(max_length=255, blank=True, default='')
+    response_messages = models.JSONField(default=list, blank=True)
+    response_body = models.TextField(blank=True, default='')
+    response_content_type = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for {self.user}"
+
+
+class LedgerEntry(models.Model):
+    """
+    Append-only record of every balance movement. A transfer writes one
+    negative DEBIT row for the sender and one positive CREDIT row for the
+    recipient, each in that account's currency; OPENING rows hold the
+    balance an account was created with. Rows are never updated.
+    """
+    OPENING = 'opening'
+    DEBIT = 'debit'
+    CREDIT = 'credit'
+    KIND_CHOICES = [
+        (OPENING, 'Opening Balance'),
+        (DEBIT, 'Debit'),
+        (CREDIT, 'Credit'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    account = models.ForeignKey('register.OnlineAccount', on_delete=models.CASCADE, related_name='ledger_entries')
+    payment = models.ForeignKey(Payment, null=True, blank=True, on_delete=models.CASCADE, related_name='ledger_entries')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    currency = models.CharField(max_length=3)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'created_at'], name='ledger_account_created_idx'),
+            models.Index(fields=['account', 'id'], name='ledger_account_entry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} of {self.amount} {self.currency} on account {self.account_id}"
+
+
+class BalanceSnapshot(models.Model):
+    """
+    An account's ledger balance covering every entry up to last_entry_id.
+    The balance at any later point is the snapshot plus the entries after it.
+    """
+    account = models.ForeignKey('register.OnlineAccount', on_delete=models.CASCADE, related_name='balance_snapshots')
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_entry_id = models.BigIntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'taken_at'], name='snapshot_account_taken_idx'),
+            models.Index(fields=['account', 'last_entry_id'], name='snapshot_account_entry_idx'),
+        ]
+
+    def __str__(self):
+        return f"Balance {self.balance} for account {self.account_id} at {self.taken_at}"
+
+
+class PendingTransfer(models.Model):
+    """
+    A direct payment queued for a transfer worker instead of being applied in
+    the request. Transfers are sharded by recipient, and each shard is worked
+    by one worker at a time, in id order.
+    """
+    QUEUED = 'queued'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+    sender = models.ForeignKey(User, related_name='pending_transfers_sent', on_delete=models.CASCADE)
+    recipient = models.ForeignKey(User, related_name='pending_transfers_received', on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default='GBP')
+    shard = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.CharField(max_length=255, blank=True, default='')
+    payment = models.OneToOneField(Payment, null=True, blank=True, on_delete=models.SET_NULL, related_name='pending_transfer')
+    created_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shard', 'status', 'id'], name='pending_transfer_shard_idx'),
+        ]
+
+    def __str__(self):
+        return f"Pending transfer {self.pk} from {self.sender} to {self.recipient} ({self.status})"
+
+
+class ScheduledPayment(models.Model):
+    """
+    A standing order: a direct payment repeated every interval days, weeks
+    or months from start_at until end_at, or made once. The scheduler runs
+    every active row whose next_run_at has passed.
+    """
+    ONCE = 'once'
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    RECURRENCE_CHOICES = [
+        (ONCE, 'Once'),
+        (DAILY, 'Daily'),
+        (WEEKLY, 'Weekly'),
+        (MONTHLY, 'Monthly'),
+    ]
+    ACTIVE = 'active'
+    COMPLETED = 'completed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (COMPLETED, 'Completed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    sender = models.ForeignKey(User, related_name='scheduled_payments_sent', on_delete=models.CASCADE)
+    recipient = models.ForeignKey(User, related_name='scheduled_payments_received', on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default='GBP')
+    recurrence = models.CharField(max_length=10, choices=RECURRENCE_CHOICES, default=ONCE)
+    interval = models.PositiveSmallIntegerField(default=1)
+    start_at = models.DateTimeField()
+    end_at = models.DateTimeField(null=True, blank=True)
+    next_run_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    run_count = models.PositiveIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    last_payment = models.ForeignKey(Payment, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_run_at', 'id'], name='scheduled_payment_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.recurrence} payment of {self.amount} {self.currency} from {self.sender} to {self.recipient}"
@@ -0,0 +1,121 @@
+import heapq
+from collections import namedtuple
+
+from django.db import transaction
+
+from payapp.models import Payment, PaymentRequest
+from payapp.notifications import requests_closed
+from payapp.rates import rate_provider
+from payapp.transfers import InsufficientFunds, pay_rows
+from register.models import OnlineAccount
+
+NettingResult = namedtuple('NettingResult', ['settled_requests', 'transfers', 'payments'])
+
+# Request ids marked accepted per UPDATE, well under SQLite's variable limit.
+UPDATE_CHUNK = 1000
+
+
+def net_positions(edges):
+    """
+    Sums (debtor_id, creditor_id, amount) edges into {user_id: net amount},
+    positive for users who are owed money and negative for users who owe it.
+    Cycles cancel out here: A owes B, B owes C, C owes A leaves nobody owing.
+    """
+    positions = {}
+    for debtor, creditor, amount in edges:
+        positions[debtor] = positions.get(debtor, 0) - amount
+        positions[creditor] = positions.get(creditor, 0) + amount
+    return positions
+
+
+def settle_positions(positions):
+    """
+    Returns [(debtor_id, creditor_id, amount)] transfers that bring every
+    net position to zero. The largest debtor always pays the largest
+    creditor, so each transfer clears at least one of them and there are at
+    most (users with a non-zero position - 1) transfers.
+    """
+    debtors = [(amount, user_id) for user_id, amount in positions.items() if amount < 0]
+    creditors = [(-amount, user_id) for user_id, amount in positions.items() if amount > 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers = []
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+        transfers.append((debtor, creditor, amount))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+    return transfers
+
+
+def net_payment_requests(users, currency='GBP', rates=None):
+    """
+    Settles every live payment request between users (an iterable of
+    User) with as few transfers as the netting allows.
+
+    Requests are locked and converted to currency, netted per user, and
+    the resulting transfers are paid with pay_rows(), one call per debtor.
+    The requests are then marked accepted. Everything happens in one
+    transaction: if any debtor cannot cover their net debt, InsufficientFunds
+    is raised and nothing changes.
+    """
+    if rates is None:
+        rates = rate_provider.snapshot()
+    if currency not in rates.currencies:
+        raise ValueError(f"Unsupported currency {currency}")
+    users = {user.pk: user for user in users}
+
+    with transaction.atomic():
+        requests = list(
+            PaymentRequest.objects.live().select_for_update()
+            .filter(requester_id__in=list(users), requestee_id__in=list(users))
+            .values_list('pk', 'requestee_id', 'requester_id', 'amount', 'currency')
+        )
+        # Converted once per currency; the requestee owes the requester.
+        edges = []
+        for from_currency in {request[4] for request in requests}:
+            group = [request for request in requests if request[4] == from_currency]
+            amounts = [request[3] for request in group]
+            if from_currency != currency:
+                amounts = rates.convert_many(from_currency, currency, amounts)
+                if amounts is None:
+                    raise ValueError(f"Unsupported currency pair {from_currency} -> {currency}")
+            edges.extend(
+                (requestee, requester, amount)
+                for (_, requestee, requester, _, _), amount in zip(group, amounts)
+            )
+
+        transfers = settle_positions(net_positions(edges))
+
+        accounts = {
+            account.user_id: account
+            for account in OnlineAccount.objects.select_related('user')
+            .only('id', 'currency', 'shard_count', 'user__id', 'user__email')
+            .filter(user_id__in={creditor for _, creditor, _ in transfers})
+        }
+        by_debtor = {}
+        for debtor, creditor, amount in transfers:
+            if creditor not in accounts:
+                raise OnlineAccount.DoesNotExist(f"{users[creditor].email} has no online account")
+            by_debtor.setdefault(debtor, []).append(
+                {'account': accounts[creditor], 'amount': amount, 'currency': currency}
+            )
+
+        payments = []
+        for debtor, rows in by_debtor.items():
+            paid, unpaid = pay_rows(users[debtor], rows, Payment.PAYMENT_REQUEST, rates)
+            if unpaid:
+                raise InsufficientFunds(debtor)
+            payments.extend(payment for _, payment in paid)
+
+        request_ids = [request[0] for request in requests]
+        for start in range(0, len(request_ids), UPDATE_CHUNK):
+            PaymentRequest.objects.filter(pk__in=request_ids[start:start + UPDATE_CHUNK]).update(status='accepted')
+        requests_closed((request[1], request[0]) for request in requests)
+
+    return NettingResult(len(request_ids), transfers, payments)
@@ -0,0 +1,157 @@
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, F, Subquery
+from django.db.models.functions import Coalesce
+
+from payapp.models import NotificationCounter, Payment, PaymentRequest
+
+COUNTERS = ('unread_direct_payments', 'unread_request_payments', 'unread_requests')
+PAYMENT_COUNTERS = {Payment.DIRECT_PAYMENT: 0, Payment.PAYMENT_REQUEST: 1}
+
+
+def _watermark(user, field):
+    # The user's watermark as a scalar subquery; 0 (nothing read) without a row.
+    return Coalesce(Subquery(NotificationCounter.objects.filter(pk=user.pk).values(field)), 0)
+
+
+def unread_payments(user):
+    """
+    Payments user has received since they last marked everything read: an
+    id range above their watermark rather than a per-row flag.
+    """
+    return Payment.objects.filter(recipient=user, id__gt=_watermark(user, 'last_seen_payment_id'))
+
+
+def unread_requests(user):
+    """
+    Payment requests user has received since they last marked everything read.
+    """
+    return PaymentRequest.objects.filter(requestee=user, id__gt=_watermark(user, 'last_seen_request_id'))
+
+
+def add_to_counters(deltas):
+    """
+    Adds {user_id: [direct payments, request payments, requests]} to the
+    users' counters with one executemany of
+        INSERT ... ON CONFLICT (user_id) DO UPDATE SET a = a + excluded.a
+    creating any missing rows. Runs in the caller's transaction, so the
+    counts commit or roll back with the rows they count.
+    """
+    if not deltas:
+        return
+    meta = NotificationCounter._meta
+    quote = connection.ops.quote_name
+    pk = quote(meta.pk.column)
+    columns = [quote(meta.get_field(name).column) for name in COUNTERS]
+    # A new row has read nothing yet.
+    watermarks = [quote(meta.get_field(name).column) for name in ('last_seen_payment_id', 'last_seen_request_id')]
+    increments = ', '.join(f"{column} = {column} + excluded.{column}" for column in columns)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {quote(meta.db_table)} ({pk}, {', '.join(columns + watermarks)}) "
+            f"VALUES (%s, {', '.join(['%s'] * len(columns))}, 0, 0) "
+            f"ON CONFLICT ({pk}) DO UPDATE SET {increments}",
+            # In user order, so concurrent writers take row locks in the same order.
+            [[user_id, *counts] for user_id, counts in sorted(deltas.items())],
+        )
+
+
+def payments_created(payments):
+    """
+    Counts newly saved payments as unread for their recipients.
+    """
+    deltas = {}
+    for payment in payments:
+        deltas.setdefault(payment.recipient_id, [0, 0, 0])[PAYMENT_COUNTERS[payment.origin]] += 1
+    add_to_counters(deltas)
+
+
+def requests_created(payment_requests):
+    """
+    Counts newly saved payment requests as unread for their requestees.
+    """
+    deltas = {}
+    for payment_request in payment_requests:
+        deltas.setdefault(payment_request.requestee_id, [0, 0, 0])[2] += 1
+    add_to_counters(deltas)
+
+
+def requests_closed(payment_requests):
+    """
+    Takes pending requests that were just accepted, rejected or expired off
+    their requestees' counts, if they were still unread. payment_requests is
+    an iterable of (requestee_id, request_id) pairs.
+    """
+    payment_requests = list(payment_requests)
+    if not payment_requests:
+        return
+    seen = dict(
+        NotificationCounter.objects.filter(pk__in={requestee_id for requestee_id, _ in payment_requests})
+        .values_list('pk', 'last_seen_request_id')
+    )
+    deltas = {}
+    for requestee_id, request_id in payment_requests:
+        if request_id > seen.get(requestee_id, 0):
+            deltas.setdefault(requestee_id, [0, 0, 0])[2] -= 1
+    add_to_counters(deltas)
+
+
+def mark_all_read(user):
+    """
+    Marks everything user has received as read with one single-row UPDATE:
+    the watermarks move to the newest payment and request ids and the counts
+    go to zero. A user without a row has received nothing to mark.
+    """
+    NotificationCounter.objects.filter(pk=user.pk).update(
+        last_seen_payment_id=Coalesce(
+            Subquery(Payment.objects.order_by('-pk').values('pk')[:1]), F('last_seen_payment_id')
+        ),
+        last_seen_request_id=Coalesce(
+            Subquery(PaymentRequest.objects.order_by('-pk').values('pk')[:1]), F('last_seen_request_id')
+        ),
+        **{name: 0 for name in COUNTERS},
+    )
+
+
+def rebuild_counters(batch_size=1000):
+    """
+    Recomputes every user's counters from Payment and PaymentRequest,
+    batch_size users at a time, walking users by id so memory stays flat.
+    Each batch is counted and written in one transaction, so it cannot
+    interleave with payments to the same users. Yields the users per batch.
+    """
+    after = 0
+    while True:
+        with transaction.atomic():
+            user_ids = list(User.objects.filter(pk__gt=after).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                return
+            after = user_ids[-1]
+            counts = {user_id: [0, 0, 0] for user_id in user_ids}
+            payment_counts = (
+                Payment.objects.filter(recipient_id__in=user_ids)
+                .alias(seen=Coalesce(F('recipient__notification_counter__last_seen_payment_id'), 0))
+                .filter(id__gt=F('seen'))
+                .values_list('recipient_id', 'origin')
+                .annotate(count=Count('pk'))
+                .order_by()
+            )
+            for recipient_id, origin, count in payment_counts:
+                counts[recipient_id][PAYMENT_COUNTERS[origin]] = count
+            request_counts = (
+                PaymentRequest.objects.filter(requestee_id__in=user_ids, status='pending')
+                .alias(seen=Coalesce(F('requestee__notification_counter__last_seen_request_id'), 0))
+                .filter(id__gt=F('seen'))
+                .values_list('requestee_id')
+                .annotate(count=Count('pk'))
+                .order_by()
+            )
+            for requestee_id, count in request_counts:
+                counts[requestee_id][2] = count
+            NotificationCounter.objects.bulk_create(
+                (NotificationCounter(user_id=user_id, **dict(zip(COUNTERS, values))) for user_id, values in counts.items()),
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=COUNTERS,
+            )
+        yield len(user_ids)
@@ -0,0 +1,102 @@
+from django.db import transaction
+from django.utils import timezone
+
+from payapp.models import Payment, PaymentRequest
+from payapp.notifications import requests_closed
+from payapp.rates import rate_provider
+from payapp.transfers import pay_rows
+from register.models import OnlineAccount
+
+
+def _failed(request_id, error):
+    return {'request_id': request_id, 'status': 'failed', 'error': error}
+
+
+def bulk_accept_requests(user, request_ids, rates=None):
+    """
+    Accepts and pays many of user's pending payment requests in one
+    transaction. The requests are locked and read with one query, the
+    requesters' accounts with another, and the payments are made with
+    pay_rows(), so user's account is locked and its balance checked once.
+    Requests are paid in the order given while the balance lasts.
+
+    Returns one result dict per request id, in order, with either the
+    created payment_id or an error.
+    """
+    if rates is None:
+        rates = rate_provider.snapshot()
+
+    results = [None] * len(request_ids)
+    now = timezone.now()
+    with transaction.atomic():
+        requests = {
+            payment_request.pk: payment_request
+            for payment_request in PaymentRequest.objects.select_for_update()
+            .filter(pk__in=request_ids, requestee=user)
+        }
+        accounts = {
+            account.user_id: account
+            for account in OnlineAccount.objects.select_related('user')
+            .only('id', 'currency', 'shard_count', 'user__id', 'user__email')
+            .filter(user_id__in={payment_request.requester_id for payment_request in requests.values()})
+        }
+
+        rows = []
+        claimed = set()
+        for index, request_id in enumerate(request_ids):
+            payment_request = requests.get(request_id)
+            if payment_request is None:
+                results[index] = _failed(request_id, "Payment request not found")
+            elif payment_request.status != 'pending' or request_id in claimed:
+                results[index] = _failed(request_id, "Payment request is no longer pending")
+            elif payment_request.expires_at <= now:
+                results[index] = _failed(request_id, "Payment request has expired")
+            elif payment_request.requester_id not in accounts:
+                results[index] = _failed(request_id, "Requester has no online account")
+            else:
+                claimed.add(request_id)
+                rows.append({
+                    'index': index,
+                    'request': payment_request,
+                    'account': accounts[payment_request.requester_id],
+                    'amount': payment_request.amount,
+                    'currency': payment_request.currency,
+                })
+
+        paid, unpaid = pay_rows(user, rows, Payment.PAYMENT_REQUEST, rates)
+        PaymentRequest.objects.filter(pk__in=[row['request'].pk for row, _ in paid]).update(status='accepted')
+        requests_closed((row['request'].requestee_id, row['request'].pk) for row, _ in paid)
+
+    for row in unpaid:
+        results[row['index']] = _failed(row['request'].pk, "Insufficient balance")
+    for row, payment in paid:
+        results[row['index']] = {'request_id': row['request'].pk, 'status': 'ok', 'payment_id': payment.pk}
+    return results
+
+
+def bulk_reject_requests(user, request_ids):
+    """
+    Rejects many of user's pending payment requests with one UPDATE.
+    Returns one result dict per request id, in order.
+    """
+    with transaction.atomic():
+        statuses = dict(
+            PaymentRequest.objects.select_for_update()
+            .filter(pk__in=request_ids, requestee=user)
+            .values_list('pk', 'status')
+        )
+        pending = [request_id for request_id, status in statuses.items() if status == 'pending']
+        PaymentRequest.objects.filter(pk__in=pending).update(status='rejected')
+        requests_closed((user.pk, request_id) for request_id in pending)
+
+    results = []
+    rejected = set()
+    for request_id in request_ids:
+        if request_id not in statuses:
+            results.append(_failed(request_id, "Payment request not found"))
+        elif statuses[request_id] != 'pending' or request_id in rejected:
+            results.append(_failed(request_id, "Payment request is no longer pending"))
+        else:
+            rejected.add(request_id)
+            results.append({'request_id': request_id, 'status': 'ok'})
+    return results
@@ -0,0 +1,142 @@
+import logging
+import random
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class RateServiceClient:
+    """
+    Pooled HTTP client for a remote conversion service exposing the same
+    /conversion/<currency1>/<currency2>/<amount>/ API as payapp.
+
+    Connections are kept alive in a bounded pool, every request has connect
+    and read timeouts, failed requests are retried a bounded number of times
+    with jittered backoff, and a circuit breaker stops calling the service
+    while it is down. Rates are cached for cache_ttl seconds; when the service
+    cannot be reached the last good rate for the pair is served instead.
+    """
+
+    def __init__(self, base_url, connect_timeout=1.0, read_timeout=2.0, retries=2,
+                 backoff=0.1, pool_size=10, cache_ttl=60.0, verify=True, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.cache_ttl = cache_ttl
+        self.verify = verify
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._counters = {
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'stale_hits': 0,
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'short_circuits': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def get_rate(self, currency1, currency2):
+        """
+        Returns the Decimal rate for currency1 -> currency2, or None if the
+        service does not support the pair and no earlier rate is cached.
+        """
+        key = (currency1, currency2)
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.cache_ttl:
+            self._count('cache_hits')
+            return cached[0]
+        self._count('cache_misses')
+
+        if not self.breaker.allow_request():
+            self._count('short_circuits')
+            return self._last_good(key)
+
+        try:
+            rate = self._fetch(currency1, currency2)
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure()
+            self._count('failures')
+            logger.warning(f"Rate service unavailable for {currency1}->{currency2}: {e}")
+            return self._last_good(key)
+
+        self.breaker.record_success()
+        if rate is not None:
+            self._cache[key] = (rate, time.monotonic())
+        return rate
+
+    def _fetch(self, currency1, currency2):
+        url = f"{self.base_url}/{currency1}/{currency2}/1/"
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count('retries')
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            started = time.monotonic()
+            try:
+                self._count('requests')
+                response = self.session.get(url, timeout=self.timeout, verify=self.verify)
+            except requests.exceptions.RequestException:
+                if attempt == self.retries:
+                    raise
+                continue
+            finally:
+                self._record_latency(time.monotonic() - started)
+
+            if response.status_code >= 500:
+                if attempt == self.retries:
+                    response.raise_for_status()
+                continue
+            if response.status_code != 200:
+                # The service answered but does not support this pair.
+                return None
+            try:
+                return Decimal(str(response.json()['rate']))
+            except (ValueError, KeyError, TypeError, InvalidOperation) as e:
+                raise requests.exceptions.InvalidJSONError(f"Malformed rate response: {e}")
+
+    def _last_good(self, key):
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        self._count('stale_hits')
+        return cached[0]
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _record_latency(self, seconds):
+        with self._lock:
+            self._counters['latency_total'] += seconds
+            self._counters['latency_max'] = max(self._counters['latency_max'], seconds)
+
+    def stats(self):
+        """
+        Returns a copy of the client's counters plus the breaker state and
+        the mean request latency in milliseconds.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['latency_avg_ms'] = round(stats['latency_total'] * 1000 / stats['requests'], 3) if stats['requests'] else 0.0
+        stats['circuit'] = self.breaker.state
+        return stats
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,242 @@
+import csv
+import hashlib
+import json
+import logging
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+
+from payapp.rate_client import RateServiceClient
+
+logger = logging.getLogger(__name__)
+
+# Hardcoded exchange rates used by the conversion API and the payment views.
+EXCHANGE_RATES = {
+    'USD': {'GBP': 0.75, 'EUR': 0.85},
+    'GBP': {'USD': 1.33, 'EUR': 1.14},
+    'EUR': {'USD': 1.18, 'GBP': 0.88},
+}
+
+CENTS = Decimal('0.01')
+
+
+class RateEngine:
+    """
+    In-process currency converter backed by a precomputed cross-rate matrix.
+    Every supported (base, target) pair is resolved once when the engine is
+    built, so a conversion is a single dictionary lookup.
+
+    An engine is an immutable snapshot of one rate table. Its version is a
+    hash of the matrix, so the same table gets the same version in every worker.
+    """
+
+    def __init__(self, table):
+        self.matrix = self.build_matrix(table)
+        self.currencies = frozenset(currency for pair in self.matrix for currency in pair)
+        canonical = ';'.join(f"{base}{target}={rate}" for (base, target), rate in sorted(self.matrix.items()))
+        self.version = hashlib.sha256(canonical.encode()).hexdigest()[:12]
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def build_matrix(table):
+        """
+        Builds the {(base, target): Decimal rate} matrix from a nested rate table.
+        Identity pairs are added for every currency, and a missing direction is
+        filled in with the inverse of the opposite quote.
+        """
+        matrix = {}
+        for base, quotes in table.items():
+            matrix[(base, base)] = Decimal('1')
+            for target, rate in quotes.items():
+                matrix[(base, target)] = Decimal(str(rate))
+                matrix.setdefault((target, target), Decimal('1'))
+
+        for (base, target), rate in list(matrix.items()):
+            if (target, base) not in matrix and rate:
+                matrix[(target, base)] = (Decimal('1') / rate).quantize(Decimal('0.000001'))
+        return matrix
+
+    def rate(self, currency1, currency2):
+        """
+        Returns the Decimal rate for currency1 -> currency2, or None if unsupported.
+        """
+        return self.matrix.get((currency1, currency2))
+
+    def convert(self, currency1, currency2, amount):
+        """
+        Converts amount from currency1 to currency2, rounded to cents.
+        Returns None if the currency pair is unsupported or the amount is not finite.
+        """
+        conversion_rate = self.matrix.get((currency1, currency2))
+        amount = Decimal(str(amount))
+        if conversion_rate is None or not amount.is_finite():
+            return None
+        return (amount * conversion_rate).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+    def convert_many(self, currency1, currency2, amounts):
+        """
+        Converts a sequence of Decimal amounts for one currency pair, looking the
+        rate up once. Each result is rounded exactly like convert(), so batch and
+        single conversions always agree. Returns None if the pair is unsupported.
+        """
+        conversion_rate = self.matrix.get((currency1, currency2))
+        if conversion_rate is None:
+            return None
+        return [(amount * conversion_rate).quantize(CENTS, rounding=ROUND_HALF_UP) for amount in amounts]
+
+
+class StaticRateSource:
+    """
+    Rate source serving a fixed in-memory table (the built-in EXCHANGE_RATES by default).
+    """
+
+    def __init__(self, table=None):
+        self.table = EXCHANGE_RATES if table is None else table
+
+    def load(self):
+        return self.table
+
+
+class JSONFileRateSource:
+    """
+    Rate source reading a nested {"USD": {"GBP": 0.75}} table from a JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+
+class CSVFileRateSource:
+    """
+    Rate source reading "base,target,rate" rows from a CSV file with a header line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        table = {}
+        with open(self.path, newline='') as f:
+            for row in csv.DictReader(f):
+                table.setdefault(row['base'].strip(), {})[row['target'].strip()] = row['rate'].strip()
+        return table
+
+
+class RemoteRateSource:
+    """
+    Rate source asking a remote conversion service for every supported pair.
+    The pooled client serves the last good rate for a pair while the service
+    is unreachable, so a refresh during an outage keeps the previous rates.
+    """
+
+    def __init__(self, client, currencies=None):
+        self.client = client
+        self.currencies = sorted(currencies or EXCHANGE_RATES)
+
+    def load(self):
+        table = {}
+        for base in self.currencies:
+            for target in self.currencies:
+                if base == target:
+                    continue
+                conversion_rate = self.client.get_rate(base, target)
+                if conversion_rate is not None:
+                    table.setdefault(base, {})[target] = conversion_rate
+        if not table:
+            raise RuntimeError(f"No rates available from {self.client.base_url}")
+        return table
+
+
+class RateProvider:
+    """
+    Holds the current RateEngine snapshot and refreshes it from a rate source.
+
+    Once a snapshot is older than ttl seconds, the next read starts a background
+    refresh and keeps serving the old snapshot until the new one is swapped in,
+    so the request path never waits on the source.
+    """
+
+    def __init__(self, source, ttl=300):
+        self.source = source
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._snapshot = None
+        self._expires_at = 0
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Initial exchange-rate load failed, using built-in rates: {e}")
+            self._snapshot = RateEngine(EXCHANGE_RATES)
+            self._expires_at = time.monotonic() + self.ttl
+
+    def snapshot(self):
+        """
+        Returns the current snapshot, scheduling a background refresh if it has expired.
+        """
+        snapshot = self._snapshot
+        if time.monotonic() > self._expires_at:
+            self._schedule_refresh()
+        return snapshot
+
+    def refresh(self):
+        """
+        Loads the source synchronously and swaps in the new snapshot.
+        """
+        snapshot = RateEngine(self.source.load())
+        if self._snapshot is not None and snapshot.version != self._snapshot.version:
+            logger.info(f"Exchange rates updated: {self._snapshot.version} -> {snapshot.version}")
+        self._snapshot = snapshot
+        self._expires_at = time.monotonic() + self.ttl
+        return snapshot
+
+    def _schedule_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='rate-refresh', daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # Keep serving the last good snapshot; retry after another TTL.
+            logger.error(f"Exchange-rate refresh failed: {e}")
+            self._expires_at = time.monotonic() + self.ttl
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+def build_rate_source(path=None):
+    """
+    Picks a rate source from a file path or URL: http(s) URLs use the remote
+    conversion service, .json and .csv files are read from disk, and no path
+    means the built-in EXCHANGE_RATES.
+    """
+    if not path:
+        return StaticRateSource()
+    if str(path).startswith(('http://', 'https://')):
+        connect_timeout, read_timeout = getattr(settings, 'EXCHANGE_RATE_SERVICE_TIMEOUT', (1.0, 2.0))
+        return RemoteRateSource(RateServiceClient(
+            str(path),
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            verify=getattr(settings, 'EXCHANGE_RATE_SERVICE_VERIFY', True),
+        ))
+    if str(path).endswith('.csv'):
+        return CSVFileRateSource(path)
+    return JSONFileRateSource(path)
+
+
+rate_provider = RateProvider(
+    build_rate_source(getattr(settings, 'EXCHANGE_RATE_SOURCE', None)),
+    ttl=getattr(settings, 'EXCHANGE_RATE_TTL', 300),
+)
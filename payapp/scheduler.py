@@ -0,0 +1,121 @@
+import calendar
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from payapp.models import ScheduledPayment
+from payapp.rates import rate_provider
+from payapp.transfers import transfer, InsufficientFunds
+from payapp.utils import update_rows
+from register.models import OnlineAccount
+
+logger = logging.getLogger(__name__)
+
+
+def add_months(when, months, day):
+    """
+    Returns when moved forward by months, on the given day of the month or
+    the month's last day if it is shorter (31 Jan + 1 month = 28/29 Feb).
+    """
+    month_index = when.month - 1 + months
+    year, month = when.year + month_index // 12, month_index % 12 + 1
+    return when.replace(year=year, month=month, day=min(day, calendar.monthrange(year, month)[1]))
+
+
+def following_run(schedule, run_at):
+    """
+    Returns the occurrence of schedule after run_at, or None for one-off payments.
+    """
+    if schedule.recurrence == ScheduledPayment.DAILY:
+        return run_at + timedelta(days=schedule.interval)
+    if schedule.recurrence == ScheduledPayment.WEEKLY:
+        return run_at + timedelta(weeks=schedule.interval)
+    if schedule.recurrence == ScheduledPayment.MONTHLY:
+        # Counted from start_at's day, so a 31st does not drift to the 28th.
+        return add_months(run_at, schedule.interval, schedule.start_at.day)
+    return None
+
+
+def advance(schedule, now):
+    """
+    Moves next_run_at to the first occurrence after now, skipping any that
+    were missed, so a late run pays once rather than once per missed period.
+    Completes the schedule when it has no occurrence left.
+    """
+    next_run_at = following_run(schedule, schedule.next_run_at)
+    while next_run_at is not None and next_run_at <= now:
+        next_run_at = following_run(schedule, next_run_at)
+    if next_run_at is None or (schedule.end_at is not None and next_run_at > schedule.end_at):
+        schedule.status = ScheduledPayment.COMPLETED
+    else:
+        schedule.next_run_at = next_run_at
+
+
+def _run(schedule, now, rates):
+    """
+    Pays one occurrence in its own savepoint, so a schedule that fails for
+    any reason is recorded and advanced without undoing the rest of the batch.
+    """
+    schedule.last_run_at = now
+    try:
+        with transaction.atomic():
+            result = transfer(schedule.sender, schedule.recipient, schedule.amount, schedule.currency, rates=rates)
+    except InsufficientFunds:
+        schedule.failure_count += 1
+        schedule.last_error = "Insufficient balance"
+    except (OnlineAccount.DoesNotExist, ValueError) as e:
+        schedule.failure_count += 1
+        schedule.last_error = str(e)[:255]
+    except Exception as e:
+        logger.exception("Scheduled payment %s failed", schedule.pk)
+        schedule.failure_count += 1
+        schedule.last_error = (str(e) or type(e).__name__)[:255]
+    else:
+        schedule.run_count += 1
+        schedule.last_error = ''
+        schedule.last_payment = result.payment
+    advance(schedule, now)
+
+
+UPDATED_FIELDS = [
+    'status', 'next_run_at', 'run_count', 'failure_count', 'last_run_at', 'last_error', 'last_payment',
+]
+
+
+def run_due_payments(batch_size=500, now=None):
+    """
+    Runs every active schedule due by now through the same transfer() as
+    direct_payment and advances it. Yields (succeeded, failed) per batch.
+
+    Due rows are claimed batch_size at a time with SELECT ... FOR UPDATE SKIP
+    LOCKED (where the database supports it), so several schedulers can share a
+    backlog, and batches are walked by (next_run_at, id) keyset rather than
+    OFFSET, so memory and per-batch cost stay flat however long the backlog is.
+    """
+    now = now or timezone.now()
+    after = None
+    while True:
+        rates = rate_provider.snapshot()
+        with transaction.atomic():
+            due = ScheduledPayment.objects.filter(status=ScheduledPayment.ACTIVE, next_run_at__lte=now)
+            if after is not None:
+                due = due.filter(Q(next_run_at__gt=after[0]) | Q(next_run_at=after[0], pk__gt=after[1]))
+            batch = list(
+                due.select_for_update(skip_locked=True, of=('self',))
+                .select_related('sender', 'recipient')
+                .order_by('next_run_at', 'pk')[:batch_size]
+            )
+            if not batch:
+                return
+            after = (batch[-1].next_run_at, batch[-1].pk)
+
+            succeeded = 0
+            for schedule in batch:
+                failures = schedule.failure_count
+                _run(schedule, now, rates)
+                succeeded += schedule.failure_count == failures
+            update_rows(batch, UPDATED_FIELDS)
+        yield succeeded, len(batch) - succeeded
@@ -1,3 +1,1178 @@
-from django.test import TestCase
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from payapp.account_shards import shard_account
+from payapp.dashboard import dashboard_lists
+from payapp.idempotency import claim_key
+from payapp.rate_client import RateServiceClient
+from payapp.ledger import balance_as_of, open_account, reconcile, take_snapshots
+from payapp.utils import split_amount
+from payapp.netting import net_payment_requests
+from payapp.notifications import requests_created
+from payapp.rates import EXCHANGE_RATES, RateEngine, RateProvider, StaticRateSource
+from payapp.models import (
+    BalanceSnapshot, Payment, PaymentRequest, IdempotencyKey, LedgerEntry, NotificationCounter, PendingTransfer, ScheduledPayment,
+)
+from payapp.scheduler import add_months, run_due_payments
+from payapp.transfer_queue import TransferWorkerPool, enqueue_transfer
+from payapp.transfers import convert_amount, transfer, bulk_transfer, InsufficientFunds
+from register.models import AccountShard, OnlineAccount
+from circuit_breaker import CircuitBreaker
+from async_thrift_client import AsyncTimestampClient
+from thrift_client import FallbackClock, ThriftClientPool, TimestampLease
+from thrift_server import SERVER_MODES, TimestampHandler, build_server
+
+
+def create_user(name, balance='100.00', currency='GBP'):
+    user = User.objects.create_user(username=name, email=f"{name}@example.com", password='password')
+    open_account(user, currency, Decimal(balance))
+    return user
+
+
+class RateSnapshotTests(TestCase):
+    def test_engine_fills_in_inverse_and_identity_rates(self):
+        rates = RateEngine({'USD': {'GBP': 0.75}})
+
+        self.assertEqual(rates.rate('GBP', 'USD'), Decimal('1.333333'))
+        self.assertEqual(rates.rate('GBP', 'GBP'), Decimal('1'))
+        self.assertIsNone(rates.rate('USD', 'EUR'))
+        self.assertEqual(rates.convert('USD', 'GBP', '10.01'), Decimal('7.51'))
+        self.assertIsNone(rates.convert('USD', 'EUR', '10.00'))
+
+    def test_version_identifies_the_rate_table(self):
+        self.assertEqual(RateEngine(EXCHANGE_RATES).version, RateEngine(dict(EXCHANGE_RATES)).version)
+        self.assertNotEqual(RateEngine({'USD': {'GBP': 0.75}}).version, RateEngine({'USD': {'GBP': 0.76}}).version)
+
+    def test_refresh_swaps_the_snapshot_and_payments_record_its_version(self):
+        source = StaticRateSource({'USD': {'GBP': 0.75}})
+        provider = RateProvider(source)
+        old = provider.snapshot()
+        source.table = {'USD': {'GBP': 0.80}}
+
+        new = provider.refresh()
+
+        self.assertNotEqual(new.version, old.version)
+        self.assertIs(provider.snapshot(), new)
+        # A snapshot pinned before the refresh keeps converting at its own rates.
+        payment = transfer(create_user('alice', currency='GBP'), create_user('bob'), Decimal('10.00'), 'USD', rates=old).payment
+        self.assertEqual((payment.amount, payment.rate_version), (Decimal('7.50'), old.version))
+
+    def test_expired_snapshot_is_served_until_the_background_refresh_lands(self):
+        source = StaticRateSource({'USD': {'GBP': 0.75}})
+        provider = RateProvider(source, ttl=0)
+        old = provider._snapshot
+        source.table = {'USD': {'GBP': 0.80}}
+
+        self.assertIs(provider.snapshot(), old)
+        deadline = time.monotonic() + 5
+        while provider._snapshot is old and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(provider._snapshot.rate('USD', 'GBP'), Decimal('0.8'))
+
+    def test_failed_loads_keep_the_last_good_snapshot(self):
+        source = StaticRateSource({'USD': {'GBP': 0.75}})
+        with mock.patch.object(source, 'load', side_effect=RuntimeError("source down")), self.assertLogs('payapp.rates', 'ERROR'):
+            provider = RateProvider(source)
+            self.assertEqual(provider.snapshot().version, RateEngine(EXCHANGE_RATES).version)
+            provider._background_refresh()
+        self.assertEqual(provider.snapshot().version, RateEngine(EXCHANGE_RATES).version)
+
+
+class RateServiceClientTests(TestCase):
+    def test_breaker_opens_and_the_last_good_rate_is_served(self):
+        client = RateServiceClient(
+            'http://rates.invalid/conversion', retries=0, cache_ttl=0,
+            breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+        )
+        ok = mock.Mock(status_code=200)
+        ok.json.return_value = {'rate': 0.75}
+        down = requests.exceptions.ConnectionError("refused")
+
+        with mock.patch.object(client.session, 'get', side_effect=[ok, down, down]) as get, \
+                self.assertLogs('payapp.rate_client', 'WARNING'):
+            rates = [client.get_rate('USD', 'GBP') for _ in range(4)]
+
+        self.assertEqual(rates, [Decimal('0.75')] * 4)
+        # The fourth call is short-circuited without touching the service.
+        self.assertEqual(get.call_count, 3)
+        stats = client.stats()
+        self.assertEqual(
+            (stats['circuit'], stats['failures'], stats['short_circuits'], stats['stale_hits']),
+            (CircuitBreaker.OPEN, 2, 1, 3),
+        )
+
+
+class TimestampServiceTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            cls.port = probe.getsockname()[1]
+        cls.server = build_server(TimestampHandler(), host='127.0.0.1', port=cls.port, mode='threaded')
+        threading.Thread(target=cls.server.serve, daemon=True).start()
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', cls.port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.serverTransport.close()
+        super().tearDownClass()
+
+    def test_pool_reuses_one_connection_and_replaces_dropped_ones(self):
+        pool = ThriftClientPool('127.0.0.1', self.port, max_size=2)
+        for _ in range(5):
+            pool.call('getTimestamp')
+        self.assertEqual((pool._size, len(pool._idle)), (1, 1))
+
+        # A connection the server dropped while idle is replaced on the next call.
+        pool._idle[0][0].close()
+        pool.call('getTimestamp')
+        self.assertEqual((pool._size, len(pool._idle)), (1, 1))
+        pool.close()
+
+    def test_leased_blocks_are_strictly_increasing_over_one_pooled_connection(self):
+        pool = ThriftClientPool('127.0.0.1', self.port, max_size=2)
+        lease = TimestampLease(pool, size=50)
+        with mock.patch.object(pool, 'call', wraps=pool.call) as call:
+            timestamps = [lease.next() for _ in range(120)]
+
+        self.assertEqual(timestamps, sorted(set(timestamps)))
+        self.assertEqual(call.call_count, 3)
+        self.assertEqual((pool._size, len(pool._idle)), (1, 1))
+        pool.close()
+
+    def test_concurrent_blocks_never_overlap(self):
+        handler = TimestampHandler()
+        blocks = []
+        threads = [threading.Thread(target=lambda: blocks.append(handler.getTimestamps(200))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        timestamps = [timestamp for block in blocks for timestamp in block]
+        self.assertEqual(len(set(timestamps)), 8 * 200)
+
+    def test_threaded_server_serves_connections_concurrently(self):
+        # A simple server would not answer the second client while the
+        # first one holds its connection open.
+        first = ThriftClientPool('127.0.0.1', self.port, max_size=1)
+        second = ThriftClientPool('127.0.0.1', self.port, max_size=1, timeout_ms=2000)
+        first.call('getTimestamp')
+        self.assertTrue(second.call('getTimestamp'))
+        first.close()
+        second.close()
+
+    def test_nonblocking_server_requires_framed_transport(self):
+        with self.assertRaises(ValueError):
+            build_server(TimestampHandler(), port=0, mode='nonblocking', transport='buffered')
+
+    def test_forking_server_is_not_offered(self):
+        # Forked children would each keep their own high-water mark and lease overlapping blocks.
+        self.assertNotIn('forking', SERVER_MODES)
+        with self.assertRaises(ValueError):
+            build_server(TimestampHandler(), port=0, mode='forking')
+
+    def test_async_client_pipelines_calls_over_shared_connections(self):
+        async def lease_blocks():
+            client = AsyncTimestampClient('127.0.0.1', self.port, connections=2)
+            try:
+                return await asyncio.gather(*(client.getTimestamps(5) for _ in range(50)))
+            finally:
+                await client.close()
+
+        timestamps = [timestamp for block in asyncio.run(lease_blocks()) for timestamp in block]
+        self.assertEqual(len(set(timestamps)), 50 * 5)
+
+    def test_async_client_gives_up_on_a_hanging_connect_within_its_timeout(self):
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(3600)
+
+        async def lease_blocks():
+            client = AsyncTimestampClient('127.0.0.1', self.port, connections=1, timeout_ms=100)
+            started = time.monotonic()
+            results = await asyncio.wait_for(
+                asyncio.gather(*(client.getTimestamps(5) for _ in range(10)), return_exceptions=True), 5,
+            )
+            return results, time.monotonic() - started
+
+        with mock.patch('async_thrift_client.asyncio.open_connection', hang):
+            results, elapsed = asyncio.run(lease_blocks())
+        self.assertTrue(all(isinstance(result, asyncio.TimeoutError) for result in results))
+        # Queued callers time out together, not one connect timeout after another.
+        self.assertLess(elapsed, 0.5)
+
+    def test_async_client_drops_a_connection_whose_write_stalls(self):
+        writer = mock.Mock(is_closing=mock.Mock(return_value=False))
+
+        async def stall(*args):
+            await asyncio.sleep(3600)
+
+        async def connect(*args, **kwargs):
+            writer.drain = stall
+            return mock.Mock(read=stall), writer
+
+        async def lease_block():
+            client = AsyncTimestampClient('127.0.0.1', self.port, connections=1, timeout_ms=100)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.getTimestamps(5), 5)
+            self.assertFalse(client._connections[0].connected)
+
+        with mock.patch('async_thrift_client.asyncio.open_connection', connect):
+            asyncio.run(lease_block())
+        writer.close.assert_called()
+
+
+class FallbackClockTests(TestCase):
+    class Server:
+        """
+        Stands in for both the lease and its pool.
+        """
+        def __init__(self):
+            self.up = True
+            self.pool = self
+
+        def next(self):
+            if not self.up:
+                raise OSError("connection refused")
+            return '2099-01-01 00:00:00.000000'
+
+        def call(self, method):
+            return self.next()
+
+    def test_local_clock_takes_over_without_going_backwards_and_hands_back(self):
+        server = self.Server()
+        clock = FallbackClock(server, CircuitBreaker(failure_threshold=2, reset_timeout=60), probe_interval=0.01)
+        self.assertEqual(clock.now(), '2099-01-01 00:00:00.000000')
+        self.assertEqual(clock.last_source, FallbackClock.SERVER)
+
+        server.up = False
+        with self.assertLogs('thrift_client', 'WARNING'):
+            local = [clock.now() for _ in range(2)]
+        self.assertFalse(clock.server_available)
+        local.append(clock.now())
+        self.assertEqual(clock.last_source, FallbackClock.LOCAL)
+        self.assertEqual(local, sorted(set(local)))
+        self.assertGreater(local[0], '2099-01-01 00:00:00.000000')
+
+        server.up = True
+        deadline = time.monotonic() + 5
+        while not clock.server_available and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(clock.now(), '2099-01-01 00:00:00.000000')
+        self.assertEqual(clock.last_source, FallbackClock.SERVER)
+
+
+class CurrencyConversionTests(TestCase):
+    def test_batch_matches_the_single_shot_endpoint(self):
+        items = [
+            {'currency1': currency1, 'currency2': currency2, 'amount': amount}
+            for currency1, currency2 in [('USD', 'GBP'), ('GBP', 'EUR'), ('EUR', 'EUR'), ('XXX', 'GBP')]
+            for amount in ['100', '0.005', '-3.335', '12.345', '1e30', 'abc', 'NaN']
+        ]
+        response = self.client.post(
+            reverse('batch_currency_conversion'), {'conversions': items}, content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+
+        for item, result in zip(items, results, strict=True):
+            single = self.client.get(reverse('currency_conversion', args=[
+                item['currency1'], item['currency2'], item['amount'],
+            ]), secure=True).json()
+            single.pop('version', None)
+            if 'error' not in result:
+                result = {'converted_amount': result['converted_amount'], 'rate': result['rate']}
+            self.assertEqual(result, single, item)
+
+    def test_batch_rejects_bodies_that_are_not_objects(self):
+        for body in ([1, 2], 'amounts', 5):
+            response = self.client.post(
+                reverse('batch_currency_conversion'), body, content_type='application/json', secure=True,
+            )
+            self.assertEqual(response.status_code, 400, body)
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob', currency='USD')
+
+    def test_transfer_converts_and_logs_payment(self):
+        result = transfer(self.alice, self.bob, Decimal('10.00'), 'GBP')
+
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('90.00'))
+        self.assertEqual(OnlineAccount.objects.get(user=self.bob).balance, Decimal('113.30'))
+        self.assertEqual(result.payment.amount, Decimal('13.30'))
+        self.assertEqual(result.payment.currency, 'USD')
+        self.assertEqual((result.debited_amount, result.debited_currency), (Decimal('10.00'), 'GBP'))
+
+    def test_insufficient_funds_changes_nothing(self):
+        with self.assertRaises(InsufficientFunds):
+            transfer(self.alice, self.bob, Decimal('100.01'), 'GBP')
+
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('100.00'))
+        self.assertEqual(OnlineAccount.objects.get(user=self.bob).balance, Decimal('100.00'))
+        self.assertFalse(Payment.objects.exists())
+
+    def test_non_positive_amount_is_rejected(self):
+        with self.assertRaises(ValueError):
+            transfer(self.alice, self.bob, Decimal('-5'), 'GBP')
+
+
+class BulkTransferTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob', currency='USD')
+        self.carol = create_user('carol', currency='EUR')
+
+    def test_bulk_transfer_reports_per_row_failures(self):
+        results = bulk_transfer(self.alice, [
+            {'recipient_email': 'bob@example.com', 'amount': '10.00', 'currency': 'GBP'},
+            {'recipient_email': 'nobody@example.com', 'amount': '5', 'currency': 'GBP'},
+            {'recipient_email': 'carol@example.com', 'amount': 'abc', 'currency': 'GBP'},
+            {'recipient_email': 'carol@example.com', 'amount': '100', 'currency': 'GBP'},
+            {'recipient_email': 'carol@example.com', 'amount': '20.00', 'currency': 'EUR'},
+        ])
+
+        self.assertEqual([result['status'] for result in results], ['ok', 'failed', 'failed', 'failed', 'ok'])
+        self.assertEqual(results[1]['error'], 'Recipient not found')
+        self.assertEqual(results[2]['error'], 'Invalid amount')
+        self.assertEqual(results[3]['error'], 'Insufficient balance')
+        # 10.00 GBP + 20.00 EUR at 0.88 = 27.60 GBP debited in total.
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('72.40'))
+        self.assertEqual(OnlineAccount.objects.get(user=self.bob).balance, Decimal('113.30'))
+        self.assertEqual(OnlineAccount.objects.get(user=self.carol).balance, Decimal('120.00'))
+        self.assertEqual(Payment.objects.filter(sender=self.alice).count(), 2)
+        self.assertEqual(LedgerEntry.objects.exclude(kind=LedgerEntry.OPENING).count(), 4)
+        self.assertEqual(reconcile(), [])
+
+    def test_amounts_that_do_not_fit_fail_only_their_row(self):
+        results = bulk_transfer(self.alice, [
+            {'recipient_email': 'carol@example.com', 'amount': '1e30', 'currency': 'EUR'},
+            {'recipient_email': 'carol@example.com', 'amount': '10.005', 'currency': 'GBP'},
+            {'recipient_email': 'bob@example.com', 'amount': '10.00', 'currency': 'GBP'},
+        ])
+
+        self.assertEqual([result['status'] for result in results], ['failed', 'failed', 'ok'])
+        self.assertEqual([result.get('error') for result in results[:2]], ['Invalid amount', 'Invalid amount'])
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('90.00'))
+
+    def test_api_rejects_bodies_that_are_not_objects(self):
+        self.client.force_login(self.alice)
+        response = self.client.post(reverse('bulk_payment'), [1, 2], content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob', currency='USD')
+        self.alice_account = OnlineAccount.objects.get(user=self.alice)
+
+    def test_transfer_writes_debit_and_credit_entries(self):
+        result = transfer(self.alice, self.bob, Decimal('10.00'), 'GBP')
+
+        entries = LedgerEntry.objects.filter(payment=result.payment).order_by('kind')
+        self.assertEqual(
+            [(entry.kind, entry.amount, entry.currency) for entry in entries],
+            [(LedgerEntry.CREDIT, Decimal('13.30'), 'USD'), (LedgerEntry.DEBIT, Decimal('-10.00'), 'GBP')],
+        )
+        self.assertEqual(reconcile(), [])
+
+    def test_balance_as_of_combines_snapshot_and_later_entries(self):
+        transfer(self.alice, self.bob, Decimal('10.00'), 'GBP')
+        self.assertEqual(take_snapshots(), 2)
+        self.assertEqual(take_snapshots(), 0)
+        after_snapshot = timezone.now()
+        transfer(self.alice, self.bob, Decimal('5.00'), 'GBP')
+
+        self.assertEqual(balance_as_of(self.alice_account, after_snapshot), Decimal('90.00'))
+        self.assertEqual(balance_as_of(self.alice_account), Decimal('85.00'))
+        self.assertEqual(reconcile(), [])
+
+
+    def test_reconcile_reads_only_entries_after_the_latest_snapshot(self):
+        transfer(self.alice, self.bob, Decimal('10.00'), 'GBP')
+        take_snapshots()
+        # Entries covered by a snapshot are never read again, so changing one goes unnoticed.
+        LedgerEntry.objects.filter(account=self.alice_account, kind=LedgerEntry.OPENING).update(amount=0)
+        transfer(self.alice, self.bob, Decimal('5.00'), 'GBP')
+
+        self.assertEqual(reconcile(), [])
+        self.assertEqual(take_snapshots(), 2)
+        self.assertEqual(
+            BalanceSnapshot.objects.filter(account=self.alice_account).order_by('-last_entry_id').first().balance,
+            Decimal('85.00'),
+        )
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.client.force_login(self.alice)
+
+    def pay(self, key, amount='10.00'):
+        return self.client.post(
+            reverse('direct_payment'),
+            {'recipient_email': 'bob@example.com', 'amount': amount, 'currency': 'GBP'},
+            headers={'Idempotency-Key': key},
+            secure=True,
+        )
+
+    def test_retry_replays_without_paying_twice(self):
+        first = self.pay('retry-1')
+        second = self.pay('retry-1')
+
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('90.00'))
+
+    def test_key_reused_for_a_different_payment_is_refused(self):
+        self.pay('retry-1')
+        self.pay('retry-1', amount='20.00')
+
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('90.00'))
+
+    def test_key_released_by_a_failed_request_is_claimed_again(self):
+        create = IdempotencyKey.objects.create
+
+        def create_after_a_failed_claim(**kwargs):
+            # The first insert collides with a request that fails and deletes its record before the read.
+            if not attempts:
+                attempts.append(kwargs)
+                raise IntegrityError
+            return create(**kwargs)
+
+        attempts = []
+        with mock.patch.object(IdempotencyKey.objects, 'create', side_effect=create_after_a_failed_claim):
+            record, claimed = claim_key(self.alice, 'retry-1', 'fingerprint')
+
+        self.assertTrue(claimed)
+        self.assertEqual(IdempotencyKey.objects.get().pk, record.pk)
+
+    def test_sweeper_deletes_only_expired_keys(self):
+        self.pay('old')
+        self.pay('new')
+        IdempotencyKey.objects.filter(key='old').update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        call_command('sweep_idempotency_keys', batch_size=1, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+class TransferQueueTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.client.force_login(self.alice)
+
+    def test_queued_payment_is_applied_by_the_workers(self):
+        response = self.client.post(
+            reverse('direct_payment'),
+            {'recipient_email': 'bob@example.com', 'amount': '10.00', 'currency': 'GBP', 'mode': 'queued'},
+            headers={'Accept': 'application/json'},
+            secure=True,
+        )
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url, secure=True).json()['status'], PendingTransfer.QUEUED)
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('100.00'))
+
+        self.assertEqual(TransferWorkerPool(workers=1).drain(0), 1)
+
+        status = self.client.get(status_url, secure=True).json()
+        self.assertEqual(status['status'], PendingTransfer.COMPLETED)
+        self.assertEqual(Payment.objects.get().pk, status['payment_id'])
+        self.assertEqual(OnlineAccount.objects.get(user=self.bob).balance, Decimal('110.00'))
+
+    def test_failed_transfer_does_not_stop_the_batch(self):
+        enqueue_transfer(self.alice, self.bob, Decimal('80.00'), 'GBP')
+        enqueue_transfer(self.alice, self.bob, Decimal('80.00'), 'GBP')
+        enqueue_transfer(self.alice, self.bob, Decimal('20.00'), 'GBP')
+
+        pool = TransferWorkerPool(workers=1)
+        self.assertEqual(pool.drain(0), 3)
+
+        self.assertEqual(
+            list(PendingTransfer.objects.order_by('id').values_list('status', 'error')),
+            [
+                (PendingTransfer.COMPLETED, ''),
+                (PendingTransfer.FAILED, 'Insufficient balance'),
+                (PendingTransfer.COMPLETED, ''),
+            ],
+        )
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('0.00'))
+
+    def test_transfer_that_raises_fails_alone(self):
+        for amount in ('10.00', '13.00', '20.00'):
+            enqueue_transfer(self.alice, self.bob, Decimal(amount), 'GBP')
+        real_convert = convert_amount
+
+        def convert_or_fail(amount, from_currency, to_currency, rates):
+            if amount == Decimal('13.00'):
+                raise ArithmeticError("conversion overflow")
+            return real_convert(amount, from_currency, to_currency, rates)
+
+        with mock.patch('payapp.transfer_queue.convert_amount', convert_or_fail), \
+                self.assertLogs('payapp.transfer_queue', 'ERROR'):
+            self.assertEqual(TransferWorkerPool(workers=1).drain(0), 3)
+
+        self.assertEqual(
+            list(PendingTransfer.objects.order_by('id').values_list('status', 'error')),
+            [
+                (PendingTransfer.COMPLETED, ''),
+                (PendingTransfer.FAILED, 'conversion overflow'),
+                (PendingTransfer.COMPLETED, ''),
+            ],
+        )
+        self.assertEqual(Payment.objects.count(), 2)
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('70.00'))
+        self.assertEqual(OnlineAccount.objects.get(user=self.bob).balance, Decimal('130.00'))
+        self.assertEqual(LedgerEntry.objects.filter(payment__isnull=False).count(), 4)
+
+
+class ShardedAccountTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.merchant = create_user('merchant')
+        self.merchant_account = OnlineAccount.objects.get(user=self.merchant)
+        shard_account(self.merchant_account, 4)
+
+    def test_credits_go_to_shards_and_debits_fold_them_back(self):
+        for _ in range(5):
+            transfer(self.alice, self.merchant, Decimal('10.00'), 'GBP')
+        bulk_transfer(self.alice, [{'recipient_email': 'merchant@example.com', 'amount': '5.00', 'currency': 'GBP'}])
+
+        account = OnlineAccount.objects.get(user=self.merchant)
+        self.assertEqual(account.balance, Decimal('100.00'))
+        self.assertEqual(account.total_balance, Decimal('155.00'))
+
+        transfer(self.merchant, self.alice, Decimal('120.00'), 'GBP')
+
+        account = OnlineAccount.objects.get(user=self.merchant)
+        self.assertEqual((account.balance, account.total_balance), (Decimal('35.00'), Decimal('35.00')))
+        self.assertEqual(reconcile(), [])
+
+    def test_bulk_payout_from_a_sharded_account_spends_its_shards(self):
+        transfer(self.alice, self.merchant, Decimal('50.00'), 'GBP')
+
+        results = bulk_transfer(self.merchant, [
+            {'recipient_email': 'alice@example.com', 'amount': '120.00', 'currency': 'GBP'},
+            {'recipient_email': 'alice@example.com', 'amount': '40.00', 'currency': 'GBP'},
+            {'recipient_email': 'alice@example.com', 'amount': '30.00', 'currency': 'GBP'},
+        ])
+
+        self.assertEqual([result['status'] for result in results], ['ok', 'failed', 'ok'])
+        account = OnlineAccount.objects.get(user=self.merchant)
+        self.assertEqual((account.balance, account.total_balance), (Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(reconcile(), [])
+
+    def test_dashboard_reports_the_total_balance(self):
+        transfer(self.alice, self.merchant, Decimal('10.00'), 'GBP')
+        self.client.force_login(self.merchant)
+
+        response = self.client.get(reverse('dashboard'), secure=True)
+
+        self.assertEqual(response.context['balance'], Decimal('110.00'))
+
+    def test_unsharding_keeps_the_total(self):
+        transfer(self.alice, self.merchant, Decimal('10.00'), 'GBP')
+        shard_account(self.merchant_account, 1)
+
+        account = OnlineAccount.objects.get(user=self.merchant)
+        self.assertEqual((account.balance, account.shard_count), (Decimal('110.00'), 1))
+        self.assertFalse(account.shards.exists())
+
+    def test_credit_to_a_missing_shard_rolls_the_transfer_back(self):
+        # shard_count says 4, but shards 2 and 3 are gone, as after a re-shard the transfer did not see.
+        AccountShard.objects.filter(account=self.merchant_account, index__gte=2).delete()
+
+        with mock.patch('payapp.account_shards.random.randrange', return_value=3), \
+                self.assertRaises(AccountShard.DoesNotExist):
+            transfer(self.alice, self.merchant, Decimal('10.00'), 'GBP')
+
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('100.00'))
+        self.assertEqual(OnlineAccount.objects.get(user=self.merchant).total_balance, Decimal('100.00'))
+        self.assertFalse(Payment.objects.exists())
+
+
+class ScheduledPaymentTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.now = timezone.now()
+
+    def schedule(self, **kwargs):
+        kwargs.setdefault('start_at', self.now - timedelta(days=1))
+        kwargs.setdefault('next_run_at', kwargs['start_at'])
+        return ScheduledPayment.objects.create(sender=self.alice, recipient=self.bob, amount=Decimal('10.00'), **kwargs)
+
+    def test_due_schedules_run_once_and_advance(self):
+        weekly = self.schedule(recurrence=ScheduledPayment.WEEKLY)
+        once = self.schedule()
+        behind = self.schedule(recurrence=ScheduledPayment.DAILY, start_at=self.now - timedelta(days=10))
+        later = self.schedule(start_at=self.now + timedelta(days=1))
+
+        batches = list(run_due_payments(batch_size=2, now=self.now))
+
+        self.assertEqual(batches, [(2, 0), (1, 0)])
+        weekly.refresh_from_db()
+        self.assertEqual(weekly.next_run_at, self.now + timedelta(days=6))
+        self.assertEqual(weekly.run_count, 1)
+        once.refresh_from_db()
+        self.assertEqual(once.status, ScheduledPayment.COMPLETED)
+        # Missed days are skipped, not paid one by one.
+        behind.refresh_from_db()
+        self.assertEqual((behind.run_count, behind.next_run_at), (1, self.now + timedelta(days=1)))
+        later.refresh_from_db()
+        self.assertEqual(later.run_count, 0)
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('70.00'))
+        self.assertEqual(list(run_due_payments(now=self.now)), [])
+
+    def test_failed_run_is_recorded_and_still_advances(self):
+        schedule = self.schedule(recurrence=ScheduledPayment.DAILY)
+        OnlineAccount.objects.filter(user=self.alice).update(balance=Decimal('5.00'))
+
+        self.assertEqual(list(run_due_payments(now=self.now)), [(0, 1)])
+
+        schedule.refresh_from_db()
+        self.assertEqual((schedule.failure_count, schedule.last_error), (1, 'Insufficient balance'))
+        self.assertEqual(schedule.next_run_at, self.now + timedelta(days=1))
+
+    def test_unexpected_errors_fail_only_their_own_schedule(self):
+        broken = self.schedule(recurrence=ScheduledPayment.DAILY)
+        healthy = self.schedule(recurrence=ScheduledPayment.DAILY)
+        real_transfer = transfer
+
+        def transfer_or_fail(sender, recipient, amount, currency, rates=None):
+            result = real_transfer(sender, recipient, amount, currency, rates=rates)
+            if not hasattr(transfer_or_fail, 'failed'):
+                # Fails after its writes, which the savepoint must undo.
+                transfer_or_fail.failed = True
+                raise ArithmeticError("conversion overflow")
+            return result
+
+        with mock.patch('payapp.scheduler.transfer', transfer_or_fail), self.assertLogs('payapp.scheduler', 'ERROR'):
+            self.assertEqual(list(run_due_payments(now=self.now)), [(1, 1)])
+
+        broken.refresh_from_db()
+        healthy.refresh_from_db()
+        self.assertEqual((broken.failure_count, broken.last_error), (1, 'conversion overflow'))
+        self.assertEqual(broken.next_run_at, self.now + timedelta(days=1))
+        self.assertEqual((healthy.run_count, healthy.failure_count), (1, 0))
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('90.00'))
+
+    def test_monthly_runs_keep_their_day(self):
+        start = datetime(2025, 1, 31, 9, tzinfo=dt_timezone.utc)
+        self.assertEqual(add_months(start, 1, 31), datetime(2025, 2, 28, 9, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_months(datetime(2025, 2, 28, 9, tzinfo=dt_timezone.utc), 1, 31), datetime(2025, 3, 31, 9, tzinfo=dt_timezone.utc))
+
+    def test_api_rejects_amounts_that_do_not_fit(self):
+        self.client.force_login(self.alice)
+        for amount in ['1e30', '10.005', '0']:
+            response = self.client.post(
+                reverse('schedule_payment'),
+                {'recipient_email': 'bob@example.com', 'amount': amount, 'currency': 'GBP'},
+                content_type='application/json',
+                secure=True,
+            )
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid amount'}), amount)
+        self.assertFalse(ScheduledPayment.objects.exists())
+
+    def test_api_rejects_schedules_that_end_first_or_pay_the_sender(self):
+        self.client.force_login(self.alice)
+        cases = [
+            ({'recipient_email': 'bob@example.com', 'start_at': '2025-05-02T09:00:00Z', 'end_at': '2025-05-01T09:00:00Z'},
+             'end_at must not be before start_at'),
+            ({'recipient_email': 'alice@example.com'}, 'You cannot schedule a payment to yourself'),
+        ]
+        for data, error in cases:
+            response = self.client.post(
+                reverse('schedule_payment'), {'amount': '10.00', **data}, content_type='application/json', secure=True,
+            )
+            self.assertEqual((response.status_code, response.json()), (400, {'error': error}), data)
+        self.assertFalse(ScheduledPayment.objects.exists())
+
+    def test_api_rejects_bodies_that_are_not_objects(self):
+        self.client.force_login(self.alice)
+        response = self.client.post(reverse('schedule_payment'), [1, 2], content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ScheduledPayment.objects.exists())
+
+
+class SplitPaymentRequestTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        for name in ('bob', 'carol', 'dave'):
+            create_user(name)
+        self.client.force_login(self.alice)
+
+    def split(self, **data):
+        return self.client.post(reverse('split_payment_request'), data, content_type='application/json', secure=True)
+
+    def test_split_amount_uses_largest_remainders(self):
+        self.assertEqual(split_amount(Decimal('100.00'), [1, 1, 1]), [Decimal('33.34'), Decimal('33.33'), Decimal('33.33')])
+        self.assertEqual(split_amount(Decimal('10.00'), [1, 2]), [Decimal('3.33'), Decimal('6.67')])
+        self.assertEqual(sum(split_amount(Decimal('0.05'), [Decimal('0.7')] * 7)), Decimal('0.05'))
+
+    def test_split_creates_one_request_per_requestee(self):
+        emails = ['bob@example.com', 'carol@example.com', 'dave@example.com']
+        # Session and user, one lookup for all requestees, then one insert and
+        # one counter upsert in a savepoint.
+        with self.assertNumQueries(7):
+            response = self.split(total='100.00', currency='USD', requestees=emails, weights=[2, 1, 1])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [(request['requestee'], request['amount']) for request in response.json()['requests']],
+            [('bob@example.com', '50.00'), ('carol@example.com', '25.00'), ('dave@example.com', '25.00')],
+        )
+        self.assertEqual(PaymentRequest.objects.filter(requester=self.alice, currency='USD').count(), 3)
+
+    def test_unknown_requestee_creates_nothing(self):
+        response = self.split(total='30.00', requestees=['bob@example.com', 'nobody@example.com'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['unknown'], ['nobody@example.com'])
+        self.assertFalse(PaymentRequest.objects.exists())
+
+    def test_totals_that_do_not_fit_are_refused(self):
+        for total in ['1e30', '10.005', '-5']:
+            response = self.split(total=total, requestees=['bob@example.com'])
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid total'}), total)
+        self.assertFalse(PaymentRequest.objects.exists())
+
+    def test_bodies_that_are_not_objects_are_refused(self):
+        response = self.client.post(reverse('split_payment_request'), [1, 2], content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkRespondPaymentRequestTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob', currency='USD')
+        self.carol = create_user('carol')
+        self.client.force_login(self.alice)
+
+    def respond(self, action, request_ids):
+        return self.client.post(
+            reverse('bulk_respond_payment_requests'),
+            {'action': action, 'request_ids': request_ids},
+            content_type='application/json',
+            secure=True,
+        )
+
+    def test_bulk_accept_pays_while_the_balance_lasts(self):
+        first = PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('13.30'), currency='USD')
+        too_big = PaymentRequest.objects.create(requester=self.carol, requestee=self.alice, amount=Decimal('95.00'))
+        second = PaymentRequest.objects.create(requester=self.carol, requestee=self.alice, amount=Decimal('40.00'))
+        not_mine = PaymentRequest.objects.create(requester=self.alice, requestee=self.carol, amount=Decimal('1.00'))
+
+        response = self.respond('accept', [first.pk, too_big.pk, second.pk, not_mine.pk, first.pk])
+
+        body = response.json()
+        self.assertEqual((body['succeeded'], body['failed']), (2, 3))
+        self.assertEqual(
+            [result.get('error') for result in body['results']],
+            [None, 'Insufficient balance', None, 'Payment request not found', 'Payment request is no longer pending'],
+        )
+        # 13.30 USD at 0.75 is 9.98 GBP, plus 40.00 GBP.
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('50.02'))
+        self.assertEqual(OnlineAccount.objects.get(user=self.bob).balance, Decimal('113.30'))
+        self.assertEqual(
+            dict(PaymentRequest.objects.values_list('pk', 'status')),
+            {first.pk: 'accepted', too_big.pk: 'pending', second.pk: 'accepted', not_mine.pk: 'pending'},
+        )
+        self.assertEqual(Payment.objects.filter(origin=Payment.PAYMENT_REQUEST).count(), 2)
+        self.assertEqual(reconcile(), [])
+
+    def test_bulk_reject(self):
+        pending = PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('5.00'))
+        accepted = PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('5.00'), status='accepted')
+
+        body = self.respond('reject', [pending.pk, accepted.pk]).json()
+
+        self.assertEqual([result['status'] for result in body['results']], ['ok', 'failed'])
+        self.assertEqual(PaymentRequest.objects.get(pk=pending.pk).status, 'rejected')
+        self.assertEqual(PaymentRequest.objects.get(pk=accepted.pk).status, 'accepted')
+
+    def test_bodies_that_are_not_objects_are_refused(self):
+        response = self.client.post(
+            reverse('bulk_respond_payment_requests'), [1, 2], content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class NettingTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.carol = create_user('carol')
+        self.dave = create_user('dave')
+
+    def request(self, requester, requestee, amount, currency='GBP'):
+        return PaymentRequest.objects.create(
+            requester=requester, requestee=requestee, amount=Decimal(amount), currency=currency
+        )
+
+    def test_cycles_cancel_and_the_rest_is_settled_net(self):
+        cycle = [
+            self.request(self.bob, self.alice, '30.00'),
+            self.request(self.carol, self.bob, '30.00'),
+            self.request(self.alice, self.carol, '30.00'),
+        ]
+        owed = [
+            self.request(self.carol, self.alice, '20.00'),
+            # 13.30 USD at 0.75 is 9.98 GBP.
+            self.request(self.bob, self.alice, '13.30', 'USD'),
+        ]
+        outside = self.request(self.dave, self.alice, '5.00')
+
+        result = net_payment_requests([self.alice, self.bob, self.carol])
+
+        self.assertEqual(result.settled_requests, 5)
+        self.assertEqual(
+            sorted(result.transfers),
+            sorted([(self.alice.pk, self.carol.pk, Decimal('20.00')), (self.alice.pk, self.bob.pk, Decimal('9.98'))]),
+        )
+        balances = dict(OnlineAccount.objects.values_list('user__username', 'balance'))
+        self.assertEqual(
+            balances,
+            {'alice': Decimal('70.02'), 'bob': Decimal('109.98'), 'carol': Decimal('120.00'), 'dave': Decimal('100.00')},
+        )
+        self.assertEqual(
+            set(PaymentRequest.objects.filter(pk__in=[r.pk for r in cycle + owed]).values_list('status', flat=True)),
+            {'accepted'},
+        )
+        self.assertEqual(PaymentRequest.objects.get(pk=outside.pk).status, 'pending')
+        self.assertEqual(Payment.objects.filter(origin=Payment.PAYMENT_REQUEST).count(), 2)
+        self.assertEqual(reconcile(), [])
+
+    def test_nothing_is_settled_when_a_debtor_cannot_pay(self):
+        self.request(self.bob, self.alice, '150.00')
+        self.request(self.carol, self.bob, '10.00')
+
+        with self.assertRaises(InsufficientFunds):
+            net_payment_requests([self.alice, self.bob, self.carol])
+
+        self.assertEqual(set(PaymentRequest.objects.values_list('status', flat=True)), {'pending'})
+        self.assertEqual(
+            set(OnlineAccount.objects.values_list('balance', flat=True)), {Decimal('100.00')}
+        )
+        self.assertFalse(Payment.objects.exists())
+
+
+class PaymentRequestExpiryTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+
+    def test_new_requests_expire_after_the_ttl(self):
+        with self.settings(PAYMENT_REQUEST_TTL=60):
+            payment_request = PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('5.00'))
+
+        self.assertAlmostEqual(
+            payment_request.expires_at, timezone.now() + timedelta(seconds=60), delta=timedelta(seconds=5)
+        )
+
+    def test_sweeper_expires_only_stale_pending_requests_in_batches(self):
+        past = timezone.now() - timedelta(minutes=1)
+        stale = [
+            PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('5.00'), expires_at=past)
+            for _ in range(3)
+        ]
+        answered = PaymentRequest.objects.create(
+            requester=self.bob, requestee=self.alice, amount=Decimal('5.00'), expires_at=past, status='accepted'
+        )
+        live = PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('5.00'))
+
+        call_command('expire_payment_requests', batch_size=2, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(
+            dict(PaymentRequest.objects.values_list('pk', 'status')),
+            {**{r.pk: 'expired' for r in stale}, answered.pk: 'accepted', live.pk: 'pending'},
+        )
+
+    def test_sweeper_skips_requests_answered_after_it_read_them(self):
+        past = timezone.now() - timedelta(minutes=1)
+        stale = [
+            PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('5.00'), expires_at=past)
+            for _ in range(3)
+        ]
+        requests_created(stale)
+        answered = []
+
+        def answer_one_first(execute, sql, params, many, context):
+            # Accepts a request between the sweeper's read and its UPDATE.
+            if sql.startswith('UPDATE "payapp_paymentrequest"') and not answered:
+                answered.append(stale[0].pk)
+                PaymentRequest.objects.filter(pk=stale[0].pk).update(status='accepted')
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(answer_one_first):
+            call_command('expire_payment_requests', stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(
+            dict(PaymentRequest.objects.values_list('pk', 'status')),
+            {stale[0].pk: 'accepted', stale[1].pk: 'expired', stale[2].pk: 'expired'},
+        )
+        # The accept path takes its own request off the count; the sweeper only takes the two it expired.
+        self.assertEqual(NotificationCounter.objects.get(pk=self.alice.pk).unread_requests, 1)
+
+    def test_unswept_expired_requests_are_hidden_and_cannot_be_accepted(self):
+        stale = PaymentRequest.objects.create(
+            requester=self.bob, requestee=self.alice, amount=Decimal('5.00'),
+            expires_at=timezone.now() - timedelta(minutes=1),
+        )
+        live = PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('5.00'))
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse('dashboard'), secure=True)
+        self.assertEqual([row['id'] for row in response.context['pending_requests']], [live.pk])
+
+        self.client.post(reverse('accept_payment_request', args=[stale.pk]), secure=True)
+        self.assertEqual(PaymentRequest.objects.get(pk=stale.pk).status, 'pending')
+        self.assertEqual(OnlineAccount.objects.get(user=self.alice).balance, Decimal('100.00'))
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.client.force_login(self.alice)
+
+    def add_activity(self, count):
+        for _ in range(count):
+            transfer(self.alice, self.bob, Decimal('1.00'), 'GBP')
+            transfer(self.bob, self.alice, Decimal('1.00'), 'GBP')
+            transfer(self.alice, self.bob, Decimal('1.00'), 'GBP', origin=Payment.PAYMENT_REQUEST)
+            transfer(self.bob, self.alice, Decimal('1.00'), 'GBP', origin=Payment.PAYMENT_REQUEST)
+            requests_created([
+                PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('1.00')),
+                PaymentRequest.objects.create(requester=self.alice, requestee=self.bob, amount=Decimal('1.00')),
+            ])
+
+    def test_dashboard_runs_a_fixed_number_of_queries(self):
+        # Session, user, account with counts, and one query per tab.
+        for count in (1, 10):
+            self.add_activity(count)
+            with self.assertNumQueries(9):
+                response = self.client.get(reverse('dashboard'), secure=True)
+
+        self.assertEqual(response.context['received_direct_payments_unread_count'], 11)
+        self.assertEqual(response.context['pending_requests_unread_count'], 11)
+        self.assertEqual(response.context['sent_direct_payments'][0]['email'], 'bob@example.com')
+        self.assertContains(response, 'From: bob@example.com', count=33)
+
+    def test_lists_are_paged_by_timestamp_and_id(self):
+        when = timezone.now()
+        # Shared timestamps make the id tie-break matter at page boundaries.
+        payments = Payment.objects.bulk_create(
+            Payment(
+                sender=self.alice, recipient=self.bob, amount=Decimal('1.00'), currency='GBP',
+                timestamp=when - timedelta(minutes=i // 3),
+            )
+            for i in range(45)
+        )
+        expected = [
+            payment.pk for payment in sorted(payments, key=lambda payment: (payment.timestamp, payment.pk), reverse=True)
+        ]
+
+        response = self.client.get(reverse('dashboard'), secure=True)
+        seen = [row['id'] for row in response.context['sent_direct_payments']]
+        cursor = response.context['sent_direct_payments_cursor']
+        while cursor:
+            body = self.client.get(
+                reverse('dashboard_page', args=['sent_direct_payments']), {'cursor': cursor}, secure=True
+            ).json()
+            self.assertLessEqual(len(body['results']), 20)
+            seen += [row['id'] for row in body['results']]
+            cursor = body['next_cursor']
+
+        self.assertEqual(seen, expected)
+
+    def test_unread_lists_are_paged_by_id_without_a_sort(self):
+        when = timezone.now()
+        # Out-of-order timestamps: unread lists follow arrival (id) order.
+        payments = Payment.objects.bulk_create(
+            Payment(
+                sender=self.bob, recipient=self.alice, amount=Decimal('1.00'), currency='GBP',
+                timestamp=when - timedelta(minutes=(i * 7) % 45),
+            )
+            for i in range(45)
+        )
+        expected = sorted((payment.pk for payment in payments), reverse=True)
+
+        response = self.client.get(reverse('dashboard'), secure=True)
+        seen = [row['id'] for row in response.context['received_direct_payments']]
+        cursor = response.context['received_direct_payments_cursor']
+        while cursor:
+            body = self.client.get(
+                reverse('dashboard_page', args=['received_direct_payments']), {'cursor': cursor}, secure=True
+            ).json()
+            seen += [row['id'] for row in body['results']]
+            cursor = body['next_cursor']
+        self.assertEqual(seen, expected)
+
+        for name, queryset in dashboard_lists(self.alice).items():
+            sql, params = queryset[:20].query.sql_with_params()
+            with connection.cursor() as db_cursor:
+                db_cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                plan = ' '.join(str(row[-1]) for row in db_cursor.fetchall())
+            self.assertNotIn('TEMP B-TREE', plan, name)
+
+    def test_load_more_rejects_bad_cursors_and_lists(self):
+        url = reverse('dashboard_page', args=['sent_direct_payments'])
+        self.assertEqual(self.client.get(url, {'cursor': 'not-a-cursor'}, secure=True).status_code, 400)
+        self.assertEqual(
+            self.client.get(reverse('dashboard_page', args=['everything']), secure=True).status_code, 404
+        )
+
+
+class NotificationCounterTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.client.force_login(self.alice)
+
+    def counts(self, user):
+        return tuple(
+            NotificationCounter.objects.filter(pk=user.pk)
+            .values_list('unread_direct_payments', 'unread_request_payments', 'unread_requests')
+            .get()
+        )
+
+    def test_counters_follow_writes_and_reset_on_mark_all_as_read(self):
+        transfer(self.bob, self.alice, Decimal('1.00'), 'GBP')
+        transfer(self.bob, self.alice, Decimal('1.00'), 'GBP')
+        accepted = PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('2.00'))
+        PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('3.00'))
+        # Requests created directly on the model are not counted until a rebuild.
+        call_command('rebuild_notification_counters', stdout=open(os.devnull, 'w'))
+        self.client.post(
+            reverse('create_payment_request'),
+            {'requestee_email': 'alice@example.com', 'amount': '4.00', 'currency': 'GBP'},
+            secure=True,
+        )
+        self.assertEqual(self.counts(self.alice), (2, 0, 3))
+
+        bulk_transfer(self.alice, [{'recipient_email': 'bob@example.com', 'amount': '1.00', 'currency': 'GBP'}])
+        self.client.post(reverse('accept_payment_request', args=[accepted.pk]), secure=True)
+        self.assertEqual(self.counts(self.alice), (2, 0, 2))
+        self.assertEqual(self.counts(self.bob), (1, 1, 0))
+
+        response = self.client.get(reverse('dashboard'), secure=True)
+        self.assertEqual(response.context['received_direct_payments_unread_count'], 2)
+        self.assertEqual(response.context['pending_requests_unread_count'], 2)
+
+        self.client.get(reverse('mark_all_as_read'), secure=True)
+        self.assertEqual(self.counts(self.alice), (0, 0, 0))
+
+    def test_rebuild_repairs_drifted_counters(self):
+        transfer(self.bob, self.alice, Decimal('1.00'), 'GBP')
+        PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('2.00'))
+        PaymentRequest.objects.create(
+            requester=self.bob, requestee=self.alice, amount=Decimal('2.00'), status='rejected'
+        )
+        NotificationCounter.objects.filter(pk=self.alice.pk).update(unread_direct_payments=7)
+
+        call_command('rebuild_notification_counters', batch_size=1, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(self.counts(self.alice), (1, 0, 1))
+        self.assertEqual(self.counts(self.bob), (0, 0, 0))
+
+    def test_mark_all_as_read_moves_the_watermarks_in_one_write(self):
+        transfer(self.bob, self.alice, Decimal('1.00'), 'GBP')
+        requests_created([PaymentRequest.objects.create(requester=self.bob, requestee=self.alice, amount=Decimal('2.00'))])
+
+        # Session and user, then a single UPDATE of the counter row.
+        with self.assertNumQueries(3):
+            self.client.get(reverse('mark_all_as_read'), secure=True)
+
+        transfer(self.bob, self.alice, Decimal('3.00'), 'GBP')
+        response = self.client.get(reverse('dashboard'), secure=True)
+        self.assertEqual([row['amount'] for row in response.context['received_direct_payments']], [Decimal('3.00')])
+        self.assertEqual(response.context['pending_requests'], [])
+        self.assertEqual(response.context['received_direct_payments_unread_count'], 1)
+        call_command('rebuild_notification_counters', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.counts(self.alice), (1, 0, 0))
+
+
+class ConcurrentTransferStressTests(TransactionTestCase):
+    """
+    Hammers the transfer core from several threads and checks that no update is lost.
+    """
+    ACCOUNTS = 6
+    THREADS = 8
+    TRANSFERS_PER_THREAD = 40
+
+    def setUp(self):
+        self.users = [create_user(f"user{i}") for i in range(self.ACCOUNTS)]
+
+    def test_ledger_total_is_conserved(self):
+        total_before = OnlineAccount.objects.aggregate(total=Sum('balance'))['total']
+        completed = []
+        errors = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            done = 0
+            try:
+                for _ in range(self.TRANSFERS_PER_THREAD):
+                    sender, recipient = rng.sample(self.users, 2)
+                    try:
+                        transfer(sender, recipient, Decimal(rng.randint(1, 4000)) / 100, 'GBP')
+                        done += 1
+                    except InsufficientFunds:
+                        pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                completed.append(done)
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(errors, [])
+        self.assertEqual(OnlineAccount.objects.aggregate(total=Sum('balance'))['total'], total_before)
+        self.assertFalse(OnlineAccount.objects.filter(balance__lt=0).exists())
+        self.assertEqual(Payment.objects.count(), sum(completed))
+        self.assertEqual(reconcile(), [])
+        print(f"\n{sum(completed)} concurrent transfers in {elapsed:.2f}s ({sum(completed) / elapsed:,.0f} transfers/sec)")
@@ -0,0 +1,215 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from payapp.account_shards import consolidate_shards
+from payapp.ledger import transfer_entries
+from payapp.models import LedgerEntry, Payment, PendingTransfer
+from payapp.notifications import payments_created
+from payapp.rates import rate_provider
+from payapp.transfers import convert_amount, credit_accounts
+from payapp.utils import update_rows
+from register.models import OnlineAccount
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(recipient):
+    """
+    Returns the queue shard of a recipient. Transfers to the same account
+    always land in the same shard, so they are applied by one worker in order.
+    """
+    return recipient.pk % settings.TRANSFER_QUEUE_SHARDS
+
+
+def enqueue_transfer(sender, recipient, amount, currency):
+    """
+    Queues a direct payment and returns the PendingTransfer.
+    Only the amount is checked here; balances are checked when it is applied.
+    """
+    if not amount > 0:
+        raise ValueError("Amount must be positive.")
+    return PendingTransfer.objects.create(
+        sender=sender,
+        recipient=recipient,
+        amount=amount,
+        currency=currency,
+        shard=shard_for(recipient),
+    )
+
+
+def process_shard(shard, batch_size=100):
+    """
+    Applies up to batch_size queued transfers of one shard, oldest first, as
+    one batch (see apply_transfers). A transfer the sender cannot cover is
+    marked FAILED and the rest of the batch goes ahead. If the batch raises,
+    its transfers are applied again one at a time, each in its own
+    savepoint, and the ones that still raise are marked FAILED with the
+    error, so one bad row cannot hold up its shard.
+    Returns the number of transfers processed.
+    """
+    rates = rate_provider.snapshot()
+    with transaction.atomic():
+        batch = list(
+            PendingTransfer.objects.select_for_update()
+            .filter(shard=shard, status=PendingTransfer.QUEUED)
+            .order_by('id')[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                apply_transfers(batch, rates, now)
+        except Exception:
+            logger.exception("Transfer batch on shard %s failed; applying its transfers one at a time", shard)
+            for pending in batch:
+                try:
+                    with transaction.atomic():
+                        apply_transfers([pending], rates, now)
+                except Exception as e:
+                    pending.status, pending.error = PendingTransfer.FAILED, (str(e) or type(e).__name__)[:255]
+                    pending.payment, pending.processed_at = None, now
+        update_rows(batch, ['status', 'error', 'payment', 'processed_at'])
+    return len(batch)
+
+
+def apply_transfers(batch, rates, now):
+    """
+    Applies queued transfers in order inside the caller's transaction: the
+    accounts involved are locked and read once, the transfers are applied
+    against their running balances, and balances, payments and ledger
+    entries are written in bulk. Sets each transfer's status, error, payment
+    and processed_at; the caller saves them.
+    """
+    user_ids = {pending.sender_id for pending in batch} | {pending.recipient_id for pending in batch}
+    # Locked in id order, like move_funds, so batches cannot deadlock.
+    accounts = {
+        account.user_id: account
+        for account in OnlineAccount.objects.select_for_update().filter(user_id__in=user_ids).order_by('pk')
+    }
+    sender_ids = {pending.sender_id for pending in batch}
+    for account in accounts.values():
+        if account.shard_count > 1 and account.user_id in sender_ids:
+            consolidate_shards(account.pk)
+            account.refresh_from_db(fields=['balance'])
+    available = {account.pk: account.balance for account in accounts.values()}
+    deltas = {}
+    payments = []
+    movements = []
+    for pending in batch:
+        pending.processed_at = now
+        pending.error, pending.payment = '', None
+        sender_account = accounts.get(pending.sender_id)
+        recipient_account = accounts.get(pending.recipient_id)
+        if sender_account is None or recipient_account is None:
+            pending.status, pending.error = PendingTransfer.FAILED, "Sender or recipient has no online account"
+            continue
+        debit = convert_amount(pending.amount, pending.currency, sender_account.currency, rates)
+        credit = convert_amount(pending.amount, pending.currency, recipient_account.currency, rates)
+        if debit > available[sender_account.pk]:
+            pending.status, pending.error = PendingTransfer.FAILED, "Insufficient balance"
+            continue
+
+        available[sender_account.pk] -= debit
+        available[recipient_account.pk] += credit
+        deltas[sender_account.pk] = deltas.get(sender_account.pk, 0) - debit
+        deltas[recipient_account.pk] = deltas.get(recipient_account.pk, 0) + credit
+        pending.status = PendingTransfer.COMPLETED
+        payments.append(Payment(
+            sender_id=pending.sender_id,
+            recipient_id=pending.recipient_id,
+            amount=credit,
+            currency=recipient_account.currency,
+            original_amount=pending.amount,
+            original_currency=pending.currency,
+            origin=Payment.DIRECT_PAYMENT,
+            rate_version=rates.version,
+        ))
+        movements.append((pending, sender_account, recipient_account, debit, credit))
+
+    # The accounts are locked, so the running balances above are exact.
+    credit_accounts(deltas, {account.pk: account.shard_count for account in accounts.values()})
+    Payment.objects.bulk_create(payments, batch_size=500)
+    entries = []
+    for payment, (pending, sender_account, recipient_account, debit, credit) in zip(payments, movements):
+        pending.payment = payment
+        entries.extend(transfer_entries(payment, sender_account, recipient_account, debit, credit, now))
+    LedgerEntry.objects.bulk_create(entries, batch_size=500)
+    payments_created(payments)
+
+
+class TransferWorkerPool:
+    """
+    Runs worker threads over the transfer queue. Worker i owns the shards
+    where shard % workers == i, so no shard is ever worked by two threads.
+    """
+
+    def __init__(self, workers=4, batch_size=100, poll_interval=0.5):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+
+    def shards_of(self, worker):
+        return [shard for shard in range(settings.TRANSFER_QUEUE_SHARDS) if shard % self.workers == worker]
+
+    def drain(self, worker):
+        """
+        Processes the worker's shards until they are empty.
+        Returns the number of transfers processed.
+        """
+        shards = self.shards_of(worker)
+        processed = 0
+        while True:
+            # A plain read first, so idle shards never take the write lock.
+            busy = set(
+                PendingTransfer.objects.filter(shard__in=shards, status=PendingTransfer.QUEUED)
+                .values_list('shard', flat=True)
+                .distinct()
+            )
+            if not busy:
+                return processed
+            processed += sum(process_shard(shard, self.batch_size) for shard in sorted(busy))
+
+    def _run(self, worker, once):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.drain(worker)
+                except Exception as e:
+                    # The batch was rolled back and stays queued; try it again later.
+                    logger.exception("Transfer worker %s failed: %s", worker, e)
+                else:
+                    if once:
+                        return
+                self._stop.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+    def run(self, once=False):
+        """
+        Starts the workers and blocks until stop() is called, or with once=True
+        until the queue is empty.
+        """
+        threads = [
+            threading.Thread(target=self._run, args=(worker, once), name=f'transfer-worker-{worker}')
+            for worker in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self._stop.set()
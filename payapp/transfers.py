@@ -0,0 +1,309 @@
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from payapp.account_shards import credit_shards, held_in_shards, settle_shards
+from payapp.ledger import transfer_entries
+from payapp.models import LedgerEntry, Payment
+from payapp.notifications import payments_created
+from payapp.rates import rate_provider
+from payapp.utils import fetch_exchange_rates, fits_amount_field
+from register.models import OnlineAccount
+
+
+TransferResult = namedtuple('TransferResult', ['payment', 'debited_amount', 'debited_currency'])
+
+
+class InsufficientFunds(Exception):
+    """
+    Raised when the sender's balance cannot cover a transfer.
+    """
+
+
+def convert_amount(amount, from_currency, to_currency, rates):
+    """
+    Converts amount between currencies with the given rate snapshot.
+    Falls back to the raw amount if the pair is unsupported, as the views always have.
+    """
+    if from_currency == to_currency:
+        return amount
+    converted = fetch_exchange_rates(from_currency, to_currency, amount, rates)
+    return amount if converted is None else converted
+
+
+def move_funds(sender_account, recipient_account, debit_amount, credit_amount):
+    """
+    Debits one account and credits another with conditional F() updates:
+        UPDATE ... SET balance = balance - x WHERE id = ... AND balance >= x
+    Locks are always taken in the same order, account rows by id and then
+    shards by account id, so two transfers cannot deadlock. A sharded
+    recipient is credited on a random shard instead of its own row. A sharded
+    sender's rows are locked up front, so its shards can be folded in before
+    the debit without taking a shard lock ahead of a row. Runs in its own
+    savepoint; raises InsufficientFunds and rolls back if the debit fails.
+    """
+    changes = [(sender_account.pk, -debit_amount)]
+    shard_credits = []
+    if recipient_account.shard_count > 1:
+        shard_credits.append((recipient_account.pk, recipient_account.shard_count, credit_amount))
+    else:
+        changes.append((recipient_account.pk, credit_amount))
+    changes.sort(key=lambda c: c[0])
+    with transaction.atomic():
+        if sender_account.shard_count > 1:
+            list(
+                OnlineAccount.objects.select_for_update()
+                .filter(pk__in=[account_id for account_id, _ in changes])
+                .order_by('pk')
+                .values_list('pk', flat=True)
+            )
+            settle_shards([sender_account.pk], shard_credits)
+            shard_credits = []
+        for account_id, delta in changes:
+            accounts = OnlineAccount.objects.filter(pk=account_id)
+            if delta < 0:
+                accounts = accounts.filter(balance__gte=-delta)
+            if not accounts.update(balance=F('balance') + delta):
+                raise InsufficientFunds(account_id)
+        if shard_credits:
+            credit_shards(shard_credits)
+
+
+def transfer(sender, recipient, amount, currency, origin=Payment.DIRECT_PAYMENT, rates=None):
+    """
+    Moves amount (given in currency) from sender to recipient and logs a
+    Payment with its debit and credit ledger entries.
+
+    The sender is debited the amount converted to their account currency and
+    the recipient is credited the amount converted to theirs, both with one
+    rate snapshot. Returns a TransferResult with the Payment and the amount
+    debited in the sender's currency.
+    Raises InsufficientFunds, OnlineAccount.DoesNotExist, or ValueError for a
+    non-positive amount.
+    """
+    if not amount > 0:
+        raise ValueError("Amount must be positive.")
+    if rates is None:
+        rates = rate_provider.snapshot()
+
+    with transaction.atomic():
+        accounts = {account.user_id: account for account in OnlineAccount.objects.filter(user_id__in=[sender.pk, recipient.pk])}
+        if sender.pk not in accounts or recipient.pk not in accounts:
+            raise OnlineAccount.DoesNotExist("Sender or recipient has no online account.")
+        sender_account = accounts[sender.pk]
+        recipient_account = accounts[recipient.pk]
+
+        amount_in_sender_currency = convert_amount(amount, currency, sender_account.currency, rates)
+        converted_amount = convert_amount(amount, currency, recipient_account.currency, rates)
+
+        move_funds(sender_account, recipient_account, amount_in_sender_currency, converted_amount)
+
+        payment = Payment.objects.create(
+            sender=sender,
+            recipient=recipient,
+            amount=converted_amount,
+            currency=recipient_account.currency,
+            original_amount=amount,
+            original_currency=currency,
+            origin=origin,
+            rate_version=rates.version,
+        )
+        LedgerEntry.objects.bulk_create(
+            transfer_entries(payment, sender_account, recipient_account, amount_in_sender_currency, converted_amount)
+        )
+        payments_created([payment])
+    return TransferResult(payment, amount_in_sender_currency, sender_account.currency)
+
+
+def credit_accounts(deltas, shard_counts=None):
+    """
+    Adds {account_id: amount} to many balances with one executemany of
+        UPDATE ... SET balance = balance + x WHERE id = ...
+    in account-id order. This is the bulk form of the F() credit in move_funds;
+    bulk_update() would build a CASE expression per row, which dominates the
+    cost of large payouts. Negative amounts are only safe for accounts the
+    caller has locked and checked, since nothing here prevents an overdraft.
+    Credits to accounts with more than one shard in shard_counts
+    ({account_id: shard_count}) go to one of their shards instead.
+    """
+    shard_counts = shard_counts or {}
+    sharded = {
+        account_id for account_id, delta in deltas.items() if delta > 0 and shard_counts.get(account_id, 1) > 1
+    }
+    if sharded:
+        credit_shards([(account_id, shard_counts[account_id], deltas[account_id]) for account_id in sorted(sharded)])
+        deltas = {account_id: delta for account_id, delta in deltas.items() if account_id not in sharded}
+
+    table = connection.ops.quote_name(OnlineAccount._meta.db_table)
+    balance = connection.ops.quote_name(OnlineAccount._meta.get_field('balance').column)
+    pk = connection.ops.quote_name(OnlineAccount._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {table} SET {balance} = {balance} + %s WHERE {pk} = %s",
+            [(delta, account_id) for account_id, delta in sorted(deltas.items())],
+        )
+
+
+def _convert_rows(rows, to_currency_of, rates):
+    """
+    Converts each row's amount into the currency returned by to_currency_of(row),
+    grouping rows by currency pair so each pair is converted in one pass.
+    """
+    groups = {}
+    for index, row in enumerate(rows):
+        groups.setdefault((row['currency'], to_currency_of(row)), []).append(index)
+
+    converted = [None] * len(rows)
+    for (from_currency, to_currency), indexes in groups.items():
+        amounts = [rows[index]['amount'] for index in indexes]
+        if from_currency == to_currency:
+            values = amounts
+        else:
+            values = rates.convert_many(from_currency, to_currency, amounts) or amounts
+        for index, value in zip(indexes, values):
+            converted[index] = value
+    return converted
+
+
+def pay_rows(sender, rows, origin, rates):
+    """
+    Pays many rows from sender inside the caller's transaction. Each row is a
+    dict with the recipient's 'account' (with its user loaded), 'amount' and
+    'currency'.
+
+    The sender's account is locked once, in id order with the recipients'
+    rows (see move_funds), and amounts are converted once per currency pair.
+    Rows are applied in order while the sender's balance lasts, checked
+    against a running total. Then recipients are credited in bulk, the sender
+    is debited with one conditional update, and Payment rows and ledger
+    entries are written with bulk_create.
+
+    Returns (paid, unpaid): a list of (row, Payment) for the rows paid, and
+    the rows skipped for lack of funds.
+    """
+    recipient_ids = {row['account'].pk for row in rows if row['account'].shard_count <= 1}
+    locked = OnlineAccount.objects.select_for_update().filter(Q(user=sender) | Q(pk__in=recipient_ids)).order_by('pk')
+    sender_account = next((account for account in locked if account.user_id == sender.pk), None)
+    if sender_account is None:
+        raise OnlineAccount.DoesNotExist("Sender has no online account.")
+
+    debits = _convert_rows(rows, lambda row: sender_account.currency, rates)
+    credits = _convert_rows(rows, lambda row: row['account'].currency, rates)
+
+    available = sender_account.balance
+    if sender_account.shard_count > 1:
+        # Folded into the row by settle_shards() below, before the debit.
+        available += held_in_shards(sender_account.pk)
+    deltas = {}
+    payments = []
+    paid_rows = []
+    unpaid = []
+    movements = []
+    for row, debit, credit in zip(rows, debits, credits):
+        if debit > available:
+            unpaid.append(row)
+            continue
+        available -= debit
+        recipient_account = row['account']
+        deltas[sender_account.pk] = deltas.get(sender_account.pk, 0) - debit
+        deltas[recipient_account.pk] = deltas.get(recipient_account.pk, 0) + credit
+        payments.append(Payment(
+            sender=sender,
+            recipient=recipient_account.user,
+            amount=credit,
+            currency=recipient_account.currency,
+            original_amount=row['amount'],
+            original_currency=row['currency'],
+            origin=origin,
+            rate_version=rates.version,
+        ))
+        paid_rows.append(row)
+        movements.append((recipient_account, debit, credit))
+
+    if payments:
+        sender_delta = deltas.pop(sender_account.pk)
+        shard_counts = {row['account'].pk: row['account'].shard_count for row in paid_rows}
+        credit_accounts({account_id: delta for account_id, delta in deltas.items() if shard_counts[account_id] <= 1})
+        settle_shards(
+            [sender_account.pk] if sender_account.shard_count > 1 else [],
+            [(account_id, shard_counts[account_id], delta) for account_id, delta in deltas.items() if shard_counts[account_id] > 1],
+        )
+        # The sender's debit stays conditional, as in move_funds.
+        updated = OnlineAccount.objects.filter(pk=sender_account.pk, balance__gte=-sender_delta).update(
+            balance=F('balance') + sender_delta
+        )
+        if not updated:
+            raise InsufficientFunds(sender_account.pk)
+
+        Payment.objects.bulk_create(payments, batch_size=500)
+        created_at = timezone.now()
+        entries = []
+        for payment, (recipient_account, debit, credit) in zip(payments, movements):
+            entries.extend(transfer_entries(payment, sender_account, recipient_account, debit, credit, created_at))
+        LedgerEntry.objects.bulk_create(entries, batch_size=500)
+        payments_created(payments)
+
+    return list(zip(paid_rows, payments)), unpaid
+
+
+def bulk_transfer(sender, payouts, origin=Payment.DIRECT_PAYMENT, rates=None):
+    """
+    Pays many recipients from one sender in a single transaction.
+
+    payouts is a list of dicts with recipient_email, amount and currency.
+    Recipients are resolved with one query and paid with pay_rows(). Rows
+    are applied in order while the sender's balance lasts; rows that cannot
+    be paid are skipped.
+
+    Returns one result dict per payout, in order, with either the created
+    payment_id or an error.
+    """
+    if rates is None:
+        rates = rate_provider.snapshot()
+
+    results = [None] * len(payouts)
+    rows = []
+    for index, payout in enumerate(payouts):
+        try:
+            amount = Decimal(str(payout.get('amount')))
+        except (InvalidOperation, ValueError, TypeError, AttributeError):
+            amount = None
+        currency = payout.get('currency', 'GBP') if isinstance(payout, dict) else None
+        # An unhashable currency (e.g. a JSON list) can never be supported.
+        currency = currency if isinstance(currency, str) else None
+        if amount is None or not fits_amount_field(amount) or amount <= 0:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Invalid amount'}
+        elif currency not in rates.currencies:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Unsupported currency'}
+        elif not isinstance(payout.get('recipient_email'), str):
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Recipient not found'}
+        else:
+            rows.append({'index': index, 'email': payout.get('recipient_email'), 'amount': amount, 'currency': currency})
+
+    with transaction.atomic():
+        emails = {row['email'] for row in rows}
+        accounts = {
+            account.user.email: account
+            for account in OnlineAccount.objects.select_related('user')
+            .only('id', 'currency', 'shard_count', 'user__id', 'user__email')
+            .filter(user__email__in=emails)
+        }
+
+        found = []
+        for row in rows:
+            row['account'] = accounts.get(row['email'])
+            if row['account'] is None:
+                results[row['index']] = {'index': row['index'], 'status': 'failed', 'error': 'Recipient not found'}
+            else:
+                found.append(row)
+
+        paid, unpaid = pay_rows(sender, found, origin, rates)
+        for row in unpaid:
+            results[row['index']] = {'index': row['index'], 'status': 'failed', 'error': 'Insufficient balance'}
+        for row, payment in paid:
+            results[row['index']] = {'index': row['index'], 'status': 'ok', 'payment_id': payment.pk}
+
+    return results
@@ -4,11 +4,19 @@ from payapp.views import currency_conversion
 
 urlpatterns = [
     path('direct_payment/', views.direct_payment, name='direct_payment'),
+    path('transfer_status/<int:transfer_id>/', views.transfer_status, name='transfer_status'),
+    path('bulk_payment/', views.bulk_payment, name='bulk_payment'),
+    path('schedule_payment/', views.schedule_payment, name='schedule_payment'),
+    path('split_request/', views.split_payment_request, name='split_payment_request'),
     path('request_payment/', views.create_payment_request, name='create_payment_request'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/<str:list_name>/', views.dashboard_page, name='dashboard_page'),
     path('accept_request/<int:request_id>/', views.accept_payment_request, name='accept_payment_request'),
+    path('respond_requests/', views.bulk_respond_payment_requests, name='bulk_respond_payment_requests'),
     path('reject_request/<int:request_id>/', views.reject_payment_request, name='reject_payment_request'),
     path('admin_dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('convert/', views.convert_currency, name='convert_currency'),
+    path('conversion/stats/', views.rate_service_stats, name='rate_service_stats'),
+    path('conversion/batch/', views.batch_currency_conversion, name='batch_currency_conversion'),
     path('conversion/<str:currency1>/<str:currency2>/<str:amount>/', currency_conversion, name='currency_conversion'),
 ]
@@ -1,18 +1,72 @@
-import requests
+from decimal import Decimal
 
-def fetch_exchange_rates(currency1, currency2, amount):
+from django.db import connection
+
+from payapp.rates import rate_provider
+
+
+def fetch_exchange_rates(currency1, currency2, amount, snapshot=None):
     """
-    Calls the RESTful currency conversion API and retrieves the converted amount.
-    Example API call: /conversion/USD/GBP/100/
+    Converts an amount using the in-process rate engine and returns the
+    converted amount as a Decimal, or None if the currency pair is unsupported.
+    The REST endpoint (/conversion/USD/GBP/100/) reads from the same engine,
+    so results match without an HTTP round trip to our own server.
+    Pass a snapshot to pin several conversions to the same rate table.
     """
-    url = f"https://0.0.0.0:8000/payapp/conversion/{currency1}/{currency2}/{amount}/"
-
+    if snapshot is None:
+        snapshot = rate_provider.snapshot()
     try:
-        response = requests.get(url, verify=False)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("converted_amount")
-        else:
-            return None
-    except requests.exceptions.RequestException:
-        return None
\ No newline at end of file
+        return snapshot.convert(currency1, currency2, amount)
+    except ArithmeticError:
+        return None
+
+
+def fits_amount_field(amount, max_digits=10, decimal_places=2):
+    """
+    Returns whether a Decimal amount can be saved to a
+    DecimalField(max_digits, decimal_places) as it is: finite, small enough
+    for the integer digits, and with no more than decimal_places decimals.
+    Checking the magnitude first keeps quantize() from overflowing on 1e30.
+    """
+    if not amount.is_finite() or abs(amount) >= 10 ** (max_digits - decimal_places):
+        return False
+    return amount == amount.quantize(Decimal(1).scaleb(-decimal_places))
+
+
+def update_rows(objects, field_names):
+    """
+    Saves field_names of many model instances with one executemany of
+        UPDATE ... SET a = %s, b = %s WHERE id = %s
+    For batches of a few hundred rows this is much cheaper than bulk_update(),
+    which compiles a CASE expression per row and field.
+    """
+    if not objects:
+        return
+    meta = objects[0]._meta
+    fields = [meta.get_field(name) for name in field_names]
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f"{quote(field.column)} = %s" for field in fields)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {quote(meta.db_table)} SET {assignments} WHERE {quote(meta.pk.column)} = %s",
+            [
+                [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+                for obj in objects
+            ],
+        )
+
+
+def split_amount(total, weights):
+    """
+    Splits total into len(weights) parts proportional to weights, in whole
+    cents that always add up to total. Cents left over after rounding down go
+    to the parts with the largest remainders (largest remainder method), the
+    earliest first on ties.
+    """
+    cents = int((total * 100).to_integral_value())
+    weight_sum = sum(weights)
+    shares = [int(cents * weight // weight_sum) for weight in weights]
+    remainders = sorted(range(len(weights)), key=lambda i: (-(cents * weights[i] % weight_sum), i))
+    for i in remainders[:cents - sum(shares)]:
+        shares[i] += 1
+    return [Decimal(share).scaleb(-2) for share in shares]
@@ -1,48 +1,149 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.db import transaction
-from .models import PaymentRequest, Payment
+from .models import PaymentRequest, Payment, PendingTransfer, ScheduledPayment
 from register.models import OnlineAccount
 from django.http import JsonResponse
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
-from payapp.utils import fetch_exchange_rates
-from decimal import Decimal
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from payapp.utils import fetch_exchange_rates, fits_amount_field, split_amount
+from payapp.rates import rate_provider
+from payapp.transfers import transfer, bulk_transfer, InsufficientFunds
+from payapp.dashboard import dashboard_data, dashboard_lists, page
+from payapp.idempotency import idempotent
+from payapp.notifications import mark_all_read, requests_closed, requests_created
+from payapp.transfer_queue import enqueue_transfer
+from payapp.payment_requests import bulk_accept_requests, bulk_reject_requests
+from decimal import Decimal, InvalidOperation
 from django.contrib.auth import authenticate, login
+import uuid
 
 # REST implementation starts here
 
-EXCHANGE_RATES = {
-    'USD': {'GBP': 0.75, 'EUR': 0.85},
-    'GBP': {'USD': 1.33, 'EUR': 1.14},
-    'EUR': {'USD': 1.18, 'GBP': 0.88},
-}
-
-
 @api_view(['GET'])
 def currency_conversion(request, currency1, currency2, amount):
     """
-    RESTful API for hardcoded currency conversion.
+    RESTful API for hardcoded currency conversion, kept for external clients.
+    Reads from the same in-process rate engine as the payment views.
     Example: /conversion/USD/GBP/100/
     """
     try:
-        amount = float(amount)
-
-        if currency1 in EXCHANGE_RATES and currency2 in EXCHANGE_RATES[currency1]:
-            conversion_rate = EXCHANGE_RATES[currency1][currency2]
-            converted_amount = round(amount * conversion_rate, 2)
-            return Response({'converted_amount': converted_amount, 'rate': conversion_rate})
+        amount = Decimal(amount)
+        if not amount.is_finite():
+            raise ValueError(amount)
+
+        rates = rate_provider.snapshot()
+        conversion_rate = rates.rate(currency1, currency2)
+        if conversion_rate is not None:
+            converted_amount = rates.convert(currency1, currency2, amount)
+            return Response({
+                'converted_amount': float(converted_amount),
+                'rate': float(conversion_rate),
+                'version': rates.version,
+            })
 
         return Response({'error': 'Unsupported currency'}, status=400)
 
-    except ValueError:
+    except (ValueError, InvalidOperation):
         return Response({'error': 'Invalid amount'}, status=400)
 
+
+BATCH_CONVERSION_LIMIT = 10000
+
+
+def _parse_amount(value):
+    """
+    Parses a conversion amount the same way the single-shot endpoint does.
+    Returns None for anything that is not a finite number.
+    """
+    try:
+        amount = Decimal(str(value))
+    except (ValueError, InvalidOperation):
+        return None
+    return amount if amount.is_finite() else None
+
+
+def _convert_or_none(rates, currency1, currency2, amount):
+    """
+    Converts one amount, returning None where /conversion/ answers "Invalid amount".
+    """
+    try:
+        return rates.convert(currency1, currency2, amount)
+    except ArithmeticError:
+        return None
+
+
+@api_view(['POST'])
+def batch_currency_conversion(request):
+    """
+    RESTful API converting many amounts in one request.
+    Accepts either a list of conversions:
+        {"conversions": [{"currency1": "USD", "currency2": "GBP", "amount": 100}, ...]}
+    or one currency pair with a list of amounts:
+        {"currency1": "USD", "currency2": "GBP", "amounts": [100, 250.5]}
+    Results are returned in request order and match /conversion/ exactly.
+    """
+    data = request.data
+    if not isinstance(data, dict):
+        return Response({'error': 'Request body must be a JSON object'}, status=400)
+    if 'amounts' in data:
+        amounts = data.get('amounts')
+        if not isinstance(amounts, list):
+            return Response({'error': 'amounts must be a list'}, status=400)
+        items = [(data.get('currency1'), data.get('currency2'), amount) for amount in amounts]
+    else:
+        conversions = data.get('conversions')
+        if not isinstance(conversions, list) or not all(isinstance(item, dict) for item in conversions):
+            return Response({'error': 'conversions must be a list of objects'}, status=400)
+        items = [(item.get('currency1'), item.get('currency2'), item.get('amount')) for item in conversions]
+
+    if len(items) > BATCH_CONVERSION_LIMIT:
+        return Response({'error': f'At most {BATCH_CONVERSION_LIMIT} conversions per request'}, status=400)
+
+    # Group valid items by currency pair so each pair's rate is looked up once.
+    rates = rate_provider.snapshot()
+    results = [None] * len(items)
+    groups = {}
+    for index, (currency1, currency2, value) in enumerate(items):
+        amount = _parse_amount(value)
+        if amount is None:
+            results[index] = {'error': 'Invalid amount'}
+        elif not isinstance(currency1, str) or not isinstance(currency2, str) or rates.rate(currency1, currency2) is None:
+            results[index] = {'error': 'Unsupported currency'}
+        else:
+            groups.setdefault((currency1, currency2), []).append((index, amount))
+
+    for (currency1, currency2), group in groups.items():
+        conversion_rate = float(rates.rate(currency1, currency2))
+        try:
+            converted = rates.convert_many(currency1, currency2, [amount for _, amount in group])
+        except ArithmeticError:
+            # Some amount is too large to round to cents; convert one at a time to find it.
+            converted = [_convert_or_none(rates, currency1, currency2, amount) for _, amount in group]
+        for (index, amount), converted_amount in zip(group, converted):
+            if converted_amount is None:
+                results[index] = {'error': 'Invalid amount'}
+                continue
+            results[index] = {
+                'currency1': currency1,
+                'currency2': currency2,
+                'amount': float(amount),
+                'converted_amount': float(converted_amount),
+                'rate': conversion_rate,
+            }
+
+    return Response({'version': rates.version, 'results': results})
+
 def convert_currency(request):
     """
-    Converts an amount using the RESTful API-based conversion and returns
+    Converts an amount using the in-process rate engine and returns
     base currency, target currency, amount, exchange rate, and converted amount.
     """
     base = request.GET.get('base', 'GBP')
@@ -54,6 +155,7 @@ def convert_currency(request):
         converted = fetch_exchange_rates(base, target, amount)
 
         if converted is not None:
+            converted = float(converted)
             exchange_rate = round(converted / amount, 4) if amount != 0 else None
             return JsonResponse({
                 "base_currency": base,
@@ -90,23 +192,7 @@ def dashboard(request):
         messages.error(request, "Unauthorized access to dashboard!")
         return redirect('admin_dashboard')
 
-    user_account = OnlineAccount.objects.get(user=request.user)
-
-    # Direct Payments
-    sent_direct_payments = Payment.objects.filter(sender=request.user, origin=Payment.DIRECT_PAYMENT)
-    received_direct_payments = Payment.objects.filter(recipient=request.user, origin=Payment.DIRECT_PAYMENT,read_status=False )
-
-    # Payments from Requests
-    sent_request_payments = Payment.objects.filter(sender=request.user, origin=Payment.PAYMENT_REQUEST)
-    received_request_payments = Payment.objects.filter(recipient=request.user, origin=Payment.PAYMENT_REQUEST,read_status=False)
-    pending_requests = PaymentRequest.objects.filter(requestee=request.user, status='pending', read_status=False)
-    requested_payments = PaymentRequest.objects.filter(requester=request.user)
-
-    # Calculate the counts for new entries
-
-    received_direct_payments_unread_count = received_direct_payments.count()
-    received_request_payments_unread_count = received_request_payments.count()
-    pending_requests_unread_count = pending_requests.count()
+    data = dashboard_data(request.user)
 
     # Define currency symbols
     currency_symbols = {
@@ -114,30 +200,44 @@ def dashboard(request):
         'USD': '$',
         'EUR': '€',
     }
-    user_currency_symbol = currency_symbols.get(user_account.currency, '')
+    user_currency_symbol = currency_symbols.get(data['currency'], '')
 
     context = {
-        'balance': user_account.balance,
+        **data,
         'currency_symbol': user_currency_symbol,
-        'currency': user_account.currency,
-        'sent_direct_payments': sent_direct_payments,
-        'received_direct_payments': received_direct_payments,
-        'sent_request_payments': sent_request_payments,
-        'received_request_payments': received_request_payments,
-        'pending_requests': pending_requests,
-        'requested_payments': requested_payments,
-        'received_direct_payments_unread_count': received_direct_payments_unread_count,
-        'received_request_payments_unread_count': received_request_payments_unread_count,
-        'pending_requests_unread_count': pending_requests_unread_count,
+        # Fresh per page load, so resubmitting a form from this page is a retry.
+        'idempotency_key': uuid.uuid4().hex,
     }
     return render(request, 'payapp/dashboard.html', context)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dashboard_page(request, list_name):
+    """
+    RESTful API returning the next page of one of the dashboard lists, for
+    its "Load more" button. Example: /payapp/dashboard/sent_direct_payments/?cursor=...
+    Responds with the rows and the cursor of the following page (null on the last).
+    """
+    lists = dashboard_lists(request.user)
+    if list_name not in lists:
+        return Response({'error': 'Unknown list'}, status=404)
+    try:
+        rows, next_cursor = page(lists[list_name], request.query_params.get('cursor'))
+    except ValueError:
+        return Response({'error': 'Invalid cursor'}, status=400)
+    return Response({'results': rows, 'next_cursor': next_cursor})
+
+
 @login_required
-@transaction.atomic
+@idempotent
 def direct_payment(request):
     """
     Handles direct payments by users.
+    Retries sent with the same idempotency key are answered without paying again.
+    In queued mode (DIRECT_PAYMENT_MODE setting, or a mode=queued field) the
+    payment is handed to the transfer workers and its pending transfer id is
+    returned, as JSON to clients that accept it, for polling at transfer_status.
     """
     if request.method == 'POST':
         recipient_email = request.POST.get('recipient_email')
@@ -149,87 +249,34 @@ def direct_payment(request):
             return redirect('dashboard')
 
         sending_currency = request.POST.get('currency', 'GBP')
+        mode = request.POST.get('mode', settings.DIRECT_PAYMENT_MODE)
 
         try:
-            # Fetch user accounts
             recipient = User.objects.get(email=recipient_email)
-            sender_account = OnlineAccount.objects.get(user=request.user)
-            recipient_account = OnlineAccount.objects.get(user=recipient)
-
-            # Debug logs
-            print(f"Sender's Currency: {sender_account.currency}")
-            print(f"Sending Currency: {sending_currency}")
-            print(f"Recipient's Currency: {recipient_account.currency}")
-
-            # Initialize variables
-            converted_amount = Decimal('0')
-            amount_in_sender_currency = amount
-
-            # CASE 1: Sender's account currency equals the sending currency
-            if sender_account.currency == sending_currency:
-                amount_in_sender_currency = amount  # No conversion required for deduction
-                if recipient_account.currency == sending_currency:
-                    converted_amount = amount  # No conversion required for recipient
-                    print("Same-Currency Transaction: No conversion applied for recipient.")
-                else:
-                    # Convert from sending_currency to recipient's currency
-                    conv_value = fetch_exchange_rates(sending_currency, recipient_account.currency, float(amount))
-                    if conv_value is not None:
-                        converted_amount = Decimal(str(conv_value))
-                        print("Cross-Currency Transaction: Conversion applied for recipient.")
-                    else:
-                        converted_amount = amount
-                        print("Fallback: Unable to fetch conversion rate for recipient's currency.")
-            else:
-                # CASE 2: Sender's account currency is different from sending currency.
-                conv_value_sender = fetch_exchange_rates(sending_currency, sender_account.currency, float(amount))
-                if conv_value_sender is not None:
-                    amount_in_sender_currency = Decimal(str(conv_value_sender))
-                else:
-                    amount_in_sender_currency = amount
-
-                # Convert for recipient credit: from sending_currency to recipient_account.currency.
-                conv_value_recipient = fetch_exchange_rates(sending_currency, recipient_account.currency, float(amount))
-                if conv_value_recipient is not None:
-                    converted_amount = Decimal(str(conv_value_recipient))
-                else:
-                    converted_amount = amount  # Fallback
-                print("Cross-Currency Transaction: Conversions applied for both sender and recipient.")
-
-            # Debug print amounts
-            print(f"Amount Deducted (in Sender's Currency {sender_account.currency}): {amount_in_sender_currency}")
-            print(f"Amount Credited (in Recipient's Currency {recipient_account.currency}): {converted_amount}")
-
-            # Check if sender has sufficient balance
-            if sender_account.balance >= amount_in_sender_currency:
-                # Deduct from sender's account
-                sender_account.balance -= amount_in_sender_currency
-                sender_account.save()
-
-                # Credit the recipient's account
-                recipient_account.balance += converted_amount
-                recipient_account.save()
-
-                # Log the transaction
-                Payment.objects.create(
-                    sender=request.user,
-                    recipient=recipient,
-                    amount=converted_amount,
-                    currency=recipient_account.currency,
-                    original_amount=amount,
-                    original_currency=sending_currency,
-                    origin=Payment.DIRECT_PAYMENT
-                )
-
-                messages.success(
-                    request,
-                    f"Payment of {amount} {sending_currency} sent successfully! "
-                    f"Deducted {amount_in_sender_currency} {sender_account.currency} from your account."
-                )
-            else:
-                messages.error(request, "Insufficient balance!")
+
+            if mode == 'queued':
+                pending = enqueue_transfer(request.user, recipient, amount, sending_currency)
+                status_url = reverse('transfer_status', args=[pending.pk])
+                if request.accepts('application/json') and not request.accepts('text/html'):
+                    return JsonResponse(
+                        {'pending_transfer_id': pending.pk, 'status': pending.status, 'status_url': status_url},
+                        status=202,
+                    )
+                messages.info(request, f"Payment of {amount} {sending_currency} queued as transfer #{pending.pk}.")
+                return redirect('dashboard')
+
+            # Deduct from the sender, credit the recipient and log the payment atomically
+            result = transfer(request.user, recipient, amount, sending_currency)
+
+            messages.success(
+                request,
+                f"Payment of {amount} {sending_currency} sent successfully! "
+                f"Deducted {result.debited_amount} {result.debited_currency} from your account."
+            )
         except User.DoesNotExist:
             messages.error(request, "Recipient not found!")
+        except InsufficientFunds:
+            messages.error(request, "Insufficient balance!")
         except Exception as e:
             messages.error(request, f"An error occurred: {e}")
             print(f"Error: {e}")
@@ -239,6 +286,171 @@ def direct_payment(request):
     return
 
 
+@login_required
+def transfer_status(request, transfer_id):
+    """
+    Returns the status of one of the user's queued direct payments as JSON.
+    """
+    pending = get_object_or_404(PendingTransfer, id=transfer_id, sender=request.user)
+    return JsonResponse({
+        'pending_transfer_id': pending.pk,
+        'status': pending.status,
+        'error': pending.error or None,
+        'payment_id': pending.payment_id,
+        'processed_at': pending.processed_at,
+    })
+
+
+BULK_PAYOUT_LIMIT = 50000
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_payment(request):
+    """
+    RESTful API paying many recipients from the logged-in user in one transaction.
+    Example body:
+        {"payouts": [{"recipient_email": "a@example.com", "amount": "10.00", "currency": "GBP"}, ...]}
+    Responds with one result per payout, so partial failures are reported row by row.
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Request body must be a JSON object'}, status=400)
+    payouts = request.data.get('payouts')
+    if not isinstance(payouts, list):
+        return Response({'error': 'payouts must be a list'}, status=400)
+    if len(payouts) > BULK_PAYOUT_LIMIT:
+        return Response({'error': f'At most {BULK_PAYOUT_LIMIT} payouts per request'}, status=400)
+
+    try:
+        results = bulk_transfer(request.user, payouts)
+    except OnlineAccount.DoesNotExist:
+        return Response({'error': 'You do not have an online account'}, status=400)
+
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    return Response({
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results,
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def schedule_payment(request):
+    """
+    RESTful API creating a standing order for the logged-in user, run by
+    "manage.py run_scheduled_payments". Example body:
+        {"recipient_email": "a@example.com", "amount": "25.00", "currency": "GBP",
+         "recurrence": "monthly", "interval": 1, "start_at": "2025-05-01T09:00:00Z"}
+    start_at defaults to now; end_at is optional and may not be before start_at.
+    """
+    data = request.data
+    if not isinstance(data, dict):
+        return Response({'error': 'Request body must be a JSON object'}, status=400)
+    amount = _parse_amount(data.get('amount'))
+    if amount is None or not fits_amount_field(amount) or amount <= 0:
+        return Response({'error': 'Invalid amount'}, status=400)
+    currency = data.get('currency', 'GBP')
+    if not isinstance(currency, str) or currency not in rate_provider.snapshot().currencies:
+        return Response({'error': 'Unsupported currency'}, status=400)
+    recurrence = data.get('recurrence', ScheduledPayment.ONCE)
+    if recurrence not in dict(ScheduledPayment.RECURRENCE_CHOICES):
+        return Response({'error': 'Invalid recurrence'}, status=400)
+    try:
+        interval = int(data.get('interval', 1))
+        start_at = parse_datetime(data['start_at']) if data.get('start_at') else timezone.now()
+        end_at = parse_datetime(data['end_at']) if data.get('end_at') else None
+    except (TypeError, ValueError):
+        return Response({'error': 'Invalid interval or date'}, status=400)
+    if not 1 <= interval <= 366 or start_at is None or (data.get('end_at') and end_at is None):
+        return Response({'error': 'Invalid interval or date'}, status=400)
+    start_at, end_at = [
+        timezone.make_aware(when) if when is not None and timezone.is_naive(when) else when
+        for when in (start_at, end_at)
+    ]
+    if end_at is not None and end_at < start_at:
+        return Response({'error': 'end_at must not be before start_at'}, status=400)
+    try:
+        recipient = User.objects.get(email=data.get('recipient_email'))
+    except User.DoesNotExist:
+        return Response({'error': 'Recipient not found'}, status=400)
+    if recipient == request.user:
+        return Response({'error': 'You cannot schedule a payment to yourself'}, status=400)
+
+    schedule = ScheduledPayment.objects.create(
+        sender=request.user,
+        recipient=recipient,
+        amount=amount,
+        currency=currency,
+        recurrence=recurrence,
+        interval=interval,
+        start_at=start_at,
+        end_at=end_at,
+        next_run_at=start_at,
+    )
+    return Response({'id': schedule.pk, 'next_run_at': schedule.next_run_at, 'status': schedule.status}, status=201)
+
+
+SPLIT_REQUEST_LIMIT = 500
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def split_payment_request(request):
+    """
+    RESTful API splitting a bill into one payment request per requestee.
+    Example body:
+        {"total": "100.00", "currency": "GBP",
+         "requestees": ["a@example.com", "b@example.com"], "weights": [2, 1]}
+    weights are optional (equal shares by default). Shares are in whole cents
+    and add up to the total exactly. Nothing is created unless every
+    requestee is found.
+    """
+    data = request.data
+    if not isinstance(data, dict):
+        return Response({'error': 'Request body must be a JSON object'}, status=400)
+    total = _parse_amount(data.get('total'))
+    if total is None or not fits_amount_field(total) or total <= 0:
+        return Response({'error': 'Invalid total'}, status=400)
+    currency = data.get('currency', 'GBP')
+    if not isinstance(currency, str) or currency not in rate_provider.snapshot().currencies:
+        return Response({'error': 'Unsupported currency'}, status=400)
+    emails = data.get('requestees')
+    if not isinstance(emails, list) or not emails or not all(isinstance(email, str) for email in emails):
+        return Response({'error': 'requestees must be a non-empty list of emails'}, status=400)
+    if len(emails) > SPLIT_REQUEST_LIMIT:
+        return Response({'error': f'At most {SPLIT_REQUEST_LIMIT} requestees per request'}, status=400)
+    if len(set(emails)) != len(emails):
+        return Response({'error': 'Each requestee may appear only once'}, status=400)
+    weights = data.get('weights', [1] * len(emails))
+    weights = [_parse_amount(weight) for weight in weights] if isinstance(weights, list) else []
+    if len(weights) != len(emails) or not all(weight is not None and weight > 0 for weight in weights):
+        return Response({'error': 'weights must be positive numbers, one per requestee'}, status=400)
+
+    users = {user.email: user for user in User.objects.filter(email__in=emails).only('id', 'email')}
+    unknown = [email for email in emails if email not in users]
+    if unknown:
+        return Response({'error': 'Requestees not found', 'unknown': unknown}, status=400)
+    if request.user.email in users:
+        return Response({'error': 'You cannot request a payment from yourself'}, status=400)
+
+    shares = split_amount(total, weights)
+    if not all(shares):
+        return Response({'error': 'The total is too small to split between every requestee'}, status=400)
+    with transaction.atomic():
+        requests = PaymentRequest.objects.bulk_create(
+            PaymentRequest(requester=request.user, requestee=users[email], amount=share, currency=currency)
+            for email, share in zip(emails, shares)
+        )
+        requests_created(requests)
+    return Response({
+        'requests': [
+            {'id': payment_request.pk, 'requestee': email, 'amount': str(payment_request.amount)}
+            for email, payment_request in zip(emails, requests)
+        ],
+    }, status=201)
+
+
 @login_required
 def create_payment_request(request):
     """
@@ -262,12 +474,14 @@ def create_payment_request(request):
             return redirect('create_payment_request')
 
         # Create PaymentRequest with selected currency
-        PaymentRequest.objects.create(
-            requester=request.user,
-            requestee=requestee,
-            amount=amount,
-            currency=currency
-        )
+        with transaction.atomic():
+            payment_request = PaymentRequest.objects.create(
+                requester=request.user,
+                requestee=requestee,
+                amount=amount,
+                currency=currency
+            )
+            requests_created([payment_request])
         messages.success(request, "Payment request sent!")
         return redirect('dashboard')
     else:
@@ -275,11 +489,12 @@ def create_payment_request(request):
 
 
 @login_required
+@idempotent
 @transaction.atomic
 def accept_payment_request(request, request_id):
     """
     Handles payment request acceptance by users.
-    Performs currency conversion using the RESTful API as needed.
+    Performs currency conversion using the in-process rate engine as needed.
     """
     payment_request = get_object_or_404(PaymentRequest, id=request_id)
 
@@ -287,90 +502,88 @@ def accept_payment_request(request, request_id):
         messages.error(request, "You are not authorized to accept this payment request.")
         return redirect('dashboard')
 
-    # The sender here is the user accepting the request.
-    sender_account = OnlineAccount.objects.get(user=request.user)
-    # The recipient is the one who created the payment request.
-    recipient_account = OnlineAccount.objects.get(user=payment_request.requester)
-
-    # Initialize conversion variables.
-    # Amount to be deducted from sender and amount to be credited to recipient.
-    amount_in_sender_currency = payment_request.amount
-    converted_amount = payment_request.amount
+    # Claim the request first so a concurrent or repeated accept cannot pay it
+    # twice, or pay it after it has expired.
+    if not PaymentRequest.objects.live().filter(pk=payment_request.pk).update(status='accepted'):
+        messages.error(request, "This payment request is no longer pending.")
+        return redirect('dashboard')
+    requests_closed([(payment_request.requestee_id, payment_request.pk)])
 
-    # Convert for sender's deduction if sender's account currency differs from the request currency.
-    if sender_account.currency != payment_request.currency:
-        conv_value_sender = fetch_exchange_rates(
-            payment_request.currency, sender_account.currency, float(payment_request.amount)
+    try:
+        # The sender is the user accepting the request; the recipient created it.
+        transfer(
+            request.user,
+            payment_request.requester,
+            payment_request.amount,
+            payment_request.currency,
+            origin=Payment.PAYMENT_REQUEST,
         )
-        if conv_value_sender is not None:
-            amount_in_sender_currency = Decimal(str(conv_value_sender))
-            print("Converted amount for sender's deduction applied.")
-        else:
-            print("Fallback: Using raw amount for sender's deduction.")
-    else:
-        print("Same-Currency Transaction: No conversion for sender.")
+    except InsufficientFunds:
+        transaction.set_rollback(True)
+        messages.error(request, "You have insufficient balance to complete the payment.")
+        return redirect('dashboard')
 
-    # Convert for recipient's credit if recipient's account currency differs from the request currency.
-    if recipient_account.currency != payment_request.currency:
-        conv_value_recipient = fetch_exchange_rates(
-            payment_request.currency, recipient_account.currency, float(payment_request.amount)
-        )
-        if conv_value_recipient is not None:
-            converted_amount = Decimal(str(conv_value_recipient))
-            print("Converted amount for recipient's credit applied.")
-        else:
-            print("Fallback: Using raw amount for recipient's credit.")
-    else:
-        print("Same-Currency Transaction: No conversion for recipient.")
-
-    # Debug: Print deduction and credit details.
-    print(f"Amount Deducted (Sender's Currency - {sender_account.currency}): {amount_in_sender_currency}")
-    print(f"Amount Credited (Recipient's Currency - {recipient_account.currency}): {converted_amount}")
-
-    # Check if the sender (requestee) has sufficient balance.
-    if sender_account.balance >= amount_in_sender_currency:
-        # Deduct from sender's account.
-        sender_account.balance -= amount_in_sender_currency
-        sender_account.save()
-
-        # Credit the recipient's account.
-        recipient_account.balance += converted_amount
-        recipient_account.save()
-
-        # Create a payment record.
-        Payment.objects.create(
-            sender=request.user,
-            recipient=payment_request.requester,
-            amount=converted_amount,
-            currency=payment_request.currency,
-            origin=Payment.PAYMENT_REQUEST
-        )
+    messages.info(
+        request,
+        f"You have successfully accepted the payment request of {payment_request.amount} {payment_request.currency}."
+    )
+    return redirect('dashboard')
 
-        # Update the payment request status to accepted.
-        payment_request.status = 'accepted'
-        payment_request.save()
 
-        messages.info(
-            request,
-            f"You have successfully accepted the payment request of {payment_request.amount} {payment_request.currency}."
-        )
-    else:
-        messages.error(request, "You have insufficient balance to complete the payment.")
+BULK_RESPONSE_LIMIT = 1000
 
-    return redirect('dashboard')
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_respond_payment_requests(request):
+    """
+    RESTful API accepting or rejecting many of the user's pending payment requests at once.
+    Example body:
+        {"action": "accept", "request_ids": [12, 13, 14]}
+    Accepted requests are paid in one transaction while the balance lasts.
+    Responds with one result per request id, so partial successes are reported row by row.
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Request body must be a JSON object'}, status=400)
+    action = request.data.get('action')
+    if action not in ('accept', 'reject'):
+        return Response({'error': 'action must be "accept" or "reject"'}, status=400)
+    request_ids = request.data.get('request_ids')
+    if not isinstance(request_ids, list) or not all(type(request_id) is int for request_id in request_ids):
+        return Response({'error': 'request_ids must be a list of integers'}, status=400)
+    if len(request_ids) > BULK_RESPONSE_LIMIT:
+        return Response({'error': f'At most {BULK_RESPONSE_LIMIT} requests per call'}, status=400)
+
+    try:
+        if action == 'accept':
+            results = bulk_accept_requests(request.user, request_ids)
+        else:
+            results = bulk_reject_requests(request.user, request_ids)
+    except OnlineAccount.DoesNotExist:
+        return Response({'error': 'You do not have an online account'}, status=400)
+
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    return Response({
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results,
+    })
 
 
 @login_required
+@transaction.atomic
 def reject_payment_request(request, request_id):
     """
     Handles payment request rejection by users.
     """
-    payment_request = get_object_or_404(PaymentRequest, id=request_id)
+    payment_request = get_object_or_404(PaymentRequest.objects.select_for_update(), id=request_id)
 
     if payment_request.requestee != request.user:
         messages.error(request, "You are not authorized to reject this payment request.")
         return redirect('dashboard')
 
+    if payment_request.status == 'pending':
+        requests_closed([(payment_request.requestee_id, payment_request.pk)])
     payment_request.status = 'rejected'
     payment_request.save()
 
@@ -394,7 +607,7 @@ def admin_dashboard(request):
         user_transactions = {
             'username': account.user.username,
             'email': account.user.email,
-            'balance': account.balance,
+            'balance': account.total_balance,
             'sent_payments': Payment.objects.filter(sender=account.user),
             'received_payments': Payment.objects.filter(recipient=account.user),
         }
@@ -408,14 +621,28 @@ def admin_dashboard(request):
 
 
 
+@login_required
+@user_passes_test(admin_required)
+def rate_service_stats(request):
+    """
+    Admin-only view returning the current rate snapshot version and, when rates
+    come from a remote service, the rate client's cache, retry and latency counters.
+    """
+    snapshot = rate_provider.snapshot()
+    client = getattr(rate_provider.source, 'client', None)
+    return JsonResponse({
+        'version': snapshot.version,
+        'remote': client.stats() if client is not None else None,
+    })
+
+
 @login_required
 def mark_all_as_read(request):
     if request.user.is_superuser:
         messages.error(request, "Unauthorized access to mark notifications!")
         return redirect('admin_dashboard')
 
-    Payment.objects.filter(recipient=request.user, read_status=False).update(read_status=True)
-    PaymentRequest.objects.filter(requestee=request.user, read_status=False).update(read_status=True)
+    mark_all_read(request.user)
 
     return JsonResponse({'status': 'success'})
 
@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import OnlineAccount
+from .models import OnlineAccount, AccountShard
 
 admin.site.register(OnlineAccount)
+admin.site.register(AccountShard)
@@ -1,4 +1,7 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Sum
 from django.contrib.auth.models import User
 
 
@@ -12,10 +15,42 @@ class OnlineAccount(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES)
     balance = models.DecimalField(max_digits=10, decimal_places=2)
+    # Above 1, credits land on one of shard_count AccountShard rows instead of this one
+    shard_count = models.PositiveSmallIntegerField(default=1)
 
     def __str__(self):
         return f"{self.user.username} - {self.currency} Account"
 
+    @property
+    def total_balance(self):
+        """
+        The account's balance including any credits still held in its shards.
+        """
+        if self.shard_count <= 1:
+            return self.balance
+        held = self.shards.aggregate(total=Sum('balance'))['total'] or 0
+        # SQLite sums decimal columns as floats.
+        return self.balance + Decimal(held).quantize(Decimal('0.01'))
+
+
+class AccountShard(models.Model):
+    """
+    One sub-balance of a sharded OnlineAccount. Incoming credits are spread
+    over the shards so they do not all update the same row; debits first fold
+    the shards back into the account's own balance.
+    """
+    account = models.ForeignKey(OnlineAccount, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'index'], name='unique_account_shard_index'),
+        ]
+
+    def __str__(self):
+        return f"Shard {self.index} of account {self.account_id}"
+
 
 User._meta.get_field('email')._unique = True
 
@@ -3,6 +3,7 @@ from .models import OnlineAccount
 from decimal import Decimal
 from django.db import IntegrityError
 from payapp.utils import fetch_exchange_rates
+from payapp.ledger import open_account
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.models import User
 from .forms import CustomAuthenticationForm
@@ -32,7 +33,7 @@ def register_user(request):
                 selected_currency = form.cleaned_data['currency']
                 baseline = 1000  # Baseline amount in GBP
 
-                # Call REST API for currency conversion
+                # Convert the baseline using the in-process rate engine
                 converted_balance = fetch_exchange_rates('GBP', selected_currency, float(baseline))
 
                 # Ensure we use the converted balance if available
@@ -41,12 +42,8 @@ def register_user(request):
                 # Ensure any old deleted account is removed before creating a new one
                 OnlineAccount.objects.filter(user=user).delete()
 
-                # Create the OnlineAccount for the new user
-                OnlineAccount.objects.create(
-                    user=user,
-                    currency=selected_currency,
-                    balance=initial_balance
-                )
+                # Create the OnlineAccount for the new user, with its opening ledger entry
+                open_account(user, selected_currency, initial_balance)
                 messages.success(request, "User registered successfully! Please log in.")
                 return redirect('login')
 
@@ -1,36 +1,330 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from thrift.Thrift import TApplicationException
 from thrift.transport import TSocket, TTransport
-from thrift.protocol import TBinaryProtocol
+from thrift.protocol import TBinaryProtocol, TCompactProtocol
 from TimestampService import TimestampService
+from circuit_breaker import CircuitBreaker
 
+logger = logging.getLogger(__name__)
 
-def get_timestamp():
+# Timestamp service location and client pool settings
+THRIFT_HOST = os.environ.get('TIMESTAMP_SERVICE_HOST', 'localhost')
+THRIFT_PORT = int(os.environ.get('TIMESTAMP_SERVICE_PORT', 10000))
+THRIFT_TIMEOUT_MS = int(os.environ.get('TIMESTAMP_SERVICE_TIMEOUT_MS', 1000))
+THRIFT_POOL_SIZE = int(os.environ.get('TIMESTAMP_SERVICE_POOL_SIZE', 8))
+# Must match the server's --transport (buffered/framed) and --protocol (binary/compact)
+THRIFT_TRANSPORT = os.environ.get('TIMESTAMP_SERVICE_TRANSPORT', 'buffered')
+THRIFT_PROTOCOL = os.environ.get('TIMESTAMP_SERVICE_PROTOCOL', 'binary')
+# Timestamps leased per getTimestamps call, and how long a lease stays usable
+THRIFT_LEASE_SIZE = int(os.environ.get('TIMESTAMP_SERVICE_LEASE_SIZE', 100))
+THRIFT_LEASE_TTL_MS = int(os.environ.get('TIMESTAMP_SERVICE_LEASE_TTL_MS', 1000))
+# Failures before switching to the local clock, and seconds between background probes
+THRIFT_FAILURE_THRESHOLD = int(os.environ.get('TIMESTAMP_SERVICE_FAILURE_THRESHOLD', 3))
+THRIFT_PROBE_INTERVAL = float(os.environ.get('TIMESTAMP_SERVICE_PROBE_INTERVAL', 5))
+
+
+TRANSPORTS = {
+    'buffered': TTransport.TBufferedTransport,
+    'framed': TTransport.TFramedTransport,
+}
+
+PROTOCOLS = {
+    'binary': TBinaryProtocol.TBinaryProtocol,
+    'compact': TCompactProtocol.TCompactProtocol,
+}
+
+
+def open_client(host, port, timeout_ms=1000, transport='buffered', protocol='binary'):
+    """
+    Opens a TimestampService client and returns (transport, client).
+    """
+    socket = TSocket.TSocket(host, port)
+    socket.setTimeout(timeout_ms)
+    client_transport = TRANSPORTS[transport](socket)
+    client = TimestampService.Client(PROTOCOLS[protocol](client_transport))
+    client_transport.open()
+    return client_transport, client
+
+
+class ThriftClientPool:
+    """
+    Thread-safe pool of open TimestampService clients.
+
+    Connections are opened lazily, at most max_size are open at once, and an
+    idle connection is health-checked before it is handed out again. A
+    connection that fails during a call is closed and dropped from the pool.
+    """
+
+    def __init__(self, host, port, max_size=8, timeout_ms=1000, transport='buffered', protocol='binary'):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.timeout_ms = timeout_ms
+        self.transport = transport
+        self.protocol = protocol
+        self._idle = []
+        self._size = 0
+        self._available = threading.Condition()
+
+    def _connect(self):
+        return open_client(self.host, self.port, self.timeout_ms, self.transport, self.protocol)
+
+    def _acquire(self):
+        """
+        Returns (transport, client, reused), waiting for a free slot if the pool is full.
+        """
+        with self._available:
+            while not self._idle and self._size >= self.max_size:
+                if not self._available.wait(timeout=self.timeout_ms / 1000.0):
+                    raise TTransport.TTransportException(
+                        TTransport.TTransportException.TIMED_OUT, "Timed out waiting for a pooled Thrift connection"
+                    )
+            if self._idle:
+                transport, client = self._idle.pop()
+                if transport.isOpen():
+                    return transport, client, True
+                # The server closed this connection; reuse its slot for a new one.
+                self._size -= 1
+            self._size += 1
+
+        try:
+            transport, client = self._connect()
+        except Exception:
+            self._discard(None)
+            raise
+        return transport, client, False
+
+    def _release(self, transport, client):
+        with self._available:
+            self._idle.append((transport, client))
+            self._available.notify()
+
+    def _discard(self, transport):
+        if transport is not None:
+            transport.close()
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Yields a pooled client and returns it to the pool afterwards.
+        The connection is dropped instead if the block raises.
+        """
+        transport, client, _ = self._acquire()
+        try:
+            yield client
+        except Exception:
+            self._discard(transport)
+            raise
+        self._release(transport, client)
+
+    def call(self, method, *args):
+        """
+        Calls a service method on a pooled client. A call that fails on a
+        reused connection is retried once on a fresh one, which covers
+        connections the server dropped while they sat idle.
+        """
+        transport, client, reused = self._acquire()
+        try:
+            result = getattr(client, method)(*args)
+        except TTransport.TTransportException:
+            self._discard(transport)
+            if not reused:
+                raise
+            with self.connection() as client:
+                return getattr(client, method)(*args)
+        except Exception:
+            self._discard(transport)
+            raise
+        self._release(transport, client)
+        return result
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._available.notify_all()
+        for transport, _ in idle:
+            transport.close()
+
+
+class TimestampLease:
+    """
+    Hands out timestamps from a block leased with getTimestamps, fetching a
+    new block when the current one runs out or is older than ttl_ms. Leased
+    timestamps are unique and strictly increasing per block, so bulk inserts
+    need one RPC per block instead of one per row.
+    """
+
+    def __init__(self, pool, size=100, ttl_ms=1000):
+        self.pool = pool
+        self.size = size
+        self.ttl_ms = ttl_ms
+        self._lock = threading.Lock()
+        self._block = deque()
+        self._expires_at = 0
+
+    def next(self):
+        """
+        Returns the next leased timestamp string. Falls back to a single
+        getTimestamp call if the server predates getTimestamps.
+        """
+        with self._lock:
+            if not self._block or time.monotonic() > self._expires_at:
+                try:
+                    block = self.pool.call('getTimestamps', self.size)
+                except TApplicationException:
+                    return self.pool.call('getTimestamp')
+                self._block = deque(block)
+                self._expires_at = time.monotonic() + self.ttl_ms / 1000.0
+            return self._block.popleft()
+
+
+class FallbackClock:
     """
-    Connects to the Apache Thrift server to fetch a timestamp.
-    Returns the timestamp as a string in the format YYYY-MM-DD HH:MM:SS
-    (compatible with Django's DateTimeField).
+    Timestamp source that falls back to a local monotonic clock while the
+    Thrift server is unreachable.
+
+    After failure_threshold consecutive failures the circuit breaker opens and
+    timestamps come from the local clock without touching the network, so
+    inserts no longer wait for a connect timeout. Local timestamps never go
+    backwards relative to the last server timestamp or to each other. A
+    background thread probes the server every probe_interval seconds and
+    closes the breaker once it answers again.
     """
-    try:
-        # Set up the transport and protocol
-        transport = TSocket.TSocket('localhost', 10000)  # Replace with the correct host/port
-        transport = TTransport.TBufferedTransport(transport)
-        protocol = TBinaryProtocol.TBinaryProtocol(transport)
+    SERVER = 'server'
+    LOCAL = 'local'
 
-        # Create a client to communicate with the Thrift server
-        client = TimestampService.Client(protocol)
+    def __init__(self, lease, breaker, probe_interval=5.0):
+        self.lease = lease
+        self.breaker = breaker
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._last = 0
+        self._probing = False
+        # A context variable rather than a thread-local, so the source also
+        # follows async tasks into the threads that run async ORM calls.
+        self._source = contextvars.ContextVar('timestamp_source', default=self.SERVER)
 
-        # Open the transport connection
-        transport.open()
+    @property
+    def last_source(self):
+        """
+        Source (SERVER or LOCAL) of the last timestamp issued in this context.
+        """
+        return self._source.get()
 
-        # Fetch the timestamp from the Thrift server
-        timestamp = client.getTimestamp()
+    @property
+    def server_available(self):
+        return self.breaker.state == CircuitBreaker.CLOSED
 
-        # Close the transport connection
-        transport.close()
+    def now(self):
+        """
+        Returns a timestamp string, from the server when it is reachable.
+        """
+        if self.server_available:
+            try:
+                timestamp = self.lease.next()
+            except Exception as e:
+                self.record_failure(e)
+            else:
+                return self.record_server(timestamp)
+        return self.local_now()
 
-        # Return the timestamp as-is
+    def record_server(self, timestamp):
+        """
+        Records a timestamp received from the server and returns it.
+        """
+        self.breaker.record_success()
+        seconds = datetime.fromisoformat(timestamp).timestamp()
+        micros = int(round(seconds * 1_000_000))
+        with self._lock:
+            self._last = max(self._last, micros)
+        self._source.set(self.SERVER)
         return timestamp
 
-    except Exception as e:
-        # Log any error and return None as a fallback
-        print(f"Thrift client error: {e}")
-        return None
+    def record_failure(self, error):
+        """
+        Counts a failed server call and starts probing once the breaker opens.
+        """
+        logger.warning("Thrift client error: %s", error)
+        self.breaker.record_failure()
+        if not self.server_available:
+            self._start_probe()
+
+    def local_now(self):
+        """
+        Returns a local timestamp that is later than every timestamp seen so far.
+        """
+        with self._lock:
+            micros = max(time.time_ns() // 1000, self._last + 1)
+            self._last = micros
+        self._source.set(self.LOCAL)
+        seconds, micro = divmod(micros, 1_000_000)
+        return datetime.fromtimestamp(seconds).replace(microsecond=micro).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    def _start_probe(self):
+        with self._lock:
+            if self._probing:
+                return
+            self._probing = True
+        threading.Thread(target=self._probe, name='timestamp-probe', daemon=True).start()
+
+    def _probe(self):
+        try:
+            while self.breaker.state != CircuitBreaker.CLOSED:
+                time.sleep(self.probe_interval)
+                try:
+                    self.lease.pool.call('getTimestamp')
+                except Exception:
+                    continue
+                self.breaker.record_success()
+        finally:
+            with self._lock:
+                self._probing = False
+
+
+_pool = ThriftClientPool(
+    THRIFT_HOST,
+    THRIFT_PORT,
+    max_size=THRIFT_POOL_SIZE,
+    timeout_ms=THRIFT_TIMEOUT_MS,
+    transport=THRIFT_TRANSPORT,
+    protocol=THRIFT_PROTOCOL,
+)
+_lease = TimestampLease(_pool, size=THRIFT_LEASE_SIZE, ttl_ms=THRIFT_LEASE_TTL_MS)
+_clock = FallbackClock(
+    _lease,
+    CircuitBreaker(failure_threshold=THRIFT_FAILURE_THRESHOLD, reset_timeout=THRIFT_PROBE_INTERVAL),
+    probe_interval=THRIFT_PROBE_INTERVAL,
+)
+
+
+def get_timestamp():
+    """
+    Returns a timestamp leased from the Apache Thrift server as a string in
+    the format YYYY-MM-DD HH:MM:SS.ffffff (compatible with Django's DateTimeField).
+    While the server is unreachable, a local monotonic timestamp is returned instead.
+    """
+    return _clock.now()
+
+
+def get_timestamp_source():
+    """
+    Returns 'server' or 'local' for the last timestamp issued in this thread
+    or async context. Used as the default of the timestamp_source model fields,
+    which Django evaluates right after the timestamp default.
+    """
+    return _clock.last_source
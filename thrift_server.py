@@ -1,25 +1,115 @@
+import argparse
 import logging
+import threading
+import time
 from datetime import datetime
 from thrift.transport import TSocket
 from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol
-from thrift.server import TServer
+from thrift.protocol import TBinaryProtocol, TCompactProtocol
+from thrift.server import TServer, TNonblockingServer
 from TimestampService import TimestampService
 
+# No forking mode: each forked child would have its own TimestampHandler._last,
+# so two connections could lease overlapping getTimestamps blocks.
+SERVER_MODES = ('simple', 'threaded', 'threadpool', 'nonblocking')
+
+TRANSPORT_FACTORIES = {
+    'buffered': TTransport.TBufferedTransportFactory,
+    'framed': TTransport.TFramedTransportFactory,
+}
+
+PROTOCOL_FACTORIES = {
+    'binary': TBinaryProtocol.TBinaryProtocolFactory,
+    'compact': TCompactProtocol.TCompactProtocolFactory,
+}
+
 class TimestampHandler:
+    # Largest block a single getTimestamps call may lease
+    MAX_BATCH = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Microseconds since the epoch of the last timestamp handed out
+        self._last = 0
+
     def getTimestamp(self):
         # Return the current datetime in the Django-compatible format
         return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    handler = TimestampHandler()
+    def getTimestamps(self, count):
+        """
+        Leases a block of count strictly increasing microsecond timestamps.
+        Like a hybrid logical clock, the block starts at the wall clock unless
+        that is not ahead of the last timestamp issued, in which case it
+        continues one microsecond after it, so no timestamp is ever repeated.
+        """
+        count = max(1, min(count or 1, self.MAX_BATCH))
+        with self._lock:
+            start = max(time.time_ns() // 1000, self._last + 1)
+            self._last = start + count - 1
+        return [self._format(micros) for micros in range(start, start + count)]
+
+    @staticmethod
+    def _format(micros):
+        seconds, micro = divmod(micros, 1_000_000)
+        return datetime.fromtimestamp(seconds).replace(microsecond=micro).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+def build_server(handler, host=None, port=10000, mode='threaded', workers=10,
+                 transport='buffered', protocol='binary'):
+    """
+    Builds a Thrift server for the timestamp handler.
+
+    simple serves one connection at a time. threaded starts a thread per
+    connection. threadpool serves at most `workers` connections at once, so it
+    should be sized for every pooled client connection. nonblocking
+    multiplexes all connections on one event loop and runs calls on
+    `workers` threads; it always uses framed transport.
+    """
     processor = TimestampService.Processor(handler)
-    transport = TSocket.TServerSocket(port=10000)
-    tfactory = TTransport.TBufferedTransportFactory()
-    pfactory = TBinaryProtocol.TBinaryProtocolFactory()
+    server_socket = TSocket.TServerSocket(host=host, port=port)
+    pfactory = PROTOCOL_FACTORIES[protocol]()
 
-    server = TServer.TSimpleServer(processor, transport, tfactory, pfactory)
-    logging.info("Starting Thrift server...")
-    server.serve()
+    if mode == 'nonblocking':
+        if transport != 'framed':
+            raise ValueError("The nonblocking server requires framed transport")
+        return TNonblockingServer.TNonblockingServer(processor, server_socket, pfactory, pfactory, threads=workers)
+
+    tfactory = TRANSPORT_FACTORIES[transport]()
+    if mode == 'simple':
+        return TServer.TSimpleServer(processor, server_socket, tfactory, pfactory)
+    if mode == 'threaded':
+        return TServer.TThreadedServer(processor, server_socket, tfactory, pfactory, daemon=True)
+    if mode == 'threadpool':
+        server = TServer.TThreadPoolServer(processor, server_socket, tfactory, pfactory, daemon=True)
+        server.setNumThreads(workers)
+        return server
+    raise ValueError(f"Unknown server mode: {mode}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Thrift timestamp server")
+    parser.add_argument('--host', default=None, help="interface to bind (default: all)")
+    parser.add_argument('--port', type=int, default=10000)
+    parser.add_argument('--server', choices=SERVER_MODES, default='threaded', help="server implementation")
+    parser.add_argument('--workers', type=int, default=10, help="worker threads for threadpool and nonblocking")
+    parser.add_argument('--transport', choices=sorted(TRANSPORT_FACTORIES), default='buffered')
+    parser.add_argument('--protocol', choices=sorted(PROTOCOL_FACTORIES), default='binary')
+    return parser.parse_args(argv)
 
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    server = build_server(
+        TimestampHandler(),
+        host=args.host,
+        port=args.port,
+        mode=args.server,
+        workers=args.workers,
+        transport=args.transport,
+        protocol=args.protocol,
+    )
+    logging.info(
+        f"Starting Thrift server ({args.server}, {args.transport}/{args.protocol}) on port {args.port}..."
+    )
+    server.serve()
@@ -84,6 +84,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'webapps2025.db',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # transfers queue on the busy timeout instead of failing with
+            # "database is locked" when upgrading a read lock.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file-backed test database; the shared in-memory one does not
+        # wait for locks, which breaks the multi-threaded transfer tests.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_webapps2025.db',
+        },
     }
 }
 
@@ -145,3 +157,29 @@ SECURE_SSL_REDIRECT = True # Forces all HTTP to redirect to HTTPS
 SESSION_COOKIE_SECURE = True  # Ensures cookies are only sent over HTTPS
 CSRF_COOKIE_SECURE = True  # Ensures CSRF cookie is only sent over HTTPS
 
+
+
+# Exchange rates: path to a JSON or CSV rate table, or the base URL of a remote
+# conversion service such as "https://rates.example.com/payapp/conversion/"
+# (None uses the built-in payapp.rates.EXCHANGE_RATES), and how many seconds
+# a loaded snapshot stays fresh.
+EXCHANGE_RATE_SOURCE = None
+EXCHANGE_RATE_TTL = 300
+
+# Remote conversion service: (connect, read) timeouts in seconds and TLS verification.
+EXCHANGE_RATE_SERVICE_TIMEOUT = (1.0, 2.0)
+EXCHANGE_RATE_SERVICE_VERIFY = True
+
+# Seconds a payment's idempotency key is remembered; expired keys are removed
+# by "python manage.py sweep_idempotency_keys".
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Seconds a new payment request stays open; requests past their expiry are
+# marked expired by "python manage.py expire_payment_requests".
+PAYMENT_REQUEST_TTL = 30 * 24 * 60 * 60
+
+# Direct payments: "sync" applies them in the request, "queued" hands them to
+# "python manage.py process_transfer_queue" (a form or API client can also send
+# mode=queued). TRANSFER_QUEUE_SHARDS is fixed once transfers have been queued.
+DIRECT_PAYMENT_MODE = 'sync'
+TRANSFER_QUEUE_SHARDS = 16